@@ -28,40 +28,161 @@ import socket
 import string
 import subprocess
 import shutil
-import requests
 import json
 import os
 import base64
 import datetime
-from baltradcrypto.crypto import keyczarcrypto 
-
-DEFAULT_HOST="http://localhost:8080"
-DEFAULT_URI="%s/BaltradDex/administrator.htm"%DEFAULT_HOST
-DEFAULT_NODE_NAME=socket.gethostname()
-DEFAULT_PRIVATE_KEY="/etc/baltrad/bltnode-keys/%s.priv"%DEFAULT_NODE_NAME
-
-try:
-  from rave_defines import DEX_SPOE
-  DEFAULT_HOST = DEX_SPOE.replace("/BaltradDex","")
-except:
-  pass
-
-try:
-  DEFAULT_URI = "%s/BaltradDex/administrator.htm"%DEFAULT_HOST
-except:
-  pass
-
-try:
-  from rave_defines import DEX_NODENAME
-  DEFAULT_NODE_NAME = DEX_NODENAME
-except:
-  pass
-
-try:
-  from rave_defines import DEX_PRIVATEKEY
-  DEFAULT_PRIVATE_KEY = DEX_PRIVATEKEY
-except:
-  pass
+
+from baltrad.config import outputs
+
+# requests and keyczarcrypto are imported when a command is sent and the
+# defaults are looked up in rave_defines when they are needed, bltcfg is
+# called often from scripts and cron so the startup time matters.
+
+# The names read from rave_defines
+RAVE_DEFINES_NAMES = ("DEX_SPOE", "DEX_NODENAME", "DEX_PRIVATEKEY")
+
+_defaults = None
+
+##
+# Reads literal top level assignments from a python file without executing it.
+# Names assigned from other literal names are resolved as well.
+# @param filename: the python file
+# @param names: the names to return
+# @return a dictionary name -> value, or None if any of the names is not assigned
+# a literal at the top level, is also assigned elsewhere, e.g. in an if or try
+# block, or may come from an import. The module has to be imported in that case.
+def read_literal_assignments(filename, names):
+  import ast
+  with open(filename, "r") as fp:
+    tree = ast.parse(fp.read(), filename)
+  known = {}
+  unresolved = set()
+  top_targets = set()
+  for node in tree.body:
+    if isinstance(node, ast.Assign):
+      targets, value = node.targets, node.value
+    elif isinstance(node, ast.AnnAssign) and node.value is not None:
+      targets, value = [node.target], node.value
+    else:
+      continue
+    for target in targets:
+      if not isinstance(target, ast.Name):
+        continue
+      top_targets.add(id(target))
+      try:
+        if isinstance(value, ast.Name) and value.id in known:
+          known[target.id] = known[value.id]
+        else:
+          known[target.id] = ast.literal_eval(value)
+        unresolved.discard(target.id)
+      except ValueError:
+        known.pop(target.id, None)
+        unresolved.add(target.id)
+
+  for node in ast.walk(tree):
+    if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store) and id(node) not in top_targets:
+      unresolved.add(node.id)
+    elif isinstance(node, (ast.Import, ast.ImportFrom)):
+      for alias in node.names:
+        if alias.name == "*":
+          return None
+        unresolved.add((alias.asname or alias.name).split(".")[0])
+
+  if unresolved.intersection(names) or [n for n in names if n not in known]:
+    return None
+  return dict([(n, known[n]) for n in names])
+
+##
+# Returns the values of RAVE_DEFINES_NAMES in rave_defines. The file is parsed
+# instead of imported and the result is cached per user, keyed by the path,
+# mtime and size of rave_defines.py. If a value is not a literal, rave_defines
+# is imported.
+# @return a dictionary name -> value, empty if rave_defines is not available
+def read_rave_defines():
+  import importlib.util
+  try:
+    spec = importlib.util.find_spec("rave_defines")
+  except (ImportError, ValueError):
+    spec = None
+  if spec is None or not spec.origin or not spec.origin.endswith(".py"):
+    return {}
+
+  st = os.stat(spec.origin)
+  key = [spec.origin, st.st_mtime_ns, st.st_size]
+  cachedir = outputs.default_cache_dir()
+  cachefile = os.path.join(cachedir, "bltcmd-defaults.json")
+  # The values decide which key signs the commands and where they are sent
+  try:
+    private = outputs.is_private(cachedir)
+  except OSError:
+    private = None
+  if private:
+    try:
+      if outputs.is_private(cachefile):
+        with open(cachefile, "r") as fp:
+          cached = json.load(fp)
+        if cached["key"] == key:
+          return cached["values"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+      pass
+
+  values = read_literal_assignments(spec.origin, RAVE_DEFINES_NAMES)
+  if values is None:
+    import rave_defines
+    values = dict([(n, getattr(rave_defines, n)) for n in RAVE_DEFINES_NAMES if hasattr(rave_defines, n)])
+
+  if private is False:
+    return values
+  try:
+    if private is None:
+      os.makedirs(cachedir, 0o700)
+    outputs.write_atomic(cachefile, json.dumps({"key":key, "values":values}), 0o600)
+  except (IOError, OSError, TypeError):
+    pass
+  return values
+
+##
+# Returns the defaults for host, uri, node name and private key. The values are
+# taken from rave_defines if it is available, otherwise from the host name.
+# @return a dictionary with the keys DEFAULT_HOST, DEFAULT_URI, DEFAULT_NODE_NAME and DEFAULT_PRIVATE_KEY
+def get_defaults():
+  global _defaults
+  if _defaults is not None:
+    return _defaults
+
+  try:
+    values = read_rave_defines()
+  except Exception:
+    logger.debug("Could not read rave_defines", exc_info=True)
+    values = {}
+
+  host = "http://localhost:8080"
+  if isinstance(values.get("DEX_SPOE"), str):
+    host = values["DEX_SPOE"].replace("/BaltradDex","")
+  nodename = values.get("DEX_NODENAME")
+  privatekey = values.get("DEX_PRIVATEKEY")
+
+  if nodename is None:
+    nodename = socket.gethostname()
+  if privatekey is None:
+    privatekey = "/etc/baltrad/bltnode-keys/%s.priv"%socket.gethostname()
+
+  _defaults = {
+    "DEFAULT_HOST":host,
+    "DEFAULT_URI":"%s/BaltradDex/administrator.htm"%host,
+    "DEFAULT_NODE_NAME":nodename,
+    "DEFAULT_PRIVATE_KEY":privatekey
+  }
+  return _defaults
+
+##
+# Keeps DEFAULT_HOST, DEFAULT_URI, DEFAULT_NODE_NAME and DEFAULT_PRIVATE_KEY
+# available as module attributes
+def __getattr__(name):
+  if name.startswith("DEFAULT_") and name in get_defaults():
+    return get_defaults()[name]
+  raise AttributeError("module %r has no attribute %r"%(__name__, name))
 
 logger = logging.getLogger("baltrad.bltcmd")
 
@@ -82,6 +203,7 @@ class bltcmd(object):
     self._uri = uri
     self._nodename = nodename
     self._privatekey=privatekey
+    from baltradcrypto.crypto import keyczarcrypto
     self._signer = keyczarcrypto.keyczar_signer.read(self._privatekey)
       
   def _generate_headers(self, message):
@@ -104,21 +226,27 @@ class bltcmd(object):
 """%(command, content)
     #print("MESSAGE=%s"%message)
     headers = self._generate_headers(message)
+    import requests
     return requests.post(self._uri, data=message, headers=headers)  
 
 def run_command(args, unknown_args):
   nodename = args.nodename
+  if nodename is None:
+    nodename = get_defaults()["DEFAULT_NODE_NAME"]
   
   unknown_args = args.servercmd
   
-  privatekey = DEFAULT_PRIVATE_KEY
-  uri = "%s/BaltradDex/administrator.htm"%args.host
-  
   if args.uri is not None:
     uri = args.uri
+  elif args.host is not None:
+    uri = "%s/BaltradDex/administrator.htm"%args.host
+  else:
+    uri = get_defaults()["DEFAULT_URI"]
 
   if args.privatekey is not None:
     privatekey = args.privatekey
+  else:
+    privatekey = get_defaults()["DEFAULT_PRIVATE_KEY"]
   
   cmd = bltcmd(nodename, privatekey, uri)
   
@@ -157,12 +285,12 @@ def run_command(args, unknown_args):
 def run():
   parser = create_argparse("Used for communicating with the dex/beast engine")
   
-  parser.add_argument("--nodename=", dest="nodename", default=DEFAULT_NODE_NAME, help="The name of the node we should present us with.")
+  parser.add_argument("--nodename=", dest="nodename", default=None, help="The name of the node we should present us with. Default is DEX_NODENAME in rave_defines or the host name.")
 
   parser.add_argument("--privatekey=", dest="privatekey", default=None, help="The name of the folder where the private key is located")
 
   parser.add_argument(
-    "--host=", dest="host", default=DEFAULT_HOST, help="The hostname uri. E.g. http://localhost:8080. /BaltradDex/administrator.htm will be appended."
+    "--host=", dest="host", default=None, help="The hostname uri. E.g. http://localhost:8080. /BaltradDex/administrator.htm will be appended. Default is taken from DEX_SPOE in rave_defines."
   )
 
   parser.add_argument(
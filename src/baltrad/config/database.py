@@ -16,11 +16,66 @@ See the GNU Lesser General Public License for more details.
 You should have received a copy of the GNU Lesser General Public License
 along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
 '''
-import sys, os, subprocess, tempfile, re
+import os, subprocess
 #import shutil
 #import jprops
+import contextlib
+import hashlib
+import time
 import psycopg2, psycopg2.extensions
-import traceback
+from baltrad.config import sqlscript
+
+# Table recording the upgrade script chunks that have been applied
+LEDGER_TABLE = "baltrad_config_ledger"
+
+# A line starting with this marker starts a new chunk in an upgrade script
+CHUNK_MARKER = "-- baltrad:chunk"
+
+_LEDGER_DDL = """CREATE TABLE IF NOT EXISTS %s (
+  script TEXT NOT NULL,
+  chunk INTEGER NOT NULL,
+  checksum CHAR(64) NOT NULL,
+  applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  PRIMARY KEY (script, checksum)
+)"""%LEDGER_TABLE
+
+##
+# Splits an upgrade script into chunks. A chunk starts at a line beginning with
+# CHUNK_MARKER, text before the first marker is a chunk of its own. A script
+# without markers is one chunk.
+# @param sql: the script
+# @return a list of (checksum, line, chunk), the checksum is the sha256 of the
+# chunk and line the line in the script where the chunk starts. A chunk with the
+# same text as an earlier chunk also hashes its occurrence so that every chunk of
+# a script has its own checksum in the ledger.
+def split_chunks(sql):
+  chunks = [(1, [])]
+  for lineno, line in enumerate(sql.splitlines(True), 1):
+    if line.startswith(CHUNK_MARKER):
+      chunks.append((lineno, []))
+    chunks[-1][1].append(line)
+  result = []
+  occurrences = {}
+  for lineno, lines in chunks:
+    chunk = "".join(lines)
+    if chunk.strip():
+      n = occurrences.get(chunk, 0) + 1
+      occurrences[chunk] = n
+      data = chunk if n == 1 else "%s\0%d"%(chunk, n)
+      result.append((hashlib.sha256(data.encode("utf-8")).hexdigest(), lineno, chunk))
+  return result
+
+##
+# The outcome of creating or upgrading the tables of one component
+#
+class component_result(object):
+  def __init__(self, name):
+    self.name = name
+    self.elapsed = 0.0
+    self.error = None
+
+  def __str__(self):
+    return "%s %.2fs %s"%(self.name, self.elapsed, "ok" if self.error is None else "FAILED")
 
 ##
 # The class that provides support for creating, upgrading and dropping all
@@ -38,11 +93,16 @@ class baltrad_database(object):
   # Constructor
   # @param prefix: bdb-binary-folder root
   # @param propertyfile: the property file used by baltrad-bdb-client
-  # @param hostname: the host name of the database
+  # @param hostname: the host name of the database, optionally with :port
   # @param dbname: the name of the database
   # @param username: the user owning the database
   # @param password: the password for the user
-  def __init__(self, propertyfile, hostname, dbname, username, password, bdbbins="/usr/bin", beast_sql="/opt/baltrad/baltrad-beast/sql", dex_sql="/opt/baltrad/baltrad-dex/sql"):
+  # @param connect_timeout: seconds to wait for a connection to the database server
+  # @param batch_size: the number of sql statements sent to the server in one call
+  # @param progress: if each statement should be printed with its execution time
+  # @param report: a sqlscript.statement_report collecting the statement times or None
+  def __init__(self, propertyfile, hostname, dbname, username, password, bdbbins="/usr/bin", beast_sql="/opt/baltrad/baltrad-beast/sql", dex_sql="/opt/baltrad/baltrad-dex/sql", connect_timeout=10,
+               batch_size=1, progress=False, report=None):
     self._propertyfile = propertyfile
     self._hostname = hostname
     self._dbname = dbname
@@ -51,57 +111,159 @@ class baltrad_database(object):
     self._bdb_binaries = bdbbins
     self._beast_sql = beast_sql
     self._dex_sql = dex_sql
+    self._connect_timeout = connect_timeout
+    self._batch_size = batch_size
+    self._progress = progress
+    self._report = report
+    self._host, self._port = hostname, "5432"
+    if hostname.find(":") > 0:
+      self._host = hostname[0:hostname.find(":")]
+      self._port = hostname[hostname.find(":")+1:]
+    self._connection = None
+    self._in_transaction = False
+
+  ##
+  # Returns the connection to the database, it is created the first time and
+  # then kept until close() is called
+  # @return the psycopg2 connection
+  def _get_connection(self):
+    if self._connection is None or self._connection.closed:
+      self._connection = psycopg2.connect(host=self._host, port=self._port, dbname=self._dbname, user=self._username, password=self._password,
+                                          connect_timeout=self._connect_timeout, keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=5)
+    return self._connection
+
+  ##
+  # Closes the connection to the database
+  def close(self):
+    if self._connection is not None:
+      self._connection.close()
+      self._connection = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
 
   ##
   # Creates the database tables
+  # @param single_transaction: if the beast and dex tables should be created in one transaction
+  # @param parallel: if bdb, beast and dex should be created at the same time, each on its own connection
+  # @return a list of component_result
   #
-  def create(self):
-    try:
-      self._create_bdb()
-    except Exception as e:
-      traceback.print_exc(e)
-    try:
-      self._create_beast()
-    except Exception as e:
-      traceback.print_exc(e)
-    try:
-      self._create_dex()
-    except Exception as e:
-      traceback.print_exc(e)
+  def create(self, single_transaction=False, parallel=False):
+    return self._run_components("create", [("bdb", "_create_bdb"), ("beast", "_create_beast"), ("dex", "_create_dex")], single_transaction, parallel)
 
   ##
   # Upgrades the database tables
+  # @param single_transaction: if the beast and dex tables should be upgraded in one transaction
+  # @param parallel: if bdb, beast and dex should be upgraded at the same time, each on its own connection
+  # @return a list of component_result
   #
-  def upgrade(self):
-    try:
-      self._upgrade_bdb()
-    except Exception as e:
-      traceback.print_exc(e)
-    try:
-      self._upgrade_beast()
-    except Exception as e:
-      traceback.print_exc(e)
+  def upgrade(self, single_transaction=False, parallel=False):
+    return self._run_components("upgrade", [("bdb", "_upgrade_bdb"), ("beast", "_upgrade_beast"), ("dex", "_upgrade_dex")], single_transaction, parallel)
+
+  ##
+  # @return a new baltrad_database with the same settings and its own connection
+  def _copy(self):
+    return baltrad_database(self._propertyfile, self._hostname, self._dbname, self._username, self._password,
+                            self._bdb_binaries, self._beast_sql, self._dex_sql, self._connect_timeout,
+                            self._batch_size, self._progress, self._report)
+
+  ##
+  # Runs the steps of all components. A failing component does not stop the
+  # others, the errors are collected and raised together when all have finished.
+  # @param operation: create or upgrade, used in messages
+  # @param components: list of (component name, method name)
+  # @param single_transaction: if the sql components should run in one transaction
+  # @param parallel: if the components should run at the same time
+  # @return a list of component_result
+  def _run_components(self, operation, components, single_transaction, parallel):
+    if single_transaction and parallel:
+      raise Exception("A single transaction can not be used when running in parallel")
+    results = [component_result(name) for name, _ in components]
+
+    def run(result, method, db):
+      starttime = time.time()
+      try:
+        getattr(db, method)()
+      except Exception as e:
+        result.error = e
+      finally:
+        result.elapsed = time.time() - starttime
+
+    starttime = time.time()
+    if parallel:
+      from baltrad.config import scheduler
+      steps = scheduler.step_scheduler(len(components))
+      for result, (_, method) in zip(results, components):
+        def step(result=result, method=method):
+          with self._copy() as db:
+            run(result, method, db)
+        steps.add(result.name, step)
+      steps.run()
+    else:
+      run(results[0], components[0][1], self)
+      with self._transaction(single_transaction, results[1:]):
+        for result, (_, method) in zip(results[1:], components[1:]):
+          run(result, method, self)
+
+    print("Database %s finished in %.2fs: %s"%(operation, time.time() - starttime, ", ".join([str(r) for r in results])))
+    failed = [r for r in results if r.error is not None]
+    if failed:
+      raise Exception("Failed to %s %s"%(operation, "; ".join(["%s: %s"%(r.name, r.error) for r in failed])))
+    return results
+
+  ##
+  # Runs the sql scripts of the block in one transaction when enabled. Each
+  # script then runs inside a savepoint so that a failing script leaves the
+  # transaction usable for reporting the other components. Everything is
+  # committed at the end, or rolled back if any of the components failed.
+  # @param enabled: if False, every script is committed on its own
+  # @param results: the component_result of the components run in the block
+  @contextlib.contextmanager
+  def _transaction(self, enabled, results=()):
+    if not enabled:
+      yield
+      return
+    self._in_transaction = True
     try:
-      self._upgrade_dex()
-    except Exception as e:
-      traceback.print_exc(e)
+      yield
+      self._in_transaction = False
+      if [r for r in results if r.error is not None]:
+        self._get_connection().rollback()
+      else:
+        self._get_connection().commit()
+    except:
+      self._in_transaction = False
+      self._get_connection().rollback()
+      raise
 
   ##
   # Updates the admin users password
   def update_admin_password(self, password):
-    connection = psycopg2.connect("host=%s dbname=%s user=%s password=%s"%(self._hostname,self._dbname,self._username,self._password))
+    connection = self._get_connection()
     try:
-      dbcursor = connection.cursor()
-      dbcursor.execute("UPDATE dex_users SET PASSWORD=MD5('"+password+"') WHERE name='admin'")
+      with connection.cursor() as dbcursor:
+        dbcursor.execute("UPDATE dex_users SET PASSWORD=MD5(%s) WHERE name='admin'", (password,))
       connection.commit()
     except psycopg2.DatabaseError as e:
-      raise Exception("Failed to run baltrad %s db scheme, e: %s"%(id, e.__str__()))
-    finally:
-      if dbcursor:
-        dbcursor.close()
-      if connection:
-        connection.close()
-    
+      connection.rollback()
+      raise Exception("Failed to update admin password, e: %s"%e.__str__())
+
+  ##
+  # Reads a setting from the database server
+  # @param name: the name of the setting, e.g. max_connections
+  # @return the value as a string
+  def show_setting(self, name):
+    connection = self._get_connection()
+    with connection.cursor() as dbcursor:
+      dbcursor.execute("SHOW %s"%name)
+      value = dbcursor.fetchone()[0]
+    if not self._in_transaction:
+      connection.rollback()
+    return value
+
   ##
   # Creates the bdb tables
   def _create_bdb(self):
@@ -128,7 +290,7 @@ class baltrad_database(object):
   ##
   # Upgrades the beast tables
   def _upgrade_beast(self):
-    self._run_sql_script("%s/upgrade_db.sql"%self._beast_sql, "upgrade beast")
+    self._run_migrations("%s/upgrade_db.sql"%self._beast_sql, "beast", "upgrade beast")
 
   ##
   # Creates the dex tables
@@ -139,29 +301,117 @@ class baltrad_database(object):
   ##
   # Upgrades the dex tables 
   def _upgrade_dex(self):
-    self._run_sql_script("%s/upgrade_dex_schema.sql"%self._dex_sql, "upgrade dex")
+    self._run_migrations("%s/upgrade_dex_schema.sql"%self._dex_sql, "dex", "upgrade dex")
   
+  ##
+  # Runs the chunks of an upgrade script that are not in the ledger. Each chunk
+  # is recorded in the ledger in the same transaction as it is run, so a chunk
+  # is run again only if it is changed or was not completed.
+  # @param scriptname: The filename of the sql script
+  # @param component: beast or dex, the ledger entries are named component/basename
+  # @param id: The id to be used in the error messages
+  def _run_migrations(self, scriptname, component, id):
+    with open(scriptname, 'r') as fp:
+      chunks = split_chunks(fp.read())
+    script = "%s/%s"%(component, os.path.basename(scriptname))
+    applied = self._applied_chunks(script)
+    count = 0
+    for i, (checksum, lineno, chunk) in enumerate(chunks):
+      if checksum in applied:
+        continue
+      def record(dbcursor, i=i, checksum=checksum):
+        dbcursor.execute("INSERT INTO " + LEDGER_TABLE + " (script, chunk, checksum) VALUES (%s, %s, %s)", (script, i + 1, checksum))
+      self._execute_sql(chunk.splitlines(True), scriptname, "%s chunk %d"%(id, i + 1), record, lineno)
+      count = count + 1
+    print("Applied %d of %d chunk(s) of %s"%(count, len(chunks), script))
+
+  ##
+  # Creates the ledger if it does not exist
+  # @param script: the ledger name of the script
+  # @return the checksums of the applied chunks of the script
+  def _applied_chunks(self, script):
+    connection = self._get_connection()
+    try:
+      with connection.cursor() as dbcursor:
+        if self._in_transaction:
+          dbcursor.execute("SAVEPOINT baltrad_ledger")
+        try:
+          # Serializes the creation of the ledger when components are upgraded in parallel
+          dbcursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (LEDGER_TABLE,))
+          dbcursor.execute(_LEDGER_DDL)
+          dbcursor.execute("SELECT checksum FROM " + LEDGER_TABLE + " WHERE script = %s", (script,))
+          applied = set([row[0] for row in dbcursor.fetchall()])
+        except Exception:
+          if self._in_transaction:
+            dbcursor.execute("ROLLBACK TO SAVEPOINT baltrad_ledger")
+          raise
+        if self._in_transaction:
+          dbcursor.execute("RELEASE SAVEPOINT baltrad_ledger")
+      if not self._in_transaction:
+        connection.commit()
+    except psycopg2.DatabaseError as e:
+      if not self._in_transaction:
+        connection.rollback()
+      raise Exception("Failed to read the %s table, e: %s"%(LEDGER_TABLE, e.__str__()))
+    except Exception:
+      if not self._in_transaction:
+        connection.rollback()
+      raise
+    return applied
+
   ##
   # Runs the specified sql script. The id is just used for identifying what is beeing run
   # @param scriptname: The filename of the sql script to be executed
   # @param id: The id to be used in the error messages
   def _run_sql_script(self, scriptname, id):
-    sql = open(scriptname, 'r').read()
-    hostname=self._hostname
-    portnr="5432"
-    if self._hostname.find(":") > 0:
-      hostname = self._hostname[0:self._hostname.find(":")]
-      portnr = self._hostname[self._hostname.find(":")+1:]
-      
-    connection = psycopg2.connect("host=%s port=%s dbname=%s user=%s password=%s"%(hostname,portnr,self._dbname,self._username,self._password))
+    with open(scriptname, 'r') as fp:
+      self._execute_sql(fp, scriptname, id)
+
+  ##
+  # Runs sql statement by statement, or in batches of batch_size statements, in
+  # one transaction, or savepoint when in a transaction.
+  # @param lines: an iterable of sql lines, read while the statements are run
+  # @param scriptname: the script the lines are read from, used in messages
+  # @param id: The id to be used in the error messages
+  # @param record: function (cursor) called in the same transaction after the sql, or None
+  # @param firstline: the line number in the script of the first line
+  def _execute_sql(self, lines, scriptname, id, record=None, firstline=1):
+    connection = self._get_connection()
+    batch = None
     try:
-      dbcursor = connection.cursor()
-      dbcursor.execute(sql)
-      connection.commit()
+      with connection.cursor() as dbcursor:
+        if self._in_transaction:
+          dbcursor.execute("SAVEPOINT baltrad_script")
+        try:
+          for batch in sqlscript.batches(sqlscript.split_statements(lines, firstline), self._batch_size):
+            starttime = time.time()
+            sqlscript.execute_batch(dbcursor, batch)
+            elapsed = time.time() - starttime
+            if self._progress:
+              print("  %8.3fs %s:%d %s"%(elapsed, os.path.basename(scriptname), batch[0].line, batch[0].summary()))
+            if self._report is not None:
+              self._report.add(scriptname, batch, elapsed)
+          batch = None
+          if record is not None:
+            record(dbcursor)
+        except Exception:
+          # The lines are read while the statements run, so reading the script
+          # can fail after some of them have been executed
+          if self._in_transaction:
+            dbcursor.execute("ROLLBACK TO SAVEPOINT baltrad_script")
+          raise
+        if self._in_transaction:
+          dbcursor.execute("RELEASE SAVEPOINT baltrad_script")
+      if not self._in_transaction:
+        connection.commit()
     except psycopg2.DatabaseError as e:
-      raise Exception("Failed to run baltrad %s db scheme, e: %s"%(id, e.__str__()))
-    finally:
-      if dbcursor:
-        dbcursor.close()
-      if connection:
-        connection.close()
+      if not self._in_transaction:
+        connection.rollback()
+      where = ""
+      if batch is not None:
+        where = " at %s:%d (%s)"%(scriptname, batch[0].line, batch[0].summary())
+      raise Exception("Failed to run baltrad %s db scheme%s, e: %s"%(id, where, e.__str__()))
+    except Exception:
+      if not self._in_transaction:
+        connection.rollback()
+      raise
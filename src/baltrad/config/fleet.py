@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import concurrent.futures
+import os
+
+from baltrad.config import outputs
+from baltrad.config import propertyhandler
+
+##
+# The files that are read and modified instead of generated from scratch. They
+# are read from the source files given to render_fleet.
+#
+class fleet_sources(object):
+  ##
+  # Constructor
+  # @param dexfile: the dex.properties to use as source or None
+  # @param appcontextfile: the applicationContext.xml to use as source or None
+  # @param ravedefinesfile: the rave_defines.py to use as source or None
+  # @param bltnodefile: the location of bltnode.properties on the nodes, written into rave_defines.py
+  def __init__(self, dexfile=None, appcontextfile=None, ravedefinesfile=None, bltnodefile="/etc/baltrad/bltnode.properties"):
+    self.dexfile = dexfile
+    self.appcontextfile = appcontextfile
+    self.ravedefinesfile = ravedefinesfile
+    self.bltnodefile = bltnodefile
+
+##
+# @param overlay: the overlay file of a node
+# @return the name of the node directory, the overlay file name without extension
+def node_directory_name(overlay):
+  name = os.path.basename(overlay)
+  if name.endswith(".properties"):
+    name = name[:-len(".properties")]
+  return name
+
+##
+# Creates the list of files generated for one node
+# @param a: the propertyhandler
+# @param nodedir: the directory the files should be written to
+# @param sources: the fleet_sources
+# @return a list of outputs.output_file
+def create_node_outputs(a, nodedir, sources):
+  j = lambda name: os.path.join(nodedir, name)
+  files = [
+    outputs.output_file(j("bltnode.properties"), a.render_bltnode_properties),
+    outputs.output_file(j("db.properties"), a.render_dex_db_properties),
+    outputs.output_file(j("dex.fc.properties"), a.render_dex_fc_properties),
+    outputs.output_file(j("dex.beast.properties"), a.render_dex_beast_properties),
+    outputs.output_file(j("server.xml"), a.render_tomcat_server_file),
+    # The memory of the node is not known here, sizes that are not set are left to the JVM
+    outputs.output_file(j("setenv.sh"), a.render_tomcat_setenv)
+  ]
+  if sources.dexfile:
+    files.append(outputs.output_file(j("dex.properties"), lambda: a.render_dex_properties(sources.dexfile)))
+  if sources.appcontextfile:
+    files.append(outputs.output_file(j("applicationContext.xml"), lambda: a.render_application_context(sources.appcontextfile)))
+  if sources.ravedefinesfile and a.with_rave:
+    files.append(outputs.output_file(j("rave_defines.py"), lambda: a.render_rave_defines(sources.ravedefinesfile, sources.bltnodefile), 0o664))
+  return files
+
+##
+# Renders all files for one node. Runs in a worker process.
+# @param base: the base property file
+# @param overlay: the property file with the node specific values
+# @param outdir: the directory where the node directory is created
+# @param sources: the fleet_sources
+# @return a tuple (node name, node directory, number of files, keys of unset tomcat memory sizes)
+def render_node(base, overlay, outdir, sources):
+  a = propertyhandler.propertyhandler()
+  a.open_config_file(base, [overlay])
+  nodedir = os.path.join(outdir, node_directory_name(overlay))
+  if not os.path.isdir(nodedir):
+    os.makedirs(nodedir)
+  files = create_node_outputs(a, nodedir, sources)
+  outputs.output_writer(files).run()
+  return (a.nodename, nodedir, len(files), a.unset_tomcat_memory_keys())
+
+##
+# Renders the files of all nodes in parallel.
+# @param base: the base property file shared by all nodes
+# @param overlays: one property file per node
+# @param outdir: the directory where one directory per node is created
+# @param sources: the fleet_sources
+# @param max_workers: the number of worker processes, None for one per cpu
+# @return a list of (node name, node directory, number of files, keys of unset tomcat memory sizes)
+def render_fleet(base, overlays, outdir, sources, max_workers=None):
+  names = {}
+  for overlay in overlays:
+    name = node_directory_name(overlay)
+    if name in names:
+      raise Exception("Overlays %s and %s would both be written to %s"%(names[name], overlay, name))
+    names[name] = overlay
+
+  if not os.path.isdir(outdir):
+    os.makedirs(outdir)
+
+  n = len(overlays)
+  with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+    chunksize = max(1, n // (4 * (max_workers or os.cpu_count() or 1)))
+    return list(executor.map(render_node, [base]*n, overlays, [outdir]*n, [sources]*n, chunksize=chunksize))
@@ -30,9 +30,12 @@ import shutil
 import pwd, grp
 
 from baltrad.config import propertyhandler
-from baltrad.config import database
+from baltrad.config import outputs
+from baltrad.config import scheduler
+from baltrad.config import tune
 
-from baltradcrypto.crypto import keyczarcrypto
+# database (psycopg2), fleet (multiprocessing) and keyczarcrypto are imported by
+# the functions that use them so that subcommands not needing them start faster.
 
 if sys.version_info < (3,):
   import urlparse
@@ -100,6 +103,7 @@ def create_priv_pub_keys(keys_root, nodename):
   if not os.path.exists(pub_nodekey):
     os.makedirs(pub_nodekey)
 
+    from baltradcrypto.crypto import keyczarcrypto
     keyczar_signer = keyczarcrypto.create_keyczar_key()
     keyczar_verifier = keyczarcrypto.keyczar_verifier(keyczar_signer._key)
         
@@ -165,12 +169,13 @@ def execute_createkeys(args):
 
   create_priv_pub_keys(a.keystore_root, a.nodename)
     
+  changed = ["keystore_pwd"] if forced_storage else []
   if args.keystore_jks is not None or args.keys_root is not None:
     x = read_input("Specified keystore root and/or keystore file as argument. Update property file %s  (y/n)? "%args.conf)
     if x == "y":
-      a.write_config_file(args.conf)
+      a.patch_config_file(args.conf, changed + ["keystore_root", "keystore_jks"])
   elif forced_storage:
-    a.write_config_file(args.conf)
+    a.patch_config_file(args.conf, changed)
 
 def get_current_user():
   return pwd.getpwuid(os.getuid())[0]
@@ -181,76 +186,243 @@ def change_mod(fname, mod):
   if c_uid == 0 or f_uid == c_uid:
     os.chown(fname, mod)
 
+##
+# @param a: the propertyhandler
+# @return the (uid, gid) the written files should be owned by, (None, None) if not running as root
+def get_owner(a):
+  if get_current_user() == "root":
+    return (pwd.getpwnam(a.baltrad_user).pw_uid, grp.getgrnam(a.baltrad_group).gr_gid)
+  return (None, None)
+
+##
+# Creates the list of files that should be generated by the setup
+# @param a: the propertyhandler
+# @param args: the setup arguments
+# @return a list of outputs.output_file
+def create_setup_outputs(a, args):
+  files = [
+    outputs.output_file(args.bltnodefile, a.render_bltnode_properties),
+    outputs.output_file(args.dexfile, lambda: a.render_dex_properties(args.dexfile)),
+    outputs.output_file(args.dexdbfile, a.render_dex_db_properties),
+    outputs.output_file(args.dexfcfile, a.render_dex_fc_properties),
+    outputs.output_file(args.dexbeastfile, a.render_dex_beast_properties),
+    outputs.output_file(args.tomcatserverfile, a.render_tomcat_server_file, on_change=a.backup_tomcat_server_file),
+    outputs.output_file(args.appcontextfile, lambda: a.render_application_context(args.appcontextfile)),
+    outputs.output_file(args.tomcatsetenvfile or os.path.join(os.path.dirname(args.tomcatserverfile), "setenv.sh"), lambda: a.render_tomcat_setenv(tune.host_resources.detect()))
+  ]
+  if not args.no_rave_config:
+    files.append(outputs.output_file(args.ravedefinesfile, lambda: a.render_rave_defines(args.ravedefinesfile, args.bltnodefile), 0o664))
+  return files
+
+##
+# Verifies that the node does not use more database connections than the server allows
+# @param a: the propertyhandler
+# @param args: the setup arguments
+def check_connection_budget(a, args):
+  max_connections, reserved = None, 3
+  if args.check_db_connections:
+    from baltrad.config import database
+    with database.baltrad_database(args.bltnodefile, a.db_hostname, a.db_dbname, a.db_username, a.db_password) as db:
+      max_connections = int(db.show_setting("max_connections"))
+      reserved = int(db.show_setting("superuser_reserved_connections"))
+  budget = a.analyze_connection_budget(max_connections, reserved)
+  if budget.is_oversubscribed():
+    print(str(budget))
+    raise Exception("The configuration needs more database connections than the database server allows")
+  return budget
+
 def execute_post_config(args):
   a=propertyhandler.propertyhandler()
   a.open_config_file(args.conf)
-  
-  a.write_bltnode_properties(args.bltnodefile)
-  a.write_dex_properties(args.dexfile)
-  a.write_dex_db_properties(args.dexdbfile)
-  a.write_dex_fc_properties(args.dexfcfile)
-  a.write_dex_beast_properties(args.dexbeastfile)
-  a.write_tomcat_server_file(args.tomcatserverfile)
-  a.update_application_context(args.appcontextfile)
-  if not args.no_rave_config:
-    a.update_rave_defines(args.ravedefinesfile, args.bltnodefile)
 
-  # Change owner to root:baltrad
-  uid = pwd.getpwnam("root").pw_uid
-  baltrad_uid = pwd.getpwnam(a.baltrad_user).pw_uid
-  baltrad_gid = grp.getgrnam(a.baltrad_group).gr_gid
-  if get_current_user() == "root":
-    os.chown(args.bltnodefile, baltrad_uid, baltrad_gid)
-    os.chown(args.dexfile, baltrad_uid, baltrad_gid)
-    os.chown(args.dexdbfile, baltrad_uid, baltrad_gid)
-    os.chown(args.dexfcfile, baltrad_uid, baltrad_gid)
-    os.chown(args.dexbeastfile, baltrad_uid, baltrad_gid)
-    os.chown(args.tomcatserverfile, baltrad_uid, baltrad_gid)
-    os.chown(args.appcontextfile, baltrad_uid, baltrad_gid)
-    
-    if not args.no_rave_config:
-      os.chown(args.ravedefinesfile, baltrad_uid, baltrad_gid)
+  check_connection_budget(a, args)
 
-  else:
-    print("WARNING! Could not change ownership of configuration files:")
-    print("%s"%args.bltnodefile)
-    print("%s"%args.dexfile)
-    print("%s"%args.dexdbfile)
-    print("%s"%args.dexfcfile)
-    print("%s"%args.dexbeastfile)
-    print("%s"%args.tomcatserverfile)
-    print("%s"%args.appcontextfile)
-    if not args.no_rave_config:
-      print("%s"%args.ravedefinesfile)
-
-  os.chmod(args.bltnodefile, 0o660)
-  os.chmod(args.dexfile, 0o660)
-  os.chmod(args.dexdbfile, 0o660)
-  os.chmod(args.dexfcfile, 0o660)
-  os.chmod(args.dexbeastfile, 0o660)
-  os.chmod(args.tomcatserverfile, 0o660)
-  os.chmod(args.appcontextfile, 0o660)
+  state = None
+  if args.incremental:
+    state = outputs.output_state(args.statefile)
+
+  uid, gid = get_owner(a)
+
+  # Every output is rendered in its own step, the database is installed when
+  # bltnode.properties has been written and the scripts run last.
+  steps = scheduler.step_scheduler(args.jobs)
+  writer = outputs.output_writer(create_setup_outputs(a, args), state, uid, gid)
+  last_step = writer.add_steps(steps, "write outputs")
 
-  if not args.no_rave_config:
-    os.chmod(args.ravedefinesfile, 0o664)
-  
   if args.install_database or args.update_database:
-    db = database.baltrad_database(args.bltnodefile, a.db_hostname, a.db_dbname, a.db_username, a.db_password, a.bdb_binaries, a.beast_sql_file_dir, a.dex_sql_file_dir)
-    if args.install_database:
-      db.create()
-    if args.update_database:
-      db.upgrade()
+    steps.add("database", lambda: execute_database_setup(a, args), [last_step])
+    last_step = "database"
 
   if args.run_scripts:
-    execute_post_config_scripts(a, args.conf)
-  
+    steps.add("scripts", lambda: execute_post_config_scripts(a, args.conf), [last_step])
+
+  try:
+    steps.run()
+  finally:
+    writer.rollback()
+    writer.notify_changes()
+
+  if writer.written and uid is None:
+    print("WARNING! Could not change ownership of configuration files:")
+    for f, _ in writer.written:
+      print("%s"%f.path)
+
+  if state is not None:
+    print("Wrote %d file(s), skipped %d unchanged file(s)"%(len(writer.written), len(writer.skipped)))
+
+def execute_database_setup(a, args):
+  from baltrad.config import database, sqlscript
+  report = sqlscript.statement_report() if args.sql_report else None
+  try:
+    with database.baltrad_database(args.bltnodefile, a.db_hostname, a.db_dbname, a.db_username, a.db_password, a.bdb_binaries, a.beast_sql_file_dir, a.dex_sql_file_dir,
+                                   batch_size=args.sql_batch_size, progress=args.sql_progress, report=report) as db:
+      if args.install_database:
+        db.create(args.single_transaction, args.parallel_database)
+      if args.update_database:
+        db.upgrade(args.single_transaction, args.parallel_database)
+  finally:
+    if report is not None:
+      report.write(args.sql_report)
+      print("Wrote sql statement report to %s"%args.sql_report)
+
+def execute_fleet(args):
+  from baltrad.config import fleet
+  sources = fleet.fleet_sources(args.dexfile, args.appcontextfile, None if args.no_rave_config else args.ravedefinesfile, args.bltnodefile)
+  result = fleet.render_fleet(args.conf, args.overlays, args.outdir, sources, args.jobs)
+  for nodename, nodedir, nfiles, unset in result:
+    print("%s: %d file(s) written to %s"%(nodename, nfiles, nodedir))
+    if unset:
+      print("WARNING! %s not set for %s, setenv.sh leaves them to the JVM defaults. Run baltrad-config tune on the node to set them."%(", ".join(unset), nodename))
+
+##
+# Writes the setup outputs and keeps them up to date with the configuration file
+# @param args: the watch arguments
+def execute_watch(args):
+  from baltrad.config import watch
+  logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s", level=logging.INFO)
+  watcher = watch.output_watcher(args.conf, lambda a: create_setup_outputs(a, args), get_owner)
+  try:
+    watch.run(watcher, watch.create_waiter(args.poll_interval))
+  except KeyboardInterrupt:
+    pass
+
+##
+# Proposes pool sizes for the host and updates the configuration file
+# @param args: the tune arguments
+def execute_tune(args):
+  a=propertyhandler.propertyhandler()
+  a.open_config_file(args.conf)
+
+  res = tune.host_resources.detect()
+  print("Host: %s"%", ".join(res.notes))
+  print("")
+  tunings = tune.propose(res, a)
+  tunings.extend(tune.propose_tomcat_memory(tune.apply_tunings(a, tunings), res))
+  for t in tunings:
+    current = getattr(a, t.attribute)
+    print("%s = %s  (currently %s)"%(t.key(), t.text(), current))
+    print("    %s"%t.reason)
+
+  if args.dry_run:
+    return
+  tune.patch_config_file(args.conf, tunings)
+  print("")
+  print("Updated %s"%args.conf)
+
+##
+# Writes a postgresql include file with server settings computed from the
+# host memory, the connection pools and the bdb storage type
+# @param args: the dbtune arguments
+def execute_dbtune(args):
+  write = args.outfile is not None and not args.dry_run
+  if not write and not args.dry_run and not args.verify:
+    raise Exception("dbtune needs --outfile= unless --dry-run or --verify is given")
+
+  a=propertyhandler.propertyhandler()
+  a.open_config_file(args.conf)
+
+  res = tune.host_resources.detect()
+  print("Host: %s"%", ".join(res.notes))
+  if a.db_hostname.split(":")[0] not in ["localhost", "127.0.0.1", "::1"]:
+    print("WARNING! The database is on %s, the settings are computed from the memory of this host"%a.db_hostname)
+  print("")
+  settings = tune.propose_postgresql(a, res)
+  for p in settings:
+    print("%s = %s"%(p.name, p.value))
+    print("    %s"%p.reason)
+
+  if write:
+    outputs.write_atomic(args.outfile, tune.render_postgresql_conf(settings))
+    print("")
+    print("Wrote %s, reload or restart postgresql to apply the settings"%args.outfile)
+
+  if args.verify:
+    from baltrad.config import database
+    with database.baltrad_database(None, a.db_hostname, a.db_dbname, a.db_username, a.db_password) as db:
+      differs = tune.verify_postgresql(settings, db.show_setting)
+    print("")
+    for p, current in differs:
+      print("%s is %s, expected %s"%(p.name, current, p.value))
+    if differs:
+      raise Exception("%d postgresql setting(s) differ from the proposed values"%len(differs))
+    print("All postgresql settings have the proposed values")
+
+##
+# Runs the post config scripts, see postconfig.run_post_config_scripts
+# @param ph: the propertyhandler
+# @param configfile: the configuration file
 def execute_post_config_scripts(ph, configfile):
-  for script in ph.post_config_scripts:
-    code = subprocess.call([sys.executable, script, configfile])
-    if code != 0:
-      print("Failed to run post script: %s"%script)
+  from baltrad.config import postconfig
+  postconfig.run_post_config_scripts(ph, configfile)
 
-def run():
+##
+# Adds the arguments for the locations of the files written by the setup
+# @param parser: the argument parser
+def add_output_arguments(parser):
+  parser.add_argument(
+    "--bltnodefile=", dest="bltnodefile", default="/etc/baltrad/bltnode.properties", help="Where the properties for bltnode should be written"
+  )
+
+  parser.add_argument(
+    "--dexfile=", dest="dexfile", default="/etc/baltrad/dex.properties", help="Where the properties for dex should be written"
+  )
+
+  parser.add_argument(
+    "--dexdbfile=", dest="dexdbfile", default="/etc/baltrad/db.properties", help="Where the properties for dex db should be written"
+  )
+
+  parser.add_argument(
+    "--dexfcfile=", dest="dexfcfile", default="/etc/baltrad/dex.fc.properties", help="Where the properties for dex fc should be written"
+  )
+
+  parser.add_argument(
+    "--dexbeastfile=", dest="dexbeastfile", default="/etc/baltrad/dex.beast.properties", help="Where the properties for dex beast should be written"
+  )
+  
+  parser.add_argument(
+    "--ravedefinesfile=", dest="ravedefinesfile", default="/etc/baltrad/rave/Lib/rave_defines.py", help="Where rave_defines.py is located"
+  )
+  
+  parser.add_argument(
+    "--tomcatserverfile=", dest="tomcatserverfile", default="/etc/baltrad/baltrad-node-tomcat/server.xml", help="Where the tomcat server.xml file is located"
+  )
+
+  parser.add_argument(
+    "--tomcatsetenvfile=", dest="tomcatsetenvfile", default=None, help="Where the tomcat setenv.sh file should be written, default is next to the server.xml file"
+  )
+  
+  parser.add_argument(
+    "--appcontextfile=", dest="appcontextfile", default="/var/lib/baltrad/baltrad-node-tomcat/webapps/BaltradDex/WEB-INF/applicationContext.xml", help="Where the application context file is located"
+  )
+  
+  parser.add_argument(
+    "--no-rave-config", dest="no_rave_config", action="store_true", help="if rave defines file should be updated",
+  )
+
+##
+# Creates the parser for the command line, each command sets func to the function that executes it
+# @return the argument parser
+def create_parser():
   parser = create_argparse("Creates initial configuration for the baltrad node packages")
 
   subparsers = parser.add_subparsers(help='the allowed commands')
@@ -258,6 +430,10 @@ def run():
   parser_init = subparsers.add_parser('init', help='creates initial configuration')
   parser_createkeys = subparsers.add_parser('create_keys', help='creates the key structure')
   parser_setup = subparsers.add_parser('setup', help='runs the setup of a node')
+  parser_tune = subparsers.add_parser('tune', help='proposes pool sizes from the cpu and memory of the host')
+  parser_dbtune = subparsers.add_parser('dbtune', help='writes postgresql server settings for the node')
+  parser_watch = subparsers.add_parser('watch', help='writes the setup outputs each time the configuration changes')
+  parser_fleet = subparsers.add_parser('fleet', help='renders the configuration of many nodes from one base configuration')
 
   parser_init.add_argument(
     "--conf=", dest="conf", default="/etc/baltrad/localhost.properties", help="the name of the configuration file to be created"
@@ -271,54 +447,126 @@ def run():
     "--conf=", dest="conf", default="/etc/baltrad/localhost.properties", help="the name of the configuration file to be read"
   )
 
+  add_output_arguments(parser_setup)
+
   parser_setup.add_argument(
-    "--bltnodefile=", dest="bltnodefile", default="/etc/baltrad/bltnode.properties", help="Where the properties for bltnode should be written"
+    "--install-database", dest="install_database", action="store_true", help="if the database install routines should be executed"
   )
 
   parser_setup.add_argument(
-    "--dexfile=", dest="dexfile", default="/etc/baltrad/dex.properties", help="Where the properties for dex should be written"
+    "--upgrade-database", dest="update_database", action="store_true", help="if the database upgrade routines should be executed"
   )
-
+  
   parser_setup.add_argument(
-    "--dexdbfile=", dest="dexdbfile", default="/etc/baltrad/db.properties", help="Where the properties for dex db should be written"
+    "--single-transaction", dest="single_transaction", action="store_true", help="install or upgrade the beast and dex tables in one database transaction"
   )
 
   parser_setup.add_argument(
-    "--dexfcfile=", dest="dexfcfile", default="/etc/baltrad/dex.fc.properties", help="Where the properties for dex fc should be written"
+    "--parallel-database", dest="parallel_database", action="store_true", help="install or upgrade the bdb, beast and dex tables at the same time, each on its own connection"
   )
 
   parser_setup.add_argument(
-    "--dexbeastfile=", dest="dexbeastfile", default="/etc/baltrad/dex.beast.properties", help="Where the properties for dex beast should be written"
+    "--sql-batch-size=", dest="sql_batch_size", type=int, default=1, help="the number of sql statements sent to the database server in one call, default 1"
   )
-  
+
   parser_setup.add_argument(
-    "--ravedefinesfile=", dest="ravedefinesfile", default="/etc/baltrad/rave/Lib/rave_defines.py", help="Where rave_defines.py is located"
+    "--sql-progress", dest="sql_progress", action="store_true", help="print each sql statement with its execution time"
   )
-  
+
   parser_setup.add_argument(
-    "--tomcatserverfile=", dest="tomcatserverfile", default="/etc/baltrad/baltrad-node-tomcat/server.xml", help="Where the tomcat server.xml file is located"
+    "--sql-report=", dest="sql_report", default=None, help="write the slowest sql statements and the time per script to this file"
   )
-  
+
   parser_setup.add_argument(
-    "--appcontextfile=", dest="appcontextfile", default="/var/lib/baltrad/baltrad-node-tomcat/webapps/BaltradDex/WEB-INF/applicationContext.xml", help="Where the application context file is located"
-  )
-  
+    "--runscripts", dest="run_scripts", action="store_true", help="if the scripts should be executed")
+
   parser_setup.add_argument(
-    "--no-rave-config", dest="no_rave_config", action="store_true", help="if rave defines file should be updated",
+    "--check-db-connections", dest="check_db_connections", action="store_true", help="read max_connections from the database server and verify that the configured pools fit"
   )
-  
+
   parser_setup.add_argument(
-    "--install-database", dest="install_database", action="store_true", help="if the database install routines should be executed"
+    "--jobs=", dest="jobs", type=int, default=8, help="the maximum number of setup steps running at the same time"
   )
 
   parser_setup.add_argument(
-    "--upgrade-database", dest="update_database", action="store_true", help="if the database upgrade routines should be executed"
+    "--incremental", dest="incremental", action="store_true", help="only write the files whose content has changed since the last setup"
   )
-  
+
   parser_setup.add_argument(
-    "--runscripts", dest="run_scripts", action="store_true", help="if the scripts should be executed")
+    "--statefile=", dest="statefile", default="/var/lib/baltrad/baltrad-config.state", help="where the content hashes are kept when running with --incremental"
+  )
   
   
+  parser_watch.add_argument(
+    "--conf=", dest="conf", default="/etc/baltrad/localhost.properties", help="the name of the configuration file to watch"
+  )
+
+  add_output_arguments(parser_watch)
+
+  parser_watch.add_argument(
+    "--poll-interval=", dest="poll_interval", type=float, default=None, help="check the configuration every N seconds instead of using inotify"
+  )
+
+  parser_tune.add_argument(
+    "--conf=", dest="conf", default="/etc/baltrad/localhost.properties", help="the configuration file to update"
+  )
+
+  parser_tune.add_argument(
+    "--dry-run", dest="dry_run", action="store_true", help="only print the proposed values"
+  )
+
+  parser_dbtune.add_argument(
+    "--conf=", dest="conf", default="/etc/baltrad/localhost.properties", help="the name of the configuration file to be read"
+  )
+
+  parser_dbtune.add_argument(
+    "--outfile=", dest="outfile", default=None, help="the include file to write, e.g. a file in the conf.d directory of the postgresql cluster. Required unless --dry-run or --verify is given"
+  )
+
+  parser_dbtune.add_argument(
+    "--dry-run", dest="dry_run", action="store_true", help="only print the proposed values"
+  )
+
+  parser_dbtune.add_argument(
+    "--verify", dest="verify", action="store_true", help="compare the proposed values with the running server using SHOW"
+  )
+
+  parser_fleet.add_argument(
+    "--conf=", dest="conf", default="/etc/baltrad/localhost.properties", help="the base configuration shared by all nodes"
+  )
+
+  parser_fleet.add_argument(
+    "--outdir=", dest="outdir", required=True, help="where one directory per node should be created"
+  )
+
+  parser_fleet.add_argument(
+    "--dexfile=", dest="dexfile", default="/etc/baltrad/dex.properties", help="the dex.properties file used as source"
+  )
+
+  parser_fleet.add_argument(
+    "--ravedefinesfile=", dest="ravedefinesfile", default="/etc/baltrad/rave/Lib/rave_defines.py", help="the rave_defines.py file used as source"
+  )
+
+  parser_fleet.add_argument(
+    "--appcontextfile=", dest="appcontextfile", default="/var/lib/baltrad/baltrad-node-tomcat/webapps/BaltradDex/WEB-INF/applicationContext.xml", help="the application context file used as source"
+  )
+
+  parser_fleet.add_argument(
+    "--bltnodefile=", dest="bltnodefile", default="/etc/baltrad/bltnode.properties", help="where bltnode.properties is located on the nodes"
+  )
+
+  parser_fleet.add_argument(
+    "--no-rave-config", dest="no_rave_config", action="store_true", help="if rave_defines.py should not be generated"
+  )
+
+  parser_fleet.add_argument(
+    "--jobs=", dest="jobs", type=int, default=None, help="the number of worker processes, default is one per cpu"
+  )
+
+  parser_fleet.add_argument(
+    "overlays", nargs="+", help="one property file per node with the values that differ from the base configuration"
+  )
+
   parser_createkeys.add_argument(
     "--conf=", dest="conf", default="/etc/baltrad/localhost.properties", help="the name of the configuration file to be created"
   )
@@ -340,9 +588,16 @@ def run():
   
   parser_init.set_defaults(func=create_initial_config)
   parser_setup.set_defaults(func=execute_post_config)
+  parser_fleet.set_defaults(func=execute_fleet)
+  parser_watch.set_defaults(func=execute_watch)
+  parser_tune.set_defaults(func=execute_tune)
+  parser_dbtune.set_defaults(func=execute_dbtune)
   parser_createkeys.set_defaults(func=execute_createkeys)
   
-  args = parser.parse_args()
+  return parser
+
+def run():
+  args = create_parser().parse_args()
   
   args.func(args)
   
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+# The umask of the process, used as default permissions for new files
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+##
+# @param content: the content as a string
+# @return the sha256 hex digest of the content
+def content_digest(content):
+  return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+##
+# @return the per user directory for cached data, $XDG_CACHE_HOME/baltrad-config
+def default_cache_dir():
+  base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+  return os.path.join(base, "baltrad-config")
+
+##
+# Cached data is only trusted if it cannot have been written by another user
+# @param path: a file or directory
+# @return True if path is owned by the current user and not writable by others
+def is_private(path):
+  st = os.lstat(path)
+  return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+##
+# An output file generated by the setup.
+#
+class output_file(object):
+  ##
+  # Constructor
+  # @param path: the file that should be written
+  # @param render: function returning the new content of the file
+  # @param mode: the file permissions to set after the file has been written
+  # @param on_change: if set, the file is only written when the content differs from
+  # the current file and on_change(path, original, content) is called once it has
+  # been replaced, see output_writer.notify_changes
+  def __init__(self, path, render, mode=0o660, on_change=None):
+    self.path = path
+    self.render = render
+    self.mode = mode
+    self.on_change = on_change
+
+##
+# Writes a number of files so that either all or none of them are replaced.
+# Every file is written to a temporary file in the same directory as the
+# target. On commit the temporary files are renamed into place and each
+# affected directory is synced once. If anything fails, the files that already
+# have been replaced are restored and the remaining temporary files removed.
+#
+class output_transaction(object):
+  def __init__(self):
+    self._pending = []
+    self._lock = threading.Lock()
+
+  ##
+  # Writes the content to a temporary file that will replace path on commit. Can be
+  # called from several threads.
+  # @param path: the target file
+  # @param content: the content
+  # @param mode: the file permissions, if None the permissions of the current file are kept
+  # @param uid: the owner, if None the owner of the current file is kept
+  # @param gid: the group, if None the group of the current file is kept
+  def write(self, path, content, mode=None, uid=None, gid=None):
+    path = os.path.abspath(path)
+    (fd, tmpname) = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".%s."%os.path.basename(path))
+    try:
+      with os.fdopen(fd, "w") as fp:
+        fp.write(content)
+        fp.flush()
+        os.fsync(fp.fileno())
+      current = os.stat(path) if os.path.exists(path) else None
+      if mode is None:
+        mode = current.st_mode & 0o7777 if current is not None else 0o666 & ~_UMASK
+      if uid is not None and gid is not None:
+        os.chown(tmpname, uid, gid)
+      elif current is not None:
+        _keep_owner(tmpname, current, uid, gid)
+      os.chmod(tmpname, mode)
+    except:
+      os.unlink(tmpname)
+      raise
+    with self._lock:
+      self._pending.append((path, tmpname))
+
+  ##
+  # Renames all temporary files into place. The previous files are kept as hard
+  # links until all renames have succeeded so that they can be restored.
+  def commit(self):
+    replaced = []
+    backups = []
+    try:
+      for path, tmpname in self._pending:
+        backup = None
+        if os.path.exists(path):
+          backup = "%s.bak"%tmpname
+          backups.append(backup)
+          try:
+            os.link(path, backup)
+          except OSError:
+            shutil.copy2(path, backup)
+        os.rename(tmpname, path)
+        replaced.append((path, backup))
+      for dirname in set([os.path.dirname(path) for path, _ in self._pending]):
+        _fsync_directory(dirname)
+    except:
+      for path, backup in reversed(replaced):
+        if backup is not None:
+          os.rename(backup, path)
+        else:
+          os.unlink(path)
+      for backup in backups:
+        if os.path.exists(backup):
+          os.unlink(backup)
+      self.rollback()
+      raise
+
+    for _, backup in replaced:
+      if backup is not None:
+        os.unlink(backup)
+    self._pending = []
+
+  ##
+  # Removes all temporary files without touching the targets
+  def rollback(self):
+    for _, tmpname in self._pending:
+      if os.path.exists(tmpname):
+        os.unlink(tmpname)
+    self._pending = []
+
+##
+# Renders a list of output files and replaces them in one output_transaction.
+# Rendering and writing of the temporary files can be split into one step per
+# file in a step_scheduler, followed by one commit step. notify_changes is then
+# called on the main thread.
+#
+class output_writer(object):
+  ##
+  # Constructor
+  # @param files: a list of output_file
+  # @param state: an output_state used for skipping unchanged files or None
+  # @param uid: the owner of the written files or None
+  # @param gid: the group of the written files or None
+  def __init__(self, files, state=None, uid=None, gid=None):
+    self.files = files
+    self.state = state
+    self.uid = uid
+    self.gid = gid
+    self.written = []
+    self.skipped = []
+    self._changes = []
+    self._committed_changes = []
+    self._tx = output_transaction()
+    self._lock = threading.Lock()
+
+  ##
+  # Renders one file and writes it to a temporary file unless it is unchanged
+  # @param f: the output_file
+  def prepare(self, f):
+    content = f.render()
+    digest = content_digest(content)
+    if self.state is not None and self.state.is_unchanged(f.path, digest):
+      with self._lock:
+        self.skipped.append(f)
+      return
+    if f.on_change is not None:
+      with open(f.path) as fp:
+        original = fp.read()
+      if original == content:
+        with self._lock:
+          self.skipped.append(f)
+        return
+      with self._lock:
+        self._changes.append((f, original, content))
+    self._tx.write(f.path, content, f.mode, self.uid, self.gid)
+    with self._lock:
+      self.written.append((f, digest))
+
+  ##
+  # Replaces all prepared files and updates the state
+  def commit(self):
+    self._tx.commit()
+    self._committed_changes = self._changes
+    self._changes = []
+    if self.state is not None:
+      for f, digest in self.written:
+        self.state.update(f.path, digest)
+      self.state.save()
+
+  ##
+  # Removes the temporary files of all prepared files
+  def rollback(self):
+    self._tx.rollback()
+    self._changes = []
+
+  ##
+  # Calls on_change for the replaced files. Call it from the main thread when
+  # the commit step has run, so that nothing is reported for files that were
+  # never replaced and the output of the callbacks is not interleaved.
+  def notify_changes(self):
+    changes, self._committed_changes = self._committed_changes, []
+    for f, original, content in changes:
+      f.on_change(f.path, original, content)
+
+  ##
+  # Adds one step per file and a commit step to a step_scheduler
+  # @param scheduler: the step_scheduler
+  # @param name: the name of the commit step
+  # @return the name of the commit step
+  def add_steps(self, scheduler, name="commit"):
+    depends = []
+    for f in self.files:
+      scheduler.add("render %s"%f.path, lambda f=f: self.prepare(f))
+      depends.append("render %s"%f.path)
+    scheduler.add(name, self.commit, depends)
+    return name
+
+  ##
+  # Renders and replaces all files without a scheduler
+  def run(self):
+    try:
+      for f in self.files:
+        self.prepare(f)
+      self.commit()
+    except:
+      self.rollback()
+      raise
+    self.notify_changes()
+
+##
+# Atomically replaces a single file
+# @param path: the file
+# @param content: the content
+# @param mode: the file permissions, if None the permissions of the current file are kept
+def write_atomic(path, content, mode=None):
+  tx = output_transaction()
+  tx.write(path, content, mode)
+  tx.commit()
+
+##
+# Gives a new file the owner and group of the file it replaces, like writing
+# the file in place would. Only root can give away a file, for other users the
+# ownership is left as it is.
+# @param tmpname: the new file
+# @param current: the os.stat of the replaced file
+# @param uid: the owner or None for the owner of the replaced file
+# @param gid: the group or None for the group of the replaced file
+def _keep_owner(tmpname, current, uid, gid):
+  uid = current.st_uid if uid is None else uid
+  gid = current.st_gid if gid is None else gid
+  st = os.stat(tmpname)
+  if (st.st_uid, st.st_gid) == (uid, gid):
+    return
+  try:
+    os.chown(tmpname, uid, gid)
+  except PermissionError:
+    pass
+
+def _fsync_directory(dirname):
+  fd = os.open(dirname, os.O_RDONLY)
+  try:
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+##
+# Keeps track of the content hash of every file written by the setup so that
+# files whose content has not changed can be left untouched.
+#
+class output_state(object):
+  ##
+  # Constructor
+  # @param statefile: the file where the state is kept between runs
+  def __init__(self, statefile):
+    self._statefile = statefile
+    self._entries = {}
+    if os.path.exists(statefile):
+      with open(statefile, "r") as fp:
+        self._entries = json.load(fp)
+
+  ##
+  # Checks if the file already has the content with the specified digest. If the
+  # file has been modified since it was recorded, the content on disk is hashed
+  # instead of trusting the recorded digest.
+  # @param path: the file
+  # @param digest: the digest of the new content
+  # @return True if the file already contains the content
+  def is_unchanged(self, path, digest):
+    try:
+      st = os.stat(path)
+    except OSError:
+      return False
+    entry = self._entries.get(path)
+    if entry is not None and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+      return entry["sha256"] == digest
+
+    with open(path, "rb") as fp:
+      current = hashlib.sha256(fp.read()).hexdigest()
+    if current == digest:
+      self._entries[path] = {"sha256":digest, "size":st.st_size, "mtime":st.st_mtime_ns}
+      return True
+    return False
+
+  ##
+  # Records the digest of the file as it currently is on disk
+  # @param path: the file
+  # @param digest: the digest of the content that was written
+  def update(self, path, digest):
+    st = os.stat(path)
+    self._entries[path] = {"sha256":digest, "size":st.st_size, "mtime":st.st_mtime_ns}
+
+  ##
+  # Saves the state
+  def save(self):
+    dirname = os.path.dirname(self._statefile)
+    if dirname and not os.path.exists(dirname):
+      os.makedirs(dirname)
+    write_atomic(self._statefile, json.dumps(self._entries, indent=2, sort_keys=True), 0o600)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import ast
+import hashlib
+import importlib
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+# Entry point group where packages can register post config functions
+ENTRY_POINT_GROUP = "baltrad.config.post_config"
+
+# The function a post config script defines to be run in-process
+FUNCTION_NAME = "post_config"
+
+##
+# @param filename: a python script
+# @return True if the script defines a top level post_config function
+def defines_post_config(filename):
+  with open(filename, "r") as fp:
+    tree = ast.parse(fp.read(), filename)
+  for node in tree.body:
+    if isinstance(node, ast.FunctionDef) and node.name == FUNCTION_NAME:
+      return True
+  return False
+
+def _load_file_function(filename):
+  name = "baltrad_post_config_%s"%hashlib.sha256(os.path.abspath(filename).encode("utf-8")).hexdigest()[:16]
+  spec = importlib.util.spec_from_file_location(name, filename)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return getattr(module, FUNCTION_NAME)
+
+def _load_entry_point(name):
+  from importlib import metadata
+  eps = metadata.entry_points()
+  if hasattr(eps, "select"):
+    eps = eps.select(group=ENTRY_POINT_GROUP)
+  else:
+    eps = eps.get(ENTRY_POINT_GROUP, [])
+  for ep in eps:
+    if ep.name == name:
+      return ep.load()
+  return None
+
+##
+# Finds the function to call in-process for a post config script.
+# A script can be specified as
+# - the path of a python file. If it defines post_config(ph) that function is
+#   called, otherwise the file is run with the python interpreter.
+# - module:function, the function is imported and called
+# - the name of an entry point in the group baltrad.config.post_config
+# @param script: the value of baltrad.post.config.script.N
+# @return a function taking the propertyhandler or None if the script should be run as a subprocess
+def load_plugin(script):
+  if os.path.isfile(script):
+    if defines_post_config(script):
+      return _load_file_function(script)
+    return None
+  if ":" in script:
+    modulename, funcname = script.split(":", 1)
+    return getattr(importlib.import_module(modulename), funcname)
+  func = _load_entry_point(script)
+  if func is None:
+    raise Exception("Post config script %s is neither a file, module:function nor a %s entry point"%(script, ENTRY_POINT_GROUP))
+  return func
+
+##
+# The outcome of one post config script
+#
+class script_result(object):
+  ##
+  # Constructor
+  # @param index: the number N of baltrad.post.config.script.N
+  # @param script: the script
+  def __init__(self, index, script):
+    self.index = index
+    self.script = script
+    self.mode = "-"
+    self.status = "skipped"
+    self.exitcode = None
+    self.elapsed = 0.0
+    self.output = ""
+
+def _format_exception(e):
+  return "".join(traceback.format_exception(type(e), e, e.__traceback__))
+
+def _run_plugin(plugin, ph, timeout, result):
+  result.mode = "in-process"
+  errors = []
+  def call():
+    try:
+      plugin(ph)
+    except Exception as e:
+      errors.append(e)
+  if timeout is None:
+    call()
+  else:
+    # A function can not be interrupted, it is left running in the background
+    t = threading.Thread(target=call, daemon=True)
+    t.start()
+    t.join(timeout)
+    if t.is_alive():
+      result.status = "timeout"
+      result.output = "Still running after %g seconds\n"%timeout
+      return
+  if errors:
+    result.status, result.exitcode, result.output = "failed", 1, _format_exception(errors[0])
+  else:
+    result.status, result.exitcode = "ok", 0
+
+def _run_subprocess(script, resolvedfile, env, timeout, result):
+  result.mode = "subprocess"
+  try:
+    p = subprocess.run([sys.executable, script, resolvedfile], env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+    result.exitcode = p.returncode
+    result.output = p.stdout.decode("utf-8", "replace")
+    result.status = "ok" if p.returncode == 0 else "failed"
+  except subprocess.TimeoutExpired as e:
+    result.status = "timeout"
+    result.output = (e.output or b"").decode("utf-8", "replace") + "Killed after %g seconds\n"%timeout
+
+##
+# Runs the post config scripts. Scripts that provide a post_config function are
+# called in-process with the propertyhandler. Other scripts are run with the
+# python interpreter and get a property file with the resolved properties as
+# argument, includes and ${...} references are already expanded. The original
+# configuration file is available in the environment variable BALTRAD_CONFIG_FILE.
+#
+# Up to ph.post_config_workers scripts run at the same time, a script is started
+# when the scripts it depends on have succeeded and skipped if any of them failed.
+# The output of subprocess scripts is captured and printed in the summary.
+# @param ph: the propertyhandler
+# @param configfile: the configuration file
+# @return a list of script_result
+def run_post_config_scripts(ph, configfile):
+  if not ph.post_config_scripts:
+    return []
+  from baltrad.config import scheduler
+
+  results = []
+  plugins = []
+  for i, script in enumerate(ph.post_config_scripts):
+    results.append(script_result(i + 1, script))
+    try:
+      plugins.append(load_plugin(script))
+    except Exception as e:
+      plugins.append(e)
+
+  resolvedfile = None
+  if None in plugins:
+    (fd, resolvedfile) = tempfile.mkstemp(suffix=".properties")
+    os.close(fd)
+    ph.write_resolved_properties(resolvedfile)
+  env = dict(os.environ, BALTRAD_CONFIG_FILE=os.path.abspath(configfile))
+
+  def run_script(i):
+    result = results[i]
+    depends = ph.post_config_script_depends[i] if i < len(ph.post_config_script_depends) else ()
+    timeout = ph.post_config_script_timeouts[i] if i < len(ph.post_config_script_timeouts) else None
+    for d in depends:
+      if results[d - 1].status != "ok":
+        result.output = "Script %d did not succeed\n"%d
+        return
+    starttime = time.time()
+    try:
+      if isinstance(plugins[i], Exception):
+        result.status, result.exitcode, result.output = "failed", 1, "%s\n"%plugins[i]
+      elif plugins[i] is not None:
+        _run_plugin(plugins[i], ph, timeout, result)
+      else:
+        _run_subprocess(result.script, resolvedfile, env, timeout, result)
+    finally:
+      result.elapsed = time.time() - starttime
+
+  steps = scheduler.step_scheduler(ph.post_config_workers)
+  for i in range(len(results)):
+    depends = ph.post_config_script_depends[i] if i < len(ph.post_config_script_depends) else ()
+    steps.add("script %d"%(i + 1), lambda i=i: run_script(i), ["script %d"%d for d in depends])
+
+  starttime = time.time()
+  try:
+    steps.run()
+  finally:
+    if resolvedfile is not None:
+      os.unlink(resolvedfile)
+  print_summary(results, time.time() - starttime)
+  return results
+
+##
+# Prints the status, exit code, wall time and output of each script
+# @param results: a list of script_result
+# @param elapsed: the total wall time
+def print_summary(results, elapsed):
+  print("Post config scripts finished in %.2fs:"%elapsed)
+  for r in results:
+    exitcode = "-" if r.exitcode is None else "%d"%r.exitcode
+    print("  %2d %-8s %-10s exit %-4s %8.2fs  %s"%(r.index, r.status, r.mode, exitcode, r.elapsed, r.script))
+  for r in results:
+    if r.output:
+      print("")
+      print("Output of script %d (%s):"%(r.index, r.script))
+      for line in r.output.splitlines():
+        print("  %s"%line)
+  failed = [r for r in results if r.status != "ok"]
+  if failed:
+    print("")
+    print("Failed to run post script(s): %s"%", ".join([r.script for r in failed]))
@@ -20,606 +20,771 @@ along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import socket
 import baltradutils.jprops
-import tempfile
-import re
 import os
+import re
 import shutil
 import time
-import difflib
+import hashlib
+import tempfile
+
+from baltrad.config import outputs
+from baltrad.config import rewriter
+
+##
+# Converters used for translating between the textual representation in the
+# property file and the python value kept in the propertyhandler. Each type
+# maps to a (parse, format, placeholder) tuple where None means that the value
+# can be used as is.
+_TRUE_VALUES = frozenset(("true", "1", "yes", "y", "t"))
+
+def _parse_bool(s):
+  return s is not None and s.lower() in _TRUE_VALUES
+
+def _format_bool(v):
+  return "true" if v else "false"
+
+def _parse_int_or_none(s):
+  if s is None or s == "None":
+    return None
+  try:
+    return int(s)
+  except:
+    return None
+
+def _format_int_or_none(v):
+  if v is None:
+    return "None"
+  return "%d"%v
+
+_CONVERTERS = {
+  "str": (None, None, "%s"),
+  "int": (int, None, "%d"),
+  "bool": (_parse_bool, _format_bool, "%s"),
+  "int_or_none": (_parse_int_or_none, _format_int_or_none, "%s")
+}
+
+##
+# Describes one property in the configuration file and how it maps to the
+# propertyhandler.
+#
+class property_definition(object):
+  ##
+  # Constructor
+  # @param key: the property name in the configuration file
+  # @param attribute: the attribute name in the propertyhandler
+  # @param ptype: the type of the value, one of str, int, bool or int_or_none
+  # @param default: the default value. If callable, it is called with the propertyhandler
+  # @param required: if the property must be present in the configuration file
+  # @param comment: text written before the property when serializing
+  # @param separator: the separator between key and value when serializing
+  # @param disabled: if the property should be written commented out
+  def __init__(self, key, attribute, ptype="str", default=None, required=False, comment=None, separator=" = ", disabled=False):
+    self.key = key
+    self.attribute = attribute
+    self.ptype = ptype
+    self.default = default
+    self.required = required
+    self.comment = comment
+    self.separator = separator
+    self.disabled = disabled
+    self.parse, self.format, placeholder = _CONVERTERS[ptype]
+    self.template = "%s%s%s%s%s\n"%(comment or "", "#" if disabled else "", key, separator, placeholder)
+
+_p = property_definition
+
+##
+# All properties that are handled by the propertyhandler in the order they are
+# written to the configuration file.
+PROPERTIES = (
+  _p("baltrad.with.rave", "with_rave", "bool", True, required=True,
+     comment="\n# General configuration settings\n"
+             "# Specifies if rave is installed or not (true, false).\n"
+             "# Used to know if rave_defines.py should be configured or not.\n"),
+  _p("baltrad.user", "baltrad_user", default="baltrad", comment="\n"),
+  _p("baltrad.group", "baltrad_group", default="baltrad"),
+
+  _p("baltrad.db.username", "db_username", default="baltrad", required=True, comment="\n\n# postgres database specifics\n"),
+  _p("baltrad.db.password", "db_password", default="baltrad", required=True),
+  _p("baltrad.db.hostname", "db_hostname", default="localhost", required=True),
+  _p("baltrad.db.dbname", "db_dbname", default="baltrad", required=True),
+  _p("baltrad.db.pool.size", "db_pool_size", "int", 10),
+  _p("baltrad.db.max_connections", "db_max_connections", "int_or_none", None),
+
+  _p("baltrad.node.name", "nodename", default=lambda ph: socket.gethostname(), required=True, comment="\n"),
+  _p("baltrad.node.address", "nodeaddress", default="http://127.0.0.1:8080", required=True),
+  _p("baltrad.keyczar.root", "keystore_root", default="/etc/baltrad/bltnode-keys", required=True),
+  _p("baltrad.keystore.jks", "keystore_jks", default=lambda ph: "%s/keystore.jks"%ph.keystore_root, required=True),
+  _p("baltrad.keystore.password", "keystore_pwd", default="secret"),
+
+  _p("baltrad.ajp.connector.enabled", "ajp_connector_enabled", "bool", False),
+  _p("baltrad.ajp.connector.secret_required", "ajp_connector_secret_required", "bool", False),
+  _p("baltrad.ajp.connector.secret", "ajp_connector_secret", default=""),
+  _p("baltrad.ajp.connector.address", "ajp_connector_address", default="::1"),
+  _p("baltrad.ajp.connector.port", "ajp_connector_port", "int", 8009),
+  _p("baltrad.ajp.connector.redirect_port", "ajp_connector_redirectPort", "int", 8443),
+
+  _p("baltrad.tomcat.executor.max_threads", "tomcat_executor_max_threads", "int", 200,
+     comment="\n"
+             "# Thread pool shared by the tomcat 8080 and 8443 connectors and connector limits\n"
+             "# keepalive_timeout is in milliseconds, compression is one of off, on, force\n"),
+  _p("baltrad.tomcat.executor.min_spare_threads", "tomcat_executor_min_spare_threads", "int", 10),
+  _p("baltrad.tomcat.connector.accept_count", "tomcat_connector_accept_count", "int", 100),
+  _p("baltrad.tomcat.connector.max_connections", "tomcat_connector_max_connections", "int", 8192),
+  _p("baltrad.tomcat.connector.keepalive_timeout", "tomcat_connector_keepalive_timeout", "int", 20000),
+  _p("baltrad.tomcat.connector.max_keepalive_requests", "tomcat_connector_max_keepalive_requests", "int", 100),
+  _p("baltrad.tomcat.connector.compression", "tomcat_connector_compression", default="off"),
+  _p("baltrad.tomcat.connector.compression_min_size", "tomcat_connector_compression_min_size", "int", 2048),
+  _p("baltrad.tomcat.connector.compressible_mime_type", "tomcat_connector_compressible_mime_type",
+     default="text/html,text/xml,text/plain,text/css,text/javascript,application/javascript,application/json,application/xml"),
+
+  _p("baltrad.tomcat.jvm.heap_min", "tomcat_jvm_heap_min", default="",
+     comment="\n"
+             "# JVM settings written to the tomcat setenv.sh. Sizes are given as for the JVM, e.g. 2048m or 4g.\n"
+             "# Empty heap and direct memory sizes are derived from the host memory and the pool sizes.\n"
+             "# gc is the name of the collector, e.g. G1, Parallel or Z\n"),
+  _p("baltrad.tomcat.jvm.heap_max", "tomcat_jvm_heap_max", default=""),
+  _p("baltrad.tomcat.jvm.gc", "tomcat_jvm_gc", default="G1"),
+  _p("baltrad.tomcat.jvm.max_gc_pause_millis", "tomcat_jvm_max_gc_pause_millis", "int_or_none", 200),
+  _p("baltrad.tomcat.jvm.max_direct_memory", "tomcat_jvm_max_direct_memory", default=""),
+  _p("baltrad.tomcat.jvm.extra_options", "tomcat_jvm_extra_options", default=""),
+
+  _p("baltrad.extra.fwd.port", "extra_fwd_port", default="", separator="=",
+     comment="\n"
+             "# If there is some sort of forwarding to the node which remaps for example port 80 to 8080 and 443 to 8443.\n"
+             "# Then add, from-port and to port like baltrad.extra.fwd.port=80,443\n"),
+
+  _p("baltrad.dex.uri", "dex_uri", default="http://localhost:8080/BaltradDex", required=True, comment="\n"),
+  _p("baltrad.db.jdbc.prepare_threshold", "prepare_threshold", "int", -1, required=True),
+
+  _p("beast.sql.file.dir", "beast_sql_file_dir", default="/usr/share/baltrad/baltrad-beast/sql", required=True, separator="=",
+     comment="\n# dex & beast database script locations\n"),
+  _p("dex.sql.file.dir", "dex_sql_file_dir", default="/usr/share/baltrad/baltrad-dex/sql", required=True, separator="="),
+  _p("bdb.binaries", "bdb_binaries", default="/usr/bin", required=True, separator="="),
+
+  _p("baltrad.bdb.server.type", "bdb_server_type", default="cherrypy", required=True,
+     comment="\n\n#BDB settings\n#baltrad.bdb.server.type = werkzeug\n"),
+  _p("baltrad.bdb.server.cherrypy.threads", "bdb_server_cherrypy_threads", "int", 10, required=True),
+  _p("baltrad.bdb.server.cherrypy.backlog", "bdb_server_cherrypy_backlog", "int", 5, required=True),
+  _p("baltrad.bdb.server.cherrypy.timeout", "bdb_server_cherrypy_timeout", "int", 10, required=True),
+  _p("baltrad.bdb.server.uri", "bdb_server_uri", default="http://localhost:8090", required=True),
+  _p("baltrad.bdb.server.backend.type", "bdb_server_backend_type", default="sqla", required=True),
+  _p("baltrad.bdb.server.backend.sqla.pool_size", "bdb_server_backend_sqla_pool_size", "int", 10, required=True),
+  _p("baltrad.bdb.server.log.level", "bdb_server_log_level", default="INFO", required=True),
+  _p("baltrad.bdb.server.log.type", "bdb_server_log_type", default="logfile", required=True),
+  _p("baltrad.bdb.server.log.file", "bdb_server_log_file", default="/var/log/baltrad/baltrad-bdb-server.log"),
+  _p("baltrad.bdb.server.log.id", "bdb_server_log_id", default="baltrad-bdb-server", required=True),
+  _p("baltrad.bdb.server.backend.sqla.storage.type", "bdb_server_backend_sqla_storage_type", default="db", required=True,
+     comment="#baltrad.bdb.server.backend.sqla.storage.type = fs\n"),
+  _p("baltrad.bdb.server.backend.sqla.storage.fs.path", "bdb_server_backend_sqla_storage_fs_path", default="/var/lib/baltrad/bdb_storage", required=True),
+  _p("baltrad.bdb.server.backend.sqla.storage.fs.layers", "bdb_server_backend_fs_layers", "int", 3),
+  _p("baltrad.bdb.server.backend.sqla.storage.db.cachesize", "bdb_server_backend_cachesize", "int", 5000),
+  _p("baltrad.bdb.server.auth.providers", "bdb_server_auth_providers", default="noauth, keyczar", required=True),
+
+  _p("baltrad.bdb.client.rest.maxconnections", "bdb_client_rest_maxconnections", "int", 20, comment="\n"),
+  _p("baltrad.bdb.client.rest.cachesize", "bdb_client_rest_cachesize", "int", 7000),
+
+  _p("baltrad.framepublisher.min_poolsize", "baltrad_framepublisher_min_poolsize", "int", 1, comment="\n"),
+  _p("baltrad.framepublisher.max_poolsize", "baltrad_framepublisher_max_poolsize", "int", 5),
+  _p("baltrad.framepublisher.queuesize", "baltrad_framepublisher_queuesize", "int", 100),
+
+  _p("beast.admin.mailer.enabled", "beast_admin_mailer_enabled", "bool", False, comment="\n#BEAST settings\n"),
+  _p("beast.admin.mailer.encoding", "beast_admin_mailer_encoding", default="UTF-8"),
+  _p("beast.admin.mailer.host", "beast_admin_mailer_host", default="localhost"),
+  _p("beast.admin.mailer.port", "beast_admin_mailer_port", "int", 25),
+  _p("beast.admin.mailer.username", "beast_admin_mailer_username", default=""),
+  _p("beast.admin.mailer.password", "beast_admin_mailer_password", default=""),
+  _p("beast.admin.mailer.from", "beast_admin_mailer_from", default=""),
+  _p("beast.admin.mailer.transport.protocol", "beast_admin_mailer_transport_protocol", default="smtp"),
+  _p("beast.admin.mailer.smtp.auth", "beast_admin_mailer_smtp_auth", "bool", False),
+  _p("beast.admin.mailer.smtp.starttls.enable", "beast_admin_mailer_smtp_starttls_enable", "bool", False),
+
+  _p("beast.cli.administration.enabled", "beast_cli_administration_enabled", "bool", False, comment="\n"),
+
+  _p("beast.pooled.publisher.pool.core.size", "beast_pooled_publisher_pool_core_size", "int", 1, comment="\n#BEAST exchange pool settings\n"),
+  _p("beast.pooled.publisher.pool.max.size", "beast_pooled_publisher_pool_max_size", "int", 5),
+  _p("beast.pooled.publisher.queue.size", "beast_pooled_publisher_queue_size", "int", 100),
+
+  _p("beast.manager.number.executors", "beast_manager_number_executors", "int", 10, comment="\n#BEAST message manager settings\n"),
+
+  _p("rave.ctpath", "rave_ctpath", default="", separator="=", disabled=True, comment="\n"),
+  _p("rave.pgfs", "rave_pgfs", default="4", separator="="),
+  _p("rave.pgf.tasks.per.worker", "rave_pgf_tasks_per_worker", "int_or_none", None, separator="="),
+  _p("rave.loglevel", "rave_loglevel", default="info", separator="="),
+  _p("rave.logid", "rave_logid", default=lambda ph: "'PGF[rave.%s]'"%ph.nodename, separator="="),
+  _p("rave.centerid", "rave_centerid", default="ORG:82", separator="="),
+  _p("rave.qitotalmethod", "rave_qitotalmethod", default="minimum", separator="="),
+  _p("rave.scansunout", "rave_scansun_out_path", default="", separator="="),
+  _p("rave.pgf.compositing.use_lazy_loading", "rave_pgf_compositing_use_lazy_loading", default=False, separator="="),
+  _p("rave.pgf.compositing.use_lazy_loading_preloads", "rave_pgf_compositing_use_lazy_loading_preloads", default=False, separator="="),
+
+  _p("rave.pgf.tiledcompositing.nrprocesses", "rave_pgf_tiledcompositing_nrprocesses", "int_or_none", None, separator="="),
+  _p("rave.pgf.tiledcompositing.timeout", "rave_pgf_tiledcompositing_timeout", "int", 290, separator="="),
+  _p("rave.pgf.tiledcompositing.allow_missing_tiles", "rave_pgf_tiledcompositing_allow_missing_tiles", "bool", False, separator="="),
+)
+
+del _p
+
+##
+# Translates property values into attributes
+# @param properties: dictionary of key -> value
+# @return dictionary of attribute -> value for the keys present in properties
+# @raise KeyError: if a required key is missing
+def _parse_properties(properties):
+  values = {}
+  for attribute, key, parse, required in _PARSE_TABLE:
+    if key in properties:
+      value = properties[key]
+      values[attribute] = value if parse is None else parse(value)
+    elif required:
+      raise KeyError(key)
+  return values
+
+# The attributes of the tomcat memory sizes, derived from the host when empty
+_TOMCAT_MEMORY_ATTRIBUTES = ("tomcat_jvm_heap_min", "tomcat_jvm_heap_max", "tomcat_jvm_max_direct_memory")
+
+# Precomputed tables used by the parse and serialize passes
+_PARSE_TABLE = tuple((p.attribute, p.key, p.parse, p.required) for p in PROPERTIES)
+_FORMAT_TABLE = tuple((p.template, p.attribute, p.format) for p in PROPERTIES)
+
+POST_CONFIG_SCRIPT_KEY = "baltrad.post.config.script.%d"
+POST_CONFIG_SCRIPT_DEPENDS_KEY = "baltrad.post.config.script.%d.depends"
+POST_CONFIG_SCRIPT_TIMEOUT_KEY = "baltrad.post.config.script.%d.timeout"
+POST_CONFIG_WORKERS_KEY = "baltrad.post.config.workers"
+
+# Comma separated list of property files that are loaded before the file
+# containing the key. Relative names are relative to the including file.
+INCLUDE_KEY = "baltrad.include"
+
+_REFERENCE_PATTERN = re.compile(r"\$\{([^}]+)\}")
+
+##
+# Resolves ${key} references in the property values. Each value is resolved
+# once and references to keys that are not defined are kept as they are.
+# @param properties: dictionary of key -> raw value
+# @return dictionary of key -> resolved value
+# @raise Exception: if the references are cyclic
+def resolve_properties(properties):
+  resolved = {}
+  path = []
+  active = set()
+
+  def resolve(key):
+    if key in resolved:
+      return resolved[key]
+    if key in active:
+      raise Exception("Cyclic property reference: %s"%" -> ".join(path[path.index(key):] + [key]))
+    value = properties[key]
+    if "${" in value:
+      path.append(key)
+      active.add(key)
+      value = _REFERENCE_PATTERN.sub(lambda m: resolve(m.group(1)) if m.group(1) in properties else m.group(0), value)
+      active.discard(key)
+      path.pop()
+    resolved[key] = value
+    return value
+
+  if "${" not in "\0".join(properties.values()):
+    return dict(properties)
+  for key in properties:
+    if "${" in properties[key]:
+      resolve(key)
+  result = dict(properties)
+  result.update(resolved)
+  return result
+
+##
+# Escapes a key or value so that it can be written to a property file
+def _escape_property(s, is_key=False):
+  s = s.replace("\\", "\\\\").replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t")
+  if is_key:
+    s = s.replace(" ", "\\ ").replace("=", "\\=").replace(":", "\\:")
+  elif s.startswith(" "):
+    s = "\\" + s
+  return s
+
+##
+# Writes a dictionary of properties to a file object
+# @param fp: the file object
+# @param properties: dictionary of key -> value
+def store_properties(fp, properties):
+  for key in properties:
+    fp.write("%s = %s\n"%(_escape_property(key, True), _escape_property(properties[key])))
+
+SERVER_TEMPLATE_FILE = os.path.join(os.path.dirname(__file__),"server.xml.template")
+
+# Compiled templates, keyed by file name
+_templates = {}
+
+##
+# @param filename: the template file
+# @return the compiled template, only read from disk the first time
+def _get_template(filename):
+  if filename not in _templates:
+    with open(filename, "r") as fp:
+      _templates[filename] = rewriter.compiled_template(fp.read())
+  return _templates[filename]
+
+POST_CONFIG_SCRIPT_COMMENT = """
+
+# Additional post config scripts.
+# These scripts are called as python scripts with the only additional argument pointing at this
+# property file so you can specify more properties in addition to the ones above.
+# A script that defines a function post_config(ph) is instead called in-process with the loaded
+# properties. module:function or the name of a baltrad.config.post_config entry point can be used as well.
+# The naming of the post config script properties should be baltrad.post.config.script.<N> 
+# where N is a sequential number running from 1, and upward (1,2,3....).
+# A script can list the numbers of the scripts it depends on in baltrad.post.config.script.<N>.depends
+# and set a timeout in seconds with baltrad.post.config.script.<N>.timeout. With
+# baltrad.post.config.workers > 1, scripts that do not depend on each other run concurrently.
+#baltrad.post.config.script.1=..../xyz.py
+#baltrad.post.config.script.2=..../xyz2.py
+#baltrad.post.config.script.2.depends=1
+#baltrad.post.config.script.2.timeout=300
+#baltrad.post.config.workers=4
+"""
+
+# The connections the SQLAlchemy QueuePool of the BDB server may open on top of
+# its pool_size (max_overflow), bltnode.properties does not change the default
+SQLA_MAX_OVERFLOW = 10
+
+##
+# The worst case number of concurrent database connections and threads used
+# by the components of a node compared with what the database server allows.
+#
+class connection_budget(object):
+  ##
+  # Constructor
+  # @param max_connections: the max_connections of the database server or None if unknown
+  # @param reserved_connections: connections reserved for superusers
+  def __init__(self, max_connections=None, reserved_connections=3):
+    self.max_connections = max_connections
+    self.reserved_connections = reserved_connections
+    self.entries = []
+    self.warnings = []
+
+  ##
+  # Adds a component
+  # @param component: description of the component
+  # @param key: the property controlling the value
+  # @param connections: the number of database connections the component may open
+  # @param threads: the number of threads or processes the component may run
+  def add(self, component, key, connections, threads):
+    self.entries.append((component, key, connections, threads))
+
+  def total_connections(self):
+    return sum([e[2] for e in self.entries])
+
+  def total_threads(self):
+    return sum([e[3] for e in self.entries])
+
+  ##
+  # @return the number of connections available for the node or None if unknown
+  def available_connections(self):
+    if self.max_connections is None:
+      return None
+    return self.max_connections - self.reserved_connections
+
+  ##
+  # @return True if the components may open more connections than the server allows
+  def is_oversubscribed(self):
+    available = self.available_connections()
+    return available is not None and self.total_connections() > available
+
+  def __str__(self):
+    s = "%-45s %-45s %11s %7s\n"%("Component", "Property", "Connections", "Threads")
+    for component, key, connections, threads in self.entries:
+      s += "%-45s %-45s %11d %7d\n"%(component, key, connections, threads)
+    s += "%-45s %-45s %11d %7d\n"%("Total", "", self.total_connections(), self.total_threads())
+    available = self.available_connections()
+    if available is None:
+      s += "max_connections of the database server is unknown\n"
+    else:
+      s += "Available connections: %d (max_connections %d - %d reserved)\n"%(available, self.max_connections, self.reserved_connections)
+      if self.is_oversubscribed():
+        s += "OVERSUBSCRIBED by %d connection(s)\n"%(self.total_connections() - available)
+    for w in self.warnings:
+      s += "WARNING! %s\n"%w
+    return s
 
 class propertyhandler(object):
   def __init__(self):
     super(propertyhandler, self).__init__()
-    self.baltrad_user = "baltrad"
-    self.baltrad_group = "baltrad" 
-    self.db_username="baltrad"
-    self.db_password="baltrad"
-    self.db_hostname="localhost"
-    self.db_dbname="baltrad"
-    self.db_pool_size=10
-
-    self.nodename=socket.gethostname()
-    self.nodeaddress="http://127.0.0.1:8080"
-    self.keystore_root="/etc/baltrad/bltnode-keys"
-    self.keystore_jks="%s/keystore.jks"%self.keystore_root
-    self.keystore_pwd="secret"
-
-    self.ajp_connector_enabled=False
-    self.ajp_connector_secret_required=False
-    self.ajp_connector_secret=""
-    self.ajp_connector_address="::1"
-    self.ajp_connector_port=8009
-    self.ajp_connector_redirectPort=8443
-    
-    self.extra_fwd_port=""
-    
-    self.with_rave = True
-    self.dex_uri = "http://localhost:8080/BaltradDex"
-    self.prepare_threshold = -1
-    self.bdb_binaries = "/usr/bin"
-    self.beast_sql_file_dir = "/usr/share/baltrad/baltrad-beast/sql"
-    self.dex_sql_file_dir = "/usr/share/baltrad/baltrad-dex/sql"
-    self.bdb_server_type = "cherrypy"
-    self.bdb_server_cherrypy_threads = 10
-    self.bdb_server_cherrypy_backlog = 5
-    self.bdb_server_cherrypy_timeout = 10
-    self.bdb_server_uri = "http://localhost:8090"
-    self.bdb_server_backend_type = "sqla"
-    self.bdb_server_backend_sqla_pool_size = 10
-    self.bdb_server_log_level = "INFO"
-    self.bdb_server_log_type = "logfile"
-    self.bdb_server_log_file = "/var/log/baltrad/baltrad-bdb-server.log"
-    self.bdb_server_log_id = "baltrad-bdb-server"
-    self.bdb_server_backend_sqla_storage_type = "db"
-    self.bdb_server_backend_fs_layers = 3
-    self.bdb_server_backend_cachesize = 5000
-    self.bdb_server_backend_sqla_storage_fs_path = "/var/lib/baltrad/bdb_storage"
-    self.bdb_server_auth_providers = "noauth, keyczar"
-    self.bdb_client_rest_maxconnections = 20
-    self.bdb_client_rest_cachesize = 7000
-    self.baltrad_framepublisher_min_poolsize = 1
-    self.baltrad_framepublisher_max_poolsize = 5
-    self.baltrad_framepublisher_queuesize = 100
-    
-    self.beast_admin_mailer_enabled = False
-    self.beast_admin_mailer_encoding = "UTF-8"
-    self.beast_admin_mailer_host = "localhost"
-    self.beast_admin_mailer_port = 25
-    self.beast_admin_mailer_username = ""
-    self.beast_admin_mailer_password = ""
-    self.beast_admin_mailer_from = ""
-    self.beast_admin_mailer_transport_protocol = "smtp"
-    self.beast_admin_mailer_smtp_auth = False
-    self.beast_admin_mailer_smtp_starttls_enable = False
-
-    self.beast_cli_administration_enabled = False
-
-    self.beast_pooled_publisher_pool_core_size = 1
-    self.beast_pooled_publisher_pool_max_size = 5
-    self.beast_pooled_publisher_queue_size = 100
-
-    self.beast_manager_number_executors = 10
-
-    self.rave_ctpath = ""
-    self.rave_pgfs = "4"
-    self.rave_pgf_tasks_per_worker = None
-    self.rave_loglevel = "info"
-    self.rave_logid = "'PGF[rave.%s]'"%self.nodename
-    self.rave_centerid="ORG:82"
-    self.rave_qitotalmethod="minimum"
-    self.rave_scansun_out_path = ""
-    self.rave_pgf_compositing_use_lazy_loading = False
-    self.rave_pgf_compositing_use_lazy_loading_preloads = False
-    
-    self.rave_pgf_tiledcompositing_nrprocesses = None
-    self.rave_pgf_tiledcompositing_timeout = 290
-    self.rave_pgf_tiledcompositing_allow_missing_tiles = False
+    for p in PROPERTIES:
+      if callable(p.default):
+        setattr(self, p.attribute, p.default(self))
+      else:
+        setattr(self, p.attribute, p.default)
 
     self.post_config_scripts = []
+    self.post_config_script_depends = []
+    self.post_config_script_timeouts = []
+    self.post_config_workers = 1
+
+    # The resolved properties and the files they were read from
+    self.properties = {}
+    self.loaded_files = []
     
-  def _load_properties(self, cfile):
+  ##
+  # Loads a property file together with the files it includes
+  # @param cfile: the property file
+  # @param loading: the files currently being loaded, used for detecting cyclic includes
+  # @return dictionary of key -> raw value
+  def _load_properties(self, cfile, loading=()):
+    cfile = os.path.abspath(cfile)
+    if cfile in loading:
+      raise Exception("Cyclic include of %s"%cfile)
     with open(cfile, "r") as fp:
-      return baltradutils.jprops.load_properties(fp)
+      properties = baltradutils.jprops.load_properties(fp)
+    self.loaded_files.append(cfile)
+
+    if INCLUDE_KEY in properties:
+      result = {}
+      for name in properties.pop(INCLUDE_KEY).split(","):
+        if name.strip():
+          result.update(self._load_properties(os.path.join(os.path.dirname(cfile), name.strip()), loading + (cfile,)))
+      result.update(properties)
+      properties = result
+    return properties
     
   def write_config_file(self, config_file):
     with open(config_file, "w") as fp:
       fp.write(str(self))
     os.chmod(config_file,0o600)
 
+  ##
+  # Replaces the values of some properties in an existing configuration file.
+  # The rest of the file, like includes and ${...} references, is kept as is
+  # and keys that are not defined in the file are appended.
+  # @param config_file: the configuration file
+  # @param attributes: the attributes whose properties should be written
+  def patch_config_file(self, config_file, attributes):
+    values = {}
+    for p in PROPERTIES:
+      if p.attribute in attributes:
+        value = getattr(self, p.attribute)
+        values[p.key] = "%s"%(value if p.format is None else p.format(value))
+    outputs.write_atomic(config_file, rewriter.render_file(rewriter.property_rewriter(values, append_missing=True), config_file))
+
   def str_to_bool(self, s):
-    if s is not None:
-      if s.lower() in ["true", "1", "yes", "y", "t"]:
-        return True
-    return False 
+    return _parse_bool(s)
 
   def str_to_int_or_none(self, s):
-    try:
-      return int(s)
-    except:
-      return None
+    return _parse_int_or_none(s)
 
-  def open_config_file(self, config_file):
+  ##
+  # Reads the configuration file
+  # @param config_file: the configuration file
+  # @param overlays: additional property files whose values override the ones in config_file
+  def open_config_file(self, config_file, overlays=()):
+    self.loaded_files = []
     properties = self._load_properties(config_file)
-    self.with_rave = properties["baltrad.with.rave"] == "true"
-    if "baltrad.user" in properties:
-      self.baltrad_user = properties["baltrad.user"]
-    if "baltrad.group" in properties:
-      self.baltrad_group = properties["baltrad.group"]
-
-    self.db_username = properties["baltrad.db.username"]
-    self.db_password = properties["baltrad.db.password"]
-    self.db_hostname = properties["baltrad.db.hostname"]
-    self.db_dbname = properties["baltrad.db.dbname"]
-    if "baltrad.db.pool.size" in properties:
-      self.db_pool_size = int(properties["baltrad.db.pool.size"])
-
-    self.nodename = properties["baltrad.node.name"]
-    self.nodeaddress = properties["baltrad.node.address"]
-    self.keystore_root = properties["baltrad.keyczar.root"]
-    self.keystore_jks = properties["baltrad.keystore.jks"]
-    if "baltrad.keystore.password" in properties:
-      self.keystore_pwd = properties["baltrad.keystore.password"]
-
-    if "baltrad.ajp.connector.enabled" in properties:
-      self.ajp_connector_enabled = self.str_to_bool(properties["baltrad.ajp.connector.enabled"])
-
-    if "baltrad.ajp.connector.secret_required" in properties:
-      self.ajp_connector_secret_required = self.str_to_bool(properties["baltrad.ajp.connector.secret_required"])
-      
-    if "baltrad.ajp.connector.secret" in properties:
-      self.ajp_connector_secret = properties["baltrad.ajp.connector.secret"]
-    
-    if "baltrad.ajp.connector.address" in properties:
-      self.ajp_connector_address = properties["baltrad.ajp.connector.address"]
-
-    if "baltrad.ajp.connector.port" in properties:
-      self.ajp_connector_port = int(properties["baltrad.ajp.connector.port"])
-
-    if "baltrad.ajp.connector.redirect_port" in properties:
-      self.ajp_connector_redirectPort = int(properties["baltrad.ajp.connector.redirect_port"])
-    
-    if "baltrad.extra.fwd.port" in properties:
-      self.extra_fwd_port = properties["baltrad.extra.fwd.port"]
-    
-    self.dex_uri = properties["baltrad.dex.uri"]
-    self.prepare_threshold = int(properties["baltrad.db.jdbc.prepare_threshold"])
-
-    self.bdb_binaries = properties["bdb.binaries"]
-    self.beast_sql_file_dir = properties["beast.sql.file.dir"]
-    self.dex_sql_file_dir = properties["dex.sql.file.dir"]
-    
-    self.bdb_server_type = properties["baltrad.bdb.server.type"]
-    self.bdb_server_cherrypy_threads = int(properties["baltrad.bdb.server.cherrypy.threads"])
-    self.bdb_server_cherrypy_backlog = int(properties["baltrad.bdb.server.cherrypy.backlog"])
-    self.bdb_server_cherrypy_timeout = int(properties["baltrad.bdb.server.cherrypy.timeout"])
-    self.bdb_server_uri = properties["baltrad.bdb.server.uri"]
-    self.bdb_server_backend_type = properties["baltrad.bdb.server.backend.type"]
-    self.bdb_server_backend_sqla_pool_size = int(properties["baltrad.bdb.server.backend.sqla.pool_size"])
-    self.bdb_server_log_level = properties["baltrad.bdb.server.log.level"]
-    self.bdb_server_log_type = properties["baltrad.bdb.server.log.type"]
-    
-    if "baltrad.bdb.server.log.file" in properties:
-      self.bdb_server_log_file = properties["baltrad.bdb.server.log.file"]
-    
-    self.bdb_server_log_id = properties["baltrad.bdb.server.log.id"]
-    self.bdb_server_backend_sqla_storage_type = properties["baltrad.bdb.server.backend.sqla.storage.type"]
-    self.bdb_server_backend_sqla_storage_fs_path = properties["baltrad.bdb.server.backend.sqla.storage.fs.path"]
-    if "baltrad.bdb.server.backend.sqla.storage.fs.layers" in properties:
-      self.bdb_server_backend_fs_layers = int(properties["baltrad.bdb.server.backend.sqla.storage.fs.layers"])
-    if "baltrad.bdb.server.backend.sqla.storage.db.cachesize" in properties:
-      self.bdb_server_backend_cachesize = int(properties["baltrad.bdb.server.backend.sqla.storage.db.cachesize"])
-
-    self.bdb_server_auth_providers = properties["baltrad.bdb.server.auth.providers"]
-
-    if "baltrad.bdb.client.rest.maxconnections" in properties:
-      self.bdb_client_rest_maxconnections = int(properties["baltrad.bdb.client.rest.maxconnections"])
-    if "baltrad.bdb.client.rest.cachesize" in properties:
-      self.bdb_client_rest_cachesize = int(properties["baltrad.bdb.client.rest.cachesize"])
-    
-    if "baltrad.framepublisher.min_poolsize" in properties:
-      self.baltrad_framepublisher_min_poolsize = int(properties["baltrad.framepublisher.min_poolsize"])
-    if "baltrad.framepublisher.max_poolsize" in properties:
-      self.baltrad_framepublisher_max_poolsize = int(properties["baltrad.framepublisher.max_poolsize"])
-    if "baltrad.framepublisher.queuesize" in properties:
-      self.baltrad_framepublisher_queuesize = int(properties["baltrad.framepublisher.queuesize"])
-
-    if "beast.admin.mailer.enabled" in properties:
-      self.beast_admin_mailer_enabled = properties["beast.admin.mailer.enabled"] == "true"
-    if "beast.admin.mailer.encoding" in properties:
-      self.beast_admin_mailer_encoding = properties["beast.admin.mailer.encoding"]
-    if "beast.admin.mailer.host" in properties:
-      self.beast_admin_mailer_host = properties["beast.admin.mailer.host"]
-    if "beast.admin.mailer.port" in properties:
-      self.beast_admin_mailer_port = int(properties["beast.admin.mailer.port"])
-    if "beast.admin.mailer.username" in properties:
-      self.beast_admin_mailer_username = properties["beast.admin.mailer.username"]
-    if "beast.admin.mailer.password" in properties:
-      self.beast_admin_mailer_password = properties["beast.admin.mailer.password"]
-    if "beast.admin.mailer.from" in properties:
-      self.beast_admin_mailer_from = properties["beast.admin.mailer.from"]
-    if "beast.admin.mailer.transport.protocol" in properties:
-      self.beast_admin_mailer_transport_protocol = properties["beast.admin.mailer.transport.protocol"]
-    if "beast.admin.mailer.smtp.auth" in properties:
-      self.beast_admin_mailer_smtp_auth = properties["beast.admin.mailer.smtp.auth"] == "true"
-    if "beast.admin.mailer.smtp.starttls.enable" in properties:
-      self.beast_admin_mailer_smtp_starttls_enable = properties["beast.admin.mailer.smtp.starttls.enable"] == "true"
-
-    if "beast.cli.administration.enabled" in properties:
-      self.beast_cli_administration_enabled = properties["beast.cli.administration.enabled"] == "true"
-
-    if "beast.pooled.publisher.pool.core.size" in properties:
-      self.beast_pooled_publisher_pool_core_size = int(properties["beast.pooled.publisher.pool.core.size"])
-    if "beast.pooled.publisher.pool.max.size" in properties:
-      self.beast_pooled_publisher_pool_max_size = int(properties["beast.pooled.publisher.pool.max.size"])
-    if "beast.pooled.publisher.queue.size" in properties:
-      self.beast_pooled_publisher_queue_size = int(properties["beast.pooled.publisher.queue.size"])
-
-    if "beast.manager.number.executors" in properties:
-      self.beast_manager_number_executors = int(properties["beast.manager.number.executors"])
-
-    if "rave.ctpath" in properties:
-      self.rave_ctpath = properties["rave.ctpath"]
-    if "rave.pgfs" in properties:
-      self.rave_pgfs = properties["rave.pgfs"]
-    if "rave.pgf.tasks.per.worker" in properties:
-      self.rave_pgf_tasks_per_worker = self.str_to_int_or_none(properties["rave.pgf.tasks.per.worker"])
-    if "rave.loglevel" in properties:
-      self.rave_loglevel = properties["rave.loglevel"]
-    if "rave.logid" in properties:
-      self.rave_logid = properties["rave.logid"]
-    if "rave.centerid" in properties:
-      self.rave_centerid = properties["rave.centerid"]
-    if "rave.qitotalmethod" in properties:
-      self.rave_qitotalmethod = properties["rave.qitotalmethod"]
-    if "rave.scansunout" in properties:
-      self.rave_scansun_out_path = properties["rave.scansunout"]
-    if "rave.pgf.compositing.use_lazy_loading" in properties:
-      self.rave_pgf_compositing_use_lazy_loading = properties["rave.pgf.compositing.use_lazy_loading"]
-    if "rave.pgf.compositing.use_lazy_loading_preloads" in properties:
-      self.rave_pgf_compositing_use_lazy_loading_preloads = properties["rave.pgf.compositing.use_lazy_loading_preloads"]
-
-    if "rave.pgf.tiledcompositing.nrprocesses" in properties:
-      tmpstr = properties["rave.pgf.tiledcompositing.nrprocesses"]
-      self.rave_pgf_tiledcompositing_nrprocesses = self.str_to_int_or_none(tmpstr)
-    if "rave.pgf.tiledcompositing.timeout" in properties:
-      self.rave_pgf_tiledcompositing_timeout = int(properties["rave.pgf.tiledcompositing.timeout"])
-    if "rave.pgf.tiledcompositing.allow_missing_tiles" in properties:
-      self.rave_pgf_tiledcompositing_allow_missing_tiles = self.str_to_bool(properties["rave.pgf.tiledcompositing.allow_missing_tiles"])
+    for overlay in overlays:
+      properties.update(self._load_properties(overlay))
+    properties = resolve_properties(properties)
+    self.properties = properties
+    self.__dict__.update(_parse_properties(properties))
 
     index = 1
     self.post_config_scripts=[]
-    while "baltrad.post.config.script.%d"%index in properties:
-      self.post_config_scripts.append(properties["baltrad.post.config.script.%d"%index])
+    self.post_config_script_depends=[]
+    self.post_config_script_timeouts=[]
+    while POST_CONFIG_SCRIPT_KEY%index in properties:
+      self.post_config_scripts.append(properties[POST_CONFIG_SCRIPT_KEY%index])
+      depends = properties.get(POST_CONFIG_SCRIPT_DEPENDS_KEY%index, "")
+      try:
+        self.post_config_script_depends.append(tuple([int(d) for d in depends.split(",") if d.strip()]))
+      except ValueError:
+        raise Exception("%s should be a comma separated list of script numbers, not '%s'"%(POST_CONFIG_SCRIPT_DEPENDS_KEY%index, depends))
+      timeout = properties.get(POST_CONFIG_SCRIPT_TIMEOUT_KEY%index, "")
+      self.post_config_script_timeouts.append(float(timeout) if timeout.strip() else None)
       index = index + 1
+    self.post_config_workers = int(properties.get(POST_CONFIG_WORKERS_KEY, "1"))
+
+    count = len(self.post_config_scripts)
+    for i, depends in enumerate(self.post_config_script_depends):
+      for d in depends:
+        if d < 1 or d > count:
+          raise Exception("%s refers to script %d, but only %d post config script(s) are configured"%(POST_CONFIG_SCRIPT_DEPENDS_KEY%(i + 1), d, count))
+
+  ##
+  # Sums the worst case number of database connections and threads of the node.
+  # @param max_connections: the max_connections of the database server, if None
+  # baltrad.db.max_connections is used
+  # @param reserved_connections: connections reserved for superusers
+  # @return a connection_budget
+  def analyze_connection_budget(self, max_connections=None, reserved_connections=3):
+    if max_connections is None:
+      max_connections = self.db_max_connections
+    budget = connection_budget(max_connections, reserved_connections)
+
+    pgfs = _parse_int_or_none(self.rave_pgfs)
+    if pgfs is None:
+      pgfs = 0
+      budget.warnings.append("rave.pgfs (%s) is not a number and has not been counted"%self.rave_pgfs)
+    tileprocs = self.rave_pgf_tiledcompositing_nrprocesses or 0
+
+    dex_threads = self.beast_manager_number_executors + self.beast_pooled_publisher_pool_max_size + self.baltrad_framepublisher_max_poolsize
+    budget.add("DEX JDBC pool", "baltrad.db.pool.size", self.db_pool_size, 0)
+    budget.add("BEAST message manager executors", "beast.manager.number.executors", 0, self.beast_manager_number_executors)
+    budget.add("BEAST pooled publisher", "beast.pooled.publisher.pool.max.size", 0, self.beast_pooled_publisher_pool_max_size)
+    budget.add("DEX frame publisher", "baltrad.framepublisher.max_poolsize", 0, self.baltrad_framepublisher_max_poolsize)
+    budget.add("Tomcat executor", "baltrad.tomcat.executor.max_threads", 0, self.tomcat_executor_max_threads)
+    bdb_connections = self.bdb_server_backend_sqla_pool_size + SQLA_MAX_OVERFLOW
+    budget.add("BDB server (sqla pool + overflow)", "baltrad.bdb.server.backend.sqla.pool_size", bdb_connections, self.bdb_server_cherrypy_threads)
+    if self.with_rave:
+      budget.add("RAVE PGF workers (rave.db.uri)", "rave.pgfs", pgfs, pgfs + tileprocs)
+
+    if dex_threads > self.db_pool_size:
+      budget.warnings.append("%d BEAST/DEX threads share %d DEX JDBC connections and may wait for a free connection"%(dex_threads, self.db_pool_size))
+    if self.bdb_server_cherrypy_threads > bdb_connections:
+      budget.warnings.append("%d BDB server threads share %d sqla connections"%(self.bdb_server_cherrypy_threads, bdb_connections))
+    return budget
+
+  ##
+  # Writes the resolved properties, as read by open_config_file, to a file
+  # @param filename: the file to write
+  def write_resolved_properties(self, filename):
+    with open(filename, "w") as fp:
+      store_properties(fp, self.properties)
+    os.chmod(filename, 0o600)
 
   def __str__(self):
-    s = "\n# General configuration settings\n"
-    s += "# Specifies if rave is installed or not (true, false).\n"
-    s += "# Used to know if rave_defines.py should be configured or not.\n"
-    s += "baltrad.with.rave = %s\n"%"true" if self.with_rave else "false"
-    s += "\n"
-    s += "baltrad.user = %s\n"%self.baltrad_user
-    s += "baltrad.group = %s\n"%self.baltrad_group
-    s += "\n"
-    s += "\n# postgres database specifics\n"
-    s += "baltrad.db.username = %s\n"%self.db_username
-    s += "baltrad.db.password = %s\n"%self.db_password
-    s += "baltrad.db.hostname = %s\n"%self.db_hostname
-    s += "baltrad.db.dbname = %s\n"%self.db_dbname
-    s += "baltrad.db.pool.size = %d\n"%self.db_pool_size
-    s += "\n"
-    s += "baltrad.node.name = %s\n"%self.nodename
-    s += "baltrad.node.address = %s\n"%self.nodeaddress
-    s += "baltrad.keyczar.root = %s\n"%self.keystore_root
-    s += "baltrad.keystore.jks = %s\n"%self.keystore_jks
-    s += "baltrad.keystore.password = %s\n"%self.keystore_pwd
-    
-    s += "baltrad.ajp.connector.enabled = %s\n"%str(self.ajp_connector_enabled).lower()
-    s += "baltrad.ajp.connector.secret_required = %s\n"%str(self.ajp_connector_secret_required).lower()
-    s += "baltrad.ajp.connector.secret = %s\n"%self.ajp_connector_secret
-    s += "baltrad.ajp.connector.address = %s\n"%self.ajp_connector_address
-    s += "baltrad.ajp.connector.port = %d\n"%self.ajp_connector_port
-    s += "baltrad.ajp.connector.redirect_port = %d\n"%self.ajp_connector_redirectPort
-
-    s += "\n"
-    s += "# If there is some sort of forwarding to the node which remaps for example port 80 to 8080 and 443 to 8443.\n"
-    s += "# Then add, from-port and to port like baltrad.extra.fwd.port=80,443\n"
-    s += "baltrad.extra.fwd.port=%s\n"%self.extra_fwd_port
-    s += "\n"
-
-    s += "baltrad.dex.uri = %s\n"%self.dex_uri
-    s += "baltrad.db.jdbc.prepare_threshold = %d\n"%self.prepare_threshold
-    s += "\n# dex & beast database script locations\n"
-    s += "beast.sql.file.dir=%s\n"%self.beast_sql_file_dir
-    s += "dex.sql.file.dir=%s\n"%self.dex_sql_file_dir
-    s += "bdb.binaries=%s\n"%self.bdb_binaries
-    s += "\n\n"
-    s += "#BDB settings\n"
-    s += "#baltrad.bdb.server.type = werkzeug\n"
-    s += "baltrad.bdb.server.type = %s\n"%self.bdb_server_type
-    s += "baltrad.bdb.server.cherrypy.threads = %d\n"%self.bdb_server_cherrypy_threads
-    s += "baltrad.bdb.server.cherrypy.backlog = %d\n"%self.bdb_server_cherrypy_backlog
-    s += "baltrad.bdb.server.cherrypy.timeout = %d\n"%self.bdb_server_cherrypy_timeout
-    s += "baltrad.bdb.server.uri = %s\n"%self.bdb_server_uri
-    s += "baltrad.bdb.server.backend.type = %s\n"%self.bdb_server_backend_type
-    s += "baltrad.bdb.server.backend.sqla.pool_size = %d\n"%self.bdb_server_backend_sqla_pool_size
-    s += "baltrad.bdb.server.log.level = %s\n"%self.bdb_server_log_level
-    s += "baltrad.bdb.server.log.type = %s\n"%self.bdb_server_log_type
-    s += "baltrad.bdb.server.log.file = %s\n"%self.bdb_server_log_file
-    s += "baltrad.bdb.server.log.id = %s\n"%self.bdb_server_log_id
-    s += "#baltrad.bdb.server.backend.sqla.storage.type = fs\n"
-    s += "baltrad.bdb.server.backend.sqla.storage.type = %s\n"%self.bdb_server_backend_sqla_storage_type
-    s += "baltrad.bdb.server.backend.sqla.storage.fs.path = %s\n"%self.bdb_server_backend_sqla_storage_fs_path
-    s += "baltrad.bdb.server.backend.sqla.storage.fs.layers = %d\n"%self.bdb_server_backend_fs_layers
-    s += "baltrad.bdb.server.backend.sqla.storage.db.cachesize = %d\n"%self.bdb_server_backend_cachesize
-    s += "baltrad.bdb.server.auth.providers = %s\n"%self.bdb_server_auth_providers
-    s += "\n"
-    s += "baltrad.bdb.client.rest.maxconnections = %d\n"%self.bdb_client_rest_maxconnections
-    s += "baltrad.bdb.client.rest.cachesize = %d\n"%self.bdb_client_rest_cachesize
-    s += "\n"
-    s += "baltrad.framepublisher.min_poolsize = %s\n"%self.baltrad_framepublisher_min_poolsize
-    s += "baltrad.framepublisher.max_poolsize = %s\n"%self.baltrad_framepublisher_max_poolsize
-    s += "baltrad.framepublisher.queuesize = %s\n"%self.baltrad_framepublisher_queuesize
-    s += "\n"
-    s += "#BEAST settings\n"
-    s += "beast.admin.mailer.enabled = %s\n"%("true" if self.beast_admin_mailer_enabled else "false")
-    s += "beast.admin.mailer.encoding = %s\n"%self.beast_admin_mailer_encoding
-    s += "beast.admin.mailer.host = %s\n"%self.beast_admin_mailer_host
-    s += "beast.admin.mailer.port = %s\n"%self.beast_admin_mailer_port
-    s += "beast.admin.mailer.username = %s\n"%self.beast_admin_mailer_username
-    s += "beast.admin.mailer.password = %s\n"%self.beast_admin_mailer_password
-    s += "beast.admin.mailer.from = %s\n"%self.beast_admin_mailer_from
-    s += "beast.admin.mailer.transport.protocol = %s\n"%self.beast_admin_mailer_transport_protocol
-    s += "beast.admin.mailer.smtp.auth = %s\n"%("true" if self.beast_admin_mailer_smtp_auth else "false")
-    s += "beast.admin.mailer.smtp.starttls.enable = %s\n"%("true" if self.beast_admin_mailer_smtp_starttls_enable else "false")
-    s += "\n"
-    s += "beast.cli.administration.enabled = %s\n"%("true" if self.beast_cli_administration_enabled else "false")
-    s += "\n"
-    s += "#BEAST exchange pool settings\n"
-    s += "beast.pooled.publisher.pool.core.size = %d\n"%self.beast_pooled_publisher_pool_core_size
-    s += "beast.pooled.publisher.pool.max.size = %d\n"%self.beast_pooled_publisher_pool_max_size
-    s += "beast.pooled.publisher.queue.size = %d\n"%self.beast_pooled_publisher_queue_size
-    s += "\n"
-    s += "#BEAST message manager settings\n"
-    s += "beast.manager.number.executors = %d\n"%self.beast_manager_number_executors
-    s += "\n"
-    s += "#rave.ctpath=%s\n"%self.rave_ctpath
-    s += "rave.pgfs=%s\n"%self.rave_pgfs
-    if self.rave_pgf_tasks_per_worker is not None:
-      s += "rave.pgf.tasks.per.worker=%d\n"%self.rave_pgf_tasks_per_worker
-    else:
-      s += "rave.pgf.tasks.per.worker=None\n"
-    s += "rave.loglevel=%s\n"%self.rave_loglevel
-    s += "rave.logid=%s\n"%self.rave_logid
-    s += "rave.centerid=%s\n"%self.rave_centerid
-    s += "rave.qitotalmethod=%s\n"%self.rave_qitotalmethod
-    if not self.rave_scansun_out_path:
-      s += "rave.scansunout=\n"
-    else:
-      s += "rave.scansunout=%s\n"%self.rave_scansun_out_path
-    s += "rave.pgf.compositing.use_lazy_loading=%s\n"%self.rave_pgf_compositing_use_lazy_loading
-    s += "rave.pgf.compositing.use_lazy_loading_preloads=%s\n"%self.rave_pgf_compositing_use_lazy_loading_preloads
-    if self.rave_pgf_tiledcompositing_nrprocesses is not None:
-      s += "rave.pgf.tiledcompositing.nrprocesses=%d\n"%self.rave_pgf_tiledcompositing_nrprocesses
-    else:
-      s += "rave.pgf.tiledcompositing.nrprocesses=None\n"
-    s += "rave.pgf.tiledcompositing.timeout=%d\n"%self.rave_pgf_tiledcompositing_timeout
-    s += "rave.pgf.tiledcompositing.allow_missing_tiles=%s\n"%("true" if self.rave_pgf_tiledcompositing_allow_missing_tiles else "false")
-    
-    s += "\n\n"
-    s += "# Additional post config scripts.\n"
-    s += "# These scripts are called as python scripts with the only additional argument pointing at this\n"
-    s += "# property file so you can specify more properties in addition to the ones above.\n"
-    s += "# The naming of the post config script properties should be baltrad.post.config.script.<N> \n"
-    s += "# where N is a sequential number running from 1, and upward (1,2,3....).\n"
-    s += "#baltrad.post.config.script.1=..../xyz.py\n"
-    s += "#baltrad.post.config.script.2=..../xyz2.py\n"
+    d = self.__dict__
+    s = [template%(d[attribute] if format is None else format(d[attribute])) for template, attribute, format in _FORMAT_TABLE]
+
+    s.append(POST_CONFIG_SCRIPT_COMMENT)
     for i in range(len(self.post_config_scripts)):
-      s += "baltrad.post.config.script.%d = %s\n"%(i+1, self.post_config_scripts[i])    
-    
-    return s
+      s.append("%s = %s\n"%(POST_CONFIG_SCRIPT_KEY%(i+1), self.post_config_scripts[i]))
+      if i < len(self.post_config_script_depends) and self.post_config_script_depends[i]:
+        s.append("%s = %s\n"%(POST_CONFIG_SCRIPT_DEPENDS_KEY%(i+1), ",".join(["%d"%d for d in self.post_config_script_depends[i]])))
+      if i < len(self.post_config_script_timeouts) and self.post_config_script_timeouts[i] is not None:
+        s.append("%s = %g\n"%(POST_CONFIG_SCRIPT_TIMEOUT_KEY%(i+1), self.post_config_script_timeouts[i]))
+    if self.post_config_workers != 1:
+      s.append("%s = %d\n"%(POST_CONFIG_WORKERS_KEY, self.post_config_workers))
+
+    return "".join(s)
+
+  ##
+  # Atomically replaces the specified file
+  # @param filename: the file to write
+  # @param content: the content
+  def _write_file(self, filename, content):
+    outputs.write_atomic(filename, content)
+
+  ##
+  # @return the content of the bltnode.properties file
+  def render_bltnode_properties(self):
+    s = []
+    s.append("\n#BDB settings\n")
+    s.append("baltrad.bdb.server.type = %s\n"%self.bdb_server_type)
+    s.append("baltrad.bdb.server.cherrypy.threads = %d\n"%self.bdb_server_cherrypy_threads)
+    s.append("baltrad.bdb.server.cherrypy.backlog = %d\n"%self.bdb_server_cherrypy_backlog)
+    s.append("baltrad.bdb.server.cherrypy.timeout = %d\n"%self.bdb_server_cherrypy_timeout)
+    s.append("baltrad.bdb.server.uri = %s\n"%self.bdb_server_uri)
+    s.append("baltrad.bdb.server.backend.type = %s\n"%self.bdb_server_backend_type)
+    s.append("baltrad.bdb.server.backend.sqla.uri = postgresql://%s:%s@%s/%s\n"%(self.db_username,self.db_password,self.db_hostname,self.db_dbname))
+    s.append("baltrad.bdb.server.backend.sqla.pool_size = %d\n"%self.bdb_server_backend_sqla_pool_size)
+    s.append("baltrad.bdb.server.log.level = %s\n"%self.bdb_server_log_level)
+    s.append("baltrad.bdb.server.log.type = %s\n"%self.bdb_server_log_type)
+    s.append("baltrad.bdb.server.log.id = %s\n"%self.bdb_server_log_id)
+    s.append("baltrad.bdb.server.backend.sqla.storage.type = %s\n"%self.bdb_server_backend_sqla_storage_type)
+    s.append("baltrad.bdb.server.backend.sqla.storage.fs.path = %s\n"%self.bdb_server_backend_sqla_storage_fs_path)
+    s.append("baltrad.bdb.server.backend.sqla.storage.fs.layers = %d\n"%self.bdb_server_backend_fs_layers)
+    s.append("baltrad.bdb.server.auth.providers = %s\n"%self.bdb_server_auth_providers)
+
+    s.append("baltrad.bdb.server.auth.keyczar.keystore_root = %s\n"%self.keystore_root)
+    s.append("baltrad.bdb.server.auth.keyczar.keys.%s = %s.pub\n"%(self.nodename,self.nodename))
+    s.append("\n# BEAST PGF Specific values\n")
+
+    s.append("baltrad.beast.server.url = %s\n"%self.dex_uri)
+    s.append("baltrad.beast.pgf.nodename = %s\n"%self.nodename)
+    s.append("baltrad.beast.pgf.url = http://localhost\n")
+    s.append("baltrad.beast.pgf.key = %s/%s.priv\n"%(self.keystore_root,self.nodename))
+
+    s.append("\n# RAVE PGF Specific values\n")
+    s.append("rave.db.uri=postgresql://%s:%s@%s/%s\n"%(self.db_username,self.db_password,self.db_hostname,self.db_dbname))
+    return "".join(s)
 
   def write_bltnode_properties(self, bltnodefile):
-    with open(bltnodefile, "w") as fp:
-      fp.write("\n#BDB settings\n")
-      fp.write("baltrad.bdb.server.type = %s\n"%self.bdb_server_type)
-      fp.write("baltrad.bdb.server.cherrypy.threads = %d\n"%self.bdb_server_cherrypy_threads)
-      fp.write("baltrad.bdb.server.cherrypy.backlog = %d\n"%self.bdb_server_cherrypy_backlog)
-      fp.write("baltrad.bdb.server.cherrypy.timeout = %d\n"%self.bdb_server_cherrypy_timeout)
-      fp.write("baltrad.bdb.server.uri = %s\n"%self.bdb_server_uri)
-      fp.write("baltrad.bdb.server.backend.type = %s\n"%self.bdb_server_backend_type)
-      fp.write("baltrad.bdb.server.backend.sqla.uri = postgresql://%s:%s@%s/%s\n"%(self.db_username,self.db_password,self.db_hostname,self.db_dbname))
-      fp.write("baltrad.bdb.server.backend.sqla.pool_size = %d\n"%self.bdb_server_backend_sqla_pool_size)
-      fp.write("baltrad.bdb.server.log.level = %s\n"%self.bdb_server_log_level)
-      fp.write("baltrad.bdb.server.log.type = %s\n"%self.bdb_server_log_type)
-      fp.write("baltrad.bdb.server.log.id = %s\n"%self.bdb_server_log_id)
-      fp.write("baltrad.bdb.server.backend.sqla.storage.type = %s\n"%self.bdb_server_backend_sqla_storage_type)
-      fp.write("baltrad.bdb.server.backend.sqla.storage.fs.path = %s\n"%self.bdb_server_backend_sqla_storage_fs_path)
-      fp.write("baltrad.bdb.server.backend.sqla.storage.fs.layers = %d\n"%self.bdb_server_backend_fs_layers)
-      fp.write("baltrad.bdb.server.auth.providers = %s\n"%self.bdb_server_auth_providers)
-
-      fp.write("baltrad.bdb.server.auth.keyczar.keystore_root = %s\n"%self.keystore_root)
-      fp.write("baltrad.bdb.server.auth.keyczar.keys.%s = %s.pub\n"%(self.nodename,self.nodename))
-      fp.write("\n# BEAST PGF Specific values\n")
-      
-      fp.write("baltrad.beast.server.url = %s\n"%self.dex_uri)
-      fp.write("baltrad.beast.pgf.nodename = %s\n"%self.nodename)
-      fp.write("baltrad.beast.pgf.url = http://localhost\n")
-      fp.write("baltrad.beast.pgf.key = %s/%s.priv\n"%(self.keystore_root,self.nodename))
-      
-      fp.write("\n# RAVE PGF Specific values\n")
-      fp.write("rave.db.uri=postgresql://%s:%s@%s/%s\n"%(self.db_username,self.db_password,self.db_hostname,self.db_dbname))
-    
+    self._write_file(bltnodefile, self.render_bltnode_properties())
+
+  ##
+  # @return a property_rewriter for the node specific values in dex.properties
+  def _dex_properties_rewriter(self):
+    return rewriter.property_rewriter({
+      "key.alias":self.nodename,
+      "node.name":self.nodename,
+      "keystore.directory":self.keystore_root,
+      "node.address":self.nodeaddress,
+      "framepublisher.min_poolsize":self.baltrad_framepublisher_min_poolsize,
+      "framepublisher.max_poolsize":self.baltrad_framepublisher_max_poolsize,
+      "framepublisher.queuesize":self.baltrad_framepublisher_queuesize
+    })
+
+  ##
+  # @param dexfile: the current dex.properties file
+  # @return the content of dexfile with the node specific values replaced
+  def render_dex_properties(self, dexfile):
+    return rewriter.render_file(self._dex_properties_rewriter(), dexfile)
+
   def write_dex_properties(self, dexfile):
-    with open(dexfile) as fp:
-      lines = fp.readlines()
-    fp.close()
-    (fd, fname) = tempfile.mkstemp()
-    fp = os.fdopen(fd, "w")
-    for l in lines:
-      modline = l
-      modline = re.sub("^\s*key.alias\s*=\s*.*","key.alias=%s"%self.nodename,modline)
-      modline = re.sub("^\s*node.name\s*=\s*.*","node.name=%s"%self.nodename,modline)
-      modline = re.sub("^\s*keystore.directory\s*=\s*.*","keystore.directory=%s"%self.keystore_root,modline)
-      modline = re.sub("^\s*node.address\s*=\s*.*","node.address=%s"%self.nodeaddress,modline)
-      modline = re.sub("^\s*framepublisher.min_poolsize\s*=\s*.*","framepublisher.min_poolsize=%s"%self.baltrad_framepublisher_min_poolsize,modline)
-      modline = re.sub("^\s*framepublisher.max_poolsize\s*=\s*.*","framepublisher.max_poolsize=%s"%self.baltrad_framepublisher_max_poolsize,modline)
-      modline = re.sub("^\s*framepublisher.queuesize\s*=\s*.*","framepublisher.queuesize=%s"%self.baltrad_framepublisher_queuesize,modline)
-    
-      fp.write("%s"%modline)
-    fp.close()
- 
-    shutil.move(fname, dexfile)
-    
+    outputs.write_atomic(dexfile, self.render_dex_properties(dexfile))
+
+  ##
+  # @return the content of the db.properties file
+  def render_dex_db_properties(self):
+    s = []
+    s.append("#Autogenerated by post config script\n")
+    s.append("db.jar=postgresql-42.1.4.jre6.jar\n")
+    s.append("db.driver=org.postgresql.Driver\n")
+    if self.prepare_threshold < 0:
+      s.append("db.url=jdbc:postgresql://%s/%s\n"%(self.db_hostname,self.db_dbname))
+    else:
+      s.append("db.url=jdbc:postgresql://%s/%s?prepareThreshold=%i\n"%(self.db_hostname,self.db_dbname,self.prepare_threshold))
+    s.append("db.user=%s\n"%self.db_username)
+    s.append("db.pwd=%s\n"%self.db_password)
+    s.append("db.pool.size=%d\n"%self.db_pool_size)
+    return "".join(s)
+
   def write_dex_db_properties(self, dexdbfile):
-    with open(dexdbfile, "w") as fp:
-      fp.write("#Autogenerated by post config script\n")
-      fp.write("db.jar=postgresql-42.1.4.jre6.jar\n")
-      fp.write("db.driver=org.postgresql.Driver\n")
-      if self.prepare_threshold < 0:
-        fp.write("db.url=jdbc:postgresql://%s/%s\n"%(self.db_hostname,self.db_dbname))
-      else:
-        fp.write("db.url=jdbc:postgresql://%s/%s?prepareThreshold=%i\n"%(self.db_hostname,self.db_dbname,self.prepare_threshold))
-      fp.write("db.user=%s\n"%self.db_username)
-      fp.write("db.pwd=%s\n"%self.db_password)
-      fp.write("db.pool.size=%d\n"%self.db_pool_size)
+    self._write_file(dexdbfile, self.render_dex_db_properties())
 
-    fp.close()
+  ##
+  # @return the content of the dex.fc.properties file
+  def render_dex_fc_properties(self):
+    s = []
+    s.append("# Autogenerated by install script\n")
+    s.append("database.uri=%s\n"%self.bdb_server_uri)
+    s.append("\n")
+    s.append("# What type of strategy should be used for storage\n")
+    s.append("data.storage.strategy=%s\n"%self.bdb_server_backend_sqla_storage_type)
+    s.append("\n")
+    s.append("# File catalog data storage directory\n")
+    s.append("data.storage.folder=%s\n"%self.bdb_server_backend_sqla_storage_fs_path)
+    s.append("\n")
+    s.append("# The number of layers used if using \"fs\" storage\n")
+    s.append("data.storage.number.layers=%d\n"%self.bdb_server_backend_fs_layers)
+    s.append("\n")
+    s.append("# Size of cache storage if using \"db\" storage since the \"fs\" storage itself is one huge cache.\n")
+    s.append("data.storage.cache.size=%d\n"%self.bdb_server_backend_cachesize)
+    s.append("\n")
+    s.append("# The rest clients max number of connections\n")
+    s.append("bdb.rest.client.maxconnections=%d\n"%self.bdb_client_rest_maxconnections)
+    s.append("\n")
+    s.append("# The rest clients max cache size\n")
+    s.append("bdb.rest.client.cachesize=%d\n"%self.bdb_client_rest_cachesize)
+    s.append("\n")
+    s.append("# Keyczar key to communicate with node\n")
+    s.append("database.keyczar.key=%s/%s.priv\n"%(self.keystore_root, self.nodename))
+    s.append("\n")
+    s.append("# Name of the node\n")
+    s.append("database.keyczar.name=%s\n"%self.nodename)
+    s.append("\n")
+    return "".join(s)
 
   ##
   # Updates the dex.fc.properties file in the BaltradDex tomcat directory (baltrad.install.3p_root/....)
   # @param properties: the properties to be used
   #
   def write_dex_fc_properties(self, dexfcfile):
-    with open(dexfcfile, "w") as fp:
-      fp.write("# Autogenerated by install script\n")
-      fp.write("database.uri=%s\n"%self.bdb_server_uri)
-      fp.write("\n")
-      fp.write("# What type of strategy should be used for storage\n")
-      fp.write("data.storage.strategy=%s\n"%self.bdb_server_backend_sqla_storage_type)
-      fp.write("\n")
-      fp.write("# File catalog data storage directory\n")
-      fp.write("data.storage.folder=%s\n"%self.bdb_server_backend_sqla_storage_fs_path)
-      fp.write("\n")
-      fp.write("# The number of layers used if using \"fs\" storage\n")
-      fp.write("data.storage.number.layers=%d\n"%self.bdb_server_backend_fs_layers)
-      fp.write("\n")
-      fp.write("# Size of cache storage if using \"db\" storage since the \"fs\" storage itself is one huge cache.\n")
-      fp.write("data.storage.cache.size=%d\n"%self.bdb_server_backend_cachesize)
-      fp.write("\n")
-      fp.write("# The rest clients max number of connections\n")
-      fp.write("bdb.rest.client.maxconnections=%d\n"%self.bdb_client_rest_maxconnections)
-      fp.write("\n")
-      fp.write("# The rest clients max cache size\n")
-      fp.write("bdb.rest.client.cachesize=%d\n"%self.bdb_client_rest_cachesize)
-      fp.write("\n")
-      fp.write("# Keyczar key to communicate with node\n")
-      fp.write("database.keyczar.key=%s/%s.priv\n"%(self.keystore_root, self.nodename))
-      fp.write("\n")
-      fp.write("# Name of the node\n")
-      fp.write("database.keyczar.name=%s\n"%self.nodename)
-      fp.write("\n")
-      
-    fp.close()
-    
+    self._write_file(dexfcfile, self.render_dex_fc_properties())
+
+  ##
+  # @return the content of the dex.beast.properties file
+  def render_dex_beast_properties(self):
+    s = []
+    s.append("# Autogenerated by install script\n")
+    s.append("# BEAST mailer specifics\n")
+    s.append("beast.admin.mailer.enabled=%s\n"%("true" if self.beast_admin_mailer_enabled else "false"))
+    s.append("beast.admin.mailer.encoding=%s\n"%self.beast_admin_mailer_encoding)
+    s.append("beast.admin.mailer.host=%s\n"%self.beast_admin_mailer_host)
+    s.append("beast.admin.mailer.port=%s\n"%self.beast_admin_mailer_port)
+    s.append("beast.admin.mailer.username=%s\n"%self.beast_admin_mailer_username)
+    s.append("beast.admin.mailer.password=%s\n"%self.beast_admin_mailer_password)
+    s.append("beast.admin.mailer.from=%s\n"%self.beast_admin_mailer_from)
+    s.append("beast.admin.mailer.transport.protocol=%s\n"%self.beast_admin_mailer_transport_protocol)
+    s.append("beast.admin.mailer.smtp.auth=%s\n"%("true" if self.beast_admin_mailer_smtp_auth else "false"))
+    s.append("beast.admin.mailer.smtp.starttls.enable=%s\n"%("true" if self.beast_admin_mailer_smtp_starttls_enable else "false"))
+
+    s.append("beast.cli.administration.enabled=%s\n"%("true" if self.beast_cli_administration_enabled else "false"))
+
+    s.append("\n")
+    s.append("# BEAST mailer specifics\n")
+    s.append("beast.admin.security.keyzcar.path=%s\n"%self.keystore_root)
+    s.append("\n")
+    s.append("# BEAST exchange pool settings\n")
+    s.append("beast.pooled.publisher.pool.core.size=%d\n"%self.beast_pooled_publisher_pool_core_size)
+    s.append("beast.pooled.publisher.pool.max.size=%d\n"%self.beast_pooled_publisher_pool_max_size)
+    s.append("beast.pooled.publisher.queue.size=%d\n"%self.beast_pooled_publisher_queue_size)
+    s.append("\n")
+
+    s.append("#BEAST message manager settings\n")
+    s.append("beast.manager.number.executors = %d\n"%self.beast_manager_number_executors)
+    return "".join(s)
+
   ##
   # Updates the dex.beast.properties file in the BaltradDex tomcat directory (baltrad.install.3p_root/....)
   # @param properties: the properties to be used
   #
   def write_dex_beast_properties(self, dexbeastfile):
-    with open(dexbeastfile, "w") as fp:
-      fp.write("# Autogenerated by install script\n")
-      fp.write("# BEAST mailer specifics\n")
-      fp.write("beast.admin.mailer.enabled=%s\n"%("true" if self.beast_admin_mailer_enabled else "false"))
-      fp.write("beast.admin.mailer.encoding=%s\n"%self.beast_admin_mailer_encoding)
-      fp.write("beast.admin.mailer.host=%s\n"%self.beast_admin_mailer_host)
-      fp.write("beast.admin.mailer.port=%s\n"%self.beast_admin_mailer_port)
-      fp.write("beast.admin.mailer.username=%s\n"%self.beast_admin_mailer_username)
-      fp.write("beast.admin.mailer.password=%s\n"%self.beast_admin_mailer_password)
-      fp.write("beast.admin.mailer.from=%s\n"%self.beast_admin_mailer_from)
-      fp.write("beast.admin.mailer.transport.protocol=%s\n"%self.beast_admin_mailer_transport_protocol)
-      fp.write("beast.admin.mailer.smtp.auth=%s\n"%("true" if self.beast_admin_mailer_smtp_auth else "false"))
-      fp.write("beast.admin.mailer.smtp.starttls.enable=%s\n"%("true" if self.beast_admin_mailer_smtp_starttls_enable else "false"))
-
-      fp.write("beast.cli.administration.enabled=%s\n"%("true" if self.beast_cli_administration_enabled else "false"))
-
-      fp.write("\n")
-      fp.write("# BEAST mailer specifics\n")
-      fp.write("beast.admin.security.keyzcar.path=%s\n"%self.keystore_root)
-      fp.write("\n")
-      fp.write("# BEAST exchange pool settings\n")
-      fp.write("beast.pooled.publisher.pool.core.size=%d\n"%self.beast_pooled_publisher_pool_core_size)
-      fp.write("beast.pooled.publisher.pool.max.size=%d\n"%self.beast_pooled_publisher_pool_max_size)
-      fp.write("beast.pooled.publisher.queue.size=%d\n"%self.beast_pooled_publisher_queue_size)
-      fp.write("\n")
-      
-      fp.write("#BEAST message manager settings\n")
-      fp.write("beast.manager.number.executors = %d\n"%self.beast_manager_number_executors)
-
-    fp.close()
-        
+    self._write_file(dexbeastfile, self.render_dex_beast_properties())
+
+  ##
+  # @param bltnodefile: the bltnode.properties file that rave should use
+  # @return an assignment_rewriter for the node specific values in rave_defines.py
+  def _rave_defines_rewriter(self, bltnodefile):
+    assignments = {
+      "DEX_SPOE":"DEX_SPOE = \"%s\""%self.dex_uri,
+      "DEX_NODENAME":"DEX_NODENAME = \"%s\""%self.nodename,
+      "DEX_PRIVATEKEY":"DEX_PRIVATEKEY = \"%s/%s.priv\""%(self.keystore_root,self.nodename),
+      "BDB_CONFIG_FILE":"BDB_CONFIG_FILE = \"%s\""%bltnodefile,
+      "CTPATH":None,
+      "PGFs":None,
+      "LOGLEVEL":None,
+      "LOGID":None,
+      "CENTER_ID":None,
+      "QITOTAL_METHOD":None,
+      "RAVESCANSUN_OUT":"RAVESCANSUN_OUT = None",
+      "RAVE_PGF_COMPOSITING_USE_LAZY_LOADING":"RAVE_PGF_COMPOSITING_USE_LAZY_LOADING=%s"%str(self.rave_pgf_compositing_use_lazy_loading),
+      "RAVE_PGF_COMPOSITING_USE_LAZY_LOADING_PRELOADS":"RAVE_PGF_COMPOSITING_USE_LAZY_LOADING_PRELOADS=%s"%str(self.rave_pgf_compositing_use_lazy_loading_preloads),
+      "RAVE_MULTIPROCESSING_MAX_TASKS_PER_WORKER":"RAVE_MULTIPROCESSING_MAX_TASKS_PER_WORKER=None",
+      "RAVE_TILE_COMPOSITING_PROCESSES":"RAVE_TILE_COMPOSITING_PROCESSES=None",
+      "RAVE_TILE_COMPOSITING_TIMEOUT":"RAVE_TILE_COMPOSITING_TIMEOUT: int = %d"%self.rave_pgf_tiledcompositing_timeout,
+      "RAVE_TILE_COMPOSITING_ALLOW_MISSING_TILES":"RAVE_TILE_COMPOSITING_ALLOW_MISSING_TILES=%s"%("True" if self.rave_pgf_tiledcompositing_allow_missing_tiles else "False")
+    }
+    if self.rave_ctpath is not None:
+      assignments["CTPATH"] = "CTPATH = \"%s\""%self.rave_ctpath
+    if self.rave_pgfs is not None:
+      assignments["PGFs"] = "PGFs = %s"%self.rave_pgfs
+    if self.rave_loglevel is not None:
+      assignments["LOGLEVEL"] = "LOGLEVEL = \"%s\""%self.rave_loglevel
+    if self.rave_logid is not None:
+      assignments["LOGID"] = "LOGID = %s"%self.rave_logid
+    if self.rave_centerid is not None:
+      assignments["CENTER_ID"] = "CENTER_ID = \"%s\""%self.rave_centerid
+    if self.rave_qitotalmethod is not None:
+      assignments["QITOTAL_METHOD"] = "QITOTAL_METHOD = \"%s\""%self.rave_qitotalmethod
+    if self.rave_scansun_out_path:
+      assignments["RAVESCANSUN_OUT"] = "RAVESCANSUN_OUT = \"%s\""%self.rave_scansun_out_path
+    if self.rave_pgf_tasks_per_worker is not None:
+      assignments["RAVE_MULTIPROCESSING_MAX_TASKS_PER_WORKER"] = "RAVE_MULTIPROCESSING_MAX_TASKS_PER_WORKER=%d"%self.rave_pgf_tasks_per_worker
+    if self.rave_pgf_tiledcompositing_nrprocesses is not None:
+      assignments["RAVE_TILE_COMPOSITING_PROCESSES"] = "RAVE_TILE_COMPOSITING_PROCESSES=%d"%self.rave_pgf_tiledcompositing_nrprocesses
+    return rewriter.assignment_rewriter(assignments)
+
+  ##
+  # @param ravedefinesfile: the current rave_defines.py
+  # @param bltnodefile: the bltnode.properties file that rave should use
+  # @return the content of ravedefinesfile with the node specific values replaced
+  def render_rave_defines(self, ravedefinesfile, bltnodefile):
+    return rewriter.render_file(self._rave_defines_rewriter(bltnodefile), ravedefinesfile)
+
   def update_rave_defines(self, ravedefinesfile, bltnodefile):
-    fd = open(ravedefinesfile, "r")
-    rows = fd.readlines()
-    fd.close()
-    nrows = []
-    for row in rows:
-      if row.startswith("DEX_SPOE"):
-        row = "DEX_SPOE = \"%s\"\n"%self.dex_uri
-      elif row.startswith("DEX_NODENAME"):
-        row = "DEX_NODENAME = \"%s\"\n"%self.nodename
-      elif row.startswith("DEX_PRIVATEKEY"):
-        row = "DEX_PRIVATEKEY = \"%s/%s.priv\"\n"%(self.keystore_root,self.nodename)
-      elif row.startswith("BDB_CONFIG_FILE"):
-        row = "BDB_CONFIG_FILE = \"%s\"\n"%bltnodefile
-      elif row.startswith("CTPATH") and self.rave_ctpath is not None:
-        row = "CTPATH = \"%s\"\n"%self.rave_ctpath
-      elif row.startswith("PGFs") and self.rave_pgfs is not None:
-        row = "PGFs = %s\n"%self.rave_pgfs
-      elif row.startswith("LOGLEVEL") and self.rave_loglevel is not None:
-        row = "LOGLEVEL = \"%s\"\n"%self.rave_loglevel
-      elif row.startswith("LOGID") and self.rave_logid is not None:
-        row = "LOGID = %s\n"%self.rave_logid
-      elif row.startswith("CENTER_ID") and self.rave_centerid is not None:
-        row = "CENTER_ID = \"%s\"\n"%self.rave_centerid
-      elif row.startswith("QITOTAL_METHOD") and self.rave_qitotalmethod is not None:
-        row = "QITOTAL_METHOD = \"%s\"\n"%self.rave_qitotalmethod
-      elif row.startswith("RAVESCANSUN_OUT"):
-        if not self.rave_scansun_out_path:
-          row = "RAVESCANSUN_OUT = None\n"
-        else:
-          row = "RAVESCANSUN_OUT = \"%s\"\n"%self.rave_scansun_out_path
-      elif row.startswith("RAVE_PGF_COMPOSITING_USE_LAZY_LOADING_PRELOADS"):
-        row = "RAVE_PGF_COMPOSITING_USE_LAZY_LOADING_PRELOADS=%s\n"%str(self.rave_pgf_compositing_use_lazy_loading_preloads)
-      elif row.startswith("RAVE_PGF_COMPOSITING_USE_LAZY_LOADING"):
-        row = "RAVE_PGF_COMPOSITING_USE_LAZY_LOADING=%s\n"%str(self.rave_pgf_compositing_use_lazy_loading)
-      elif row.startswith("RAVE_MULTIPROCESSING_MAX_TASKS_PER_WORKER"):
-        if self.rave_pgf_tasks_per_worker is not None:
-          row = "RAVE_MULTIPROCESSING_MAX_TASKS_PER_WORKER=%d\n"%self.rave_pgf_tasks_per_worker
-        else:
-          row = "RAVE_MULTIPROCESSING_MAX_TASKS_PER_WORKER=None\n"
-      elif row.startswith("RAVE_TILE_COMPOSITING_PROCESSES"):
-        if self.rave_pgf_tiledcompositing_nrprocesses is not None:
-          row = "RAVE_TILE_COMPOSITING_PROCESSES=%d\n"%self.rave_pgf_tiledcompositing_nrprocesses
-        else:
-          row = "RAVE_TILE_COMPOSITING_PROCESSES=None\n"
-      elif row.startswith("RAVE_TILE_COMPOSITING_TIMEOUT"):
-        row = "RAVE_TILE_COMPOSITING_TIMEOUT: int = %d\n"%self.rave_pgf_tiledcompositing_timeout
-      elif row.startswith("RAVE_TILE_COMPOSITING_ALLOW_MISSING_TILES"):
-        row = "RAVE_TILE_COMPOSITING_ALLOW_MISSING_TILES=%s\n"%("True" if self.rave_pgf_tiledcompositing_allow_missing_tiles else "False")
-
-      nrows.append(row)
-    fp = open(ravedefinesfile, "w")
-    for row in nrows:
-      fp.write(row)
-    fp.close()
-    
-  def write_tomcat_server_file(self, tomcatserverfile):
-    server_template_file = os.path.join(os.path.dirname(__file__),"server.xml.template")
-    with open(server_template_file, "r") as fp:
-      template = fp.read()
-    template = template.replace("${baltrad.keystore.file}", self.keystore_jks)
-    template = template.replace("${baltrad.keystore.password}", self.keystore_pwd)
+    outputs.write_atomic(ravedefinesfile, self.render_rave_defines(ravedefinesfile, bltnodefile))
+
+  ##
+  # @return the content of the tomcat server.xml file
+  def render_tomcat_server_file(self):
     ajpconnector=""
     if self.ajp_connector_enabled:
       ajpconnector = ajpconnector + "    <Connector port=\"%d\"\n"%self.ajp_connector_port
@@ -632,22 +797,99 @@ class propertyhandler(object):
         ajpconnector = ajpconnector + "               secret=\"%s\" />\n"%self.ajp_connector_secret
       else:
         ajpconnector = ajpconnector + "               secretRequired=\"false\" />\n"
-    template = template.replace("${baltrad.ajpconnector}", ajpconnector)
+    return _get_template(SERVER_TEMPLATE_FILE).render({
+      "baltrad.keystore.file":self.keystore_jks,
+      "baltrad.keystore.password":self.keystore_pwd,
+      "baltrad.ajpconnector":ajpconnector,
+      "baltrad.tomcat.executor.max_threads":"%d"%self.tomcat_executor_max_threads,
+      "baltrad.tomcat.executor.min_spare_threads":"%d"%self.tomcat_executor_min_spare_threads,
+      "baltrad.tomcat.connector.accept_count":"%d"%self.tomcat_connector_accept_count,
+      "baltrad.tomcat.connector.max_connections":"%d"%self.tomcat_connector_max_connections,
+      "baltrad.tomcat.connector.keepalive_timeout":"%d"%self.tomcat_connector_keepalive_timeout,
+      "baltrad.tomcat.connector.max_keepalive_requests":"%d"%self.tomcat_connector_max_keepalive_requests,
+      "baltrad.tomcat.connector.compression":self.tomcat_connector_compression,
+      "baltrad.tomcat.connector.compression_min_size":"%d"%self.tomcat_connector_compression_min_size,
+      "baltrad.tomcat.connector.compressible_mime_type":self.tomcat_connector_compressible_mime_type
+    })
+
+  ##
+  # @return the keys of the tomcat memory sizes that are not set
+  def unset_tomcat_memory_keys(self):
+    return [p.key for p in PROPERTIES if p.attribute in _TOMCAT_MEMORY_ATTRIBUTES and not getattr(self, p.attribute)]
+
+  ##
+  # @param res: the tune.host_resources of the host tomcat runs on, used for deriving
+  # the memory sizes that are not set. If None, those options are left out and the
+  # JVM defaults apply.
+  # @return the content of the tomcat setenv.sh file
+  def render_tomcat_setenv(self, res=None):
+    heap_min, heap_max, direct = self.tomcat_jvm_heap_min, self.tomcat_jvm_heap_max, self.tomcat_jvm_max_direct_memory
+    if res is not None and (not heap_min or not heap_max or not direct):
+      from baltrad.config import tune
+      derived_heap, derived_direct = tune.tomcat_memory(self, res)
+      heap_max = heap_max or "%dm"%(derived_heap // tune.MB)
+      heap_min = heap_min or heap_max
+      direct = direct or "%dm"%(derived_direct // tune.MB)
+
+    opts = []
+    if heap_min:
+      opts.append("-Xms%s"%heap_min)
+    if heap_max:
+      opts.append("-Xmx%s"%heap_max)
+    if direct:
+      opts.append("-XX:MaxDirectMemorySize=%s"%direct)
+    if self.tomcat_jvm_gc:
+      opts.append("-XX:+Use%sGC"%self.tomcat_jvm_gc)
+    if self.tomcat_jvm_max_gc_pause_millis is not None:
+      opts.append("-XX:MaxGCPauseMillis=%d"%self.tomcat_jvm_max_gc_pause_millis)
+    if self.tomcat_jvm_extra_options:
+      opts.append(self.tomcat_jvm_extra_options)
+
+    s = []
+    s.append("#!/bin/sh\n")
+    s.append("# Generated by baltrad-config from the baltrad.tomcat.jvm.* properties, changes will be overwritten\n")
+    s.append("CATALINA_OPTS=\"$CATALINA_OPTS %s\"\n"%" ".join(opts))
+    s.append("export CATALINA_OPTS\n")
+    return "".join(s)
 
+  ##
+  # Writes the tomcat setenv.sh file
+  # @param setenvfile: the setenv.sh file
+  # @param res: the tune.host_resources used for memory sizes that are not set or None
+  def write_tomcat_setenv(self, setenvfile, res=None):
+    self._write_file(setenvfile, self.render_tomcat_setenv(res))
+
+  ##
+  # Called before a changed tomcat server.xml file is replaced. The old content is
+  # saved as a backup and the differences are printed.
+  # @param tomcatserverfile: the server.xml file
+  # @param original: the current content
+  # @param content: the new content
+  def backup_tomcat_server_file(self, tomcatserverfile, original, content):
+    backup_name="%s.%s"%(tomcatserverfile, time.strftime("%Y%m%d%H%M%S"))
+    with os.fdopen(os.open(backup_name, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0o600), "w") as fp:
+      fp.write(original)
+    shutil.copymode(tomcatserverfile, backup_name)
+    print("WARNING! Tomcat server.xml has changed. Old file has been saved as %s"%backup_name)
+    import difflib
+    for line in difflib.unified_diff(original.splitlines(True), content.splitlines(True)):
+      print(line, end = '')
+
+  ##
+  # Writes the tomcat server.xml file if it differs from the existing one.
+  # @param tomcatserverfile: the server.xml file
+  def write_tomcat_server_file(self, tomcatserverfile):
+    content = self.render_tomcat_server_file()
     with open(tomcatserverfile) as fp:
       original = fp.read()
-    if template != original:
-      backup_name="%s.%s"%(tomcatserverfile, time.strftime("%Y%m%d%H%M%S"))
-      shutil.copy(tomcatserverfile, backup_name)
-      with open(tomcatserverfile, "w") as fp:
-        fp.write(template)
-      print("WARNING! Tomcat server.xml has changed. Old file has been saved as %s"%backup_name)
-      text1 = open(backup_name).readlines()
-      text2 = open(tomcatserverfile).readlines()
-      for line in difflib.unified_diff(text1, text2):
-        print(line, end = '')
+    if content != original:
+      self.backup_tomcat_server_file(tomcatserverfile, original, content)
+      self._write_file(tomcatserverfile, content)
 
-  def update_application_context(self, appcontextfile):
+  ##
+  # @param appcontextfile: the current applicationContext.xml
+  # @return the content of appcontextfile with the port mappings replaced
+  def render_application_context(self, appcontextfile):
     STARTTAG="<security:port-mappings>"
     ENDTAG="</security:port-mappings>"
     newrows = []
@@ -672,7 +914,75 @@ class propertyhandler(object):
         pass
       else:
         newrows.append(row)
-        
-    with open(appcontextfile, "w") as fp:
-      for row in newrows:
-        fp.write(row)
+    return "".join(newrows)
+
+  def update_application_context(self, appcontextfile):
+    self._write_file(appcontextfile, self.render_application_context(appcontextfile))
+
+# The attributes of a propertyhandler, all of them are restored from a snapshot
+_SNAPSHOT_ATTRIBUTES = frozenset(propertyhandler().__dict__)
+
+# Identifies the layout of the cached snapshots, a snapshot written by a
+# version with other properties or attributes is ignored
+_CACHE_VERSION = hashlib.sha256(" ".join([p.key for p in PROPERTIES] + sorted(_SNAPSHOT_ATTRIBUTES)).encode("utf-8")).hexdigest()[:16]
+
+def _file_signature(filename):
+  st = os.stat(filename)
+  return [filename, st.st_mtime_ns, st.st_size]
+
+##
+# Returns a propertyhandler for the configuration file, using a snapshot of the
+# parsed values if the file and all files it includes are unchanged since the
+# snapshot was written. Otherwise the file is parsed and a new snapshot written.
+# The snapshots are JSON and contain passwords. They are only used if both the
+# snapshot and the cache directory are owned by the current user and not
+# writable by anyone else, since the values decide which scripts are run.
+# @param path: the configuration file
+# @param cachedir: where the snapshots are kept, default is $XDG_CACHE_HOME/baltrad-config
+# @return a propertyhandler
+def load_cached(path, cachedir=None):
+  import json
+  path = os.path.abspath(path)
+  if cachedir is None:
+    cachedir = outputs.default_cache_dir()
+  cachefile = os.path.join(cachedir, "%s.json"%hashlib.sha256(path.encode("utf-8")).hexdigest())
+
+  try:
+    private = outputs.is_private(cachedir)
+  except OSError:
+    private = None
+  if private:
+    try:
+      if outputs.is_private(cachefile):
+        with open(cachefile, "r") as fp:
+          snapshot = json.load(fp)
+        signatures = snapshot["signatures"]
+        if snapshot["version"] == _CACHE_VERSION and set(snapshot["values"]) == _SNAPSHOT_ATTRIBUTES and signatures and signatures[0][0] == path:
+          if all([_file_signature(s[0]) == s for s in signatures]):
+            handler = propertyhandler.__new__(propertyhandler)
+            handler.__dict__.update(snapshot["values"])
+            handler.post_config_script_depends = [tuple(d) for d in handler.post_config_script_depends]
+            return handler
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+      pass
+
+  handler = propertyhandler()
+  handler.open_config_file(path)
+  if private is False:
+    return handler
+
+  try:
+    if private is None:
+      os.makedirs(cachedir, 0o700)
+    data = json.dumps({"version":_CACHE_VERSION, "signatures":[_file_signature(f) for f in handler.loaded_files], "values":handler.__dict__})
+    (fd, tmpname) = tempfile.mkstemp(dir=cachedir, prefix=".snapshot.")
+    try:
+      with os.fdopen(fd, "w") as fp:
+        fp.write(data)
+      os.rename(tmpname, cachefile)
+    except:
+      os.unlink(tmpname)
+      raise
+  except (IOError, OSError, TypeError):
+    pass
+  return handler
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import re
+
+##
+# Rewrites the content of a file. The result is returned, not written, so that
+# it can be written with outputs.write_atomic or in an outputs.output_transaction.
+# @param rewriter: a property_rewriter or assignment_rewriter
+# @param filename: the file to read
+# @return the rewritten content
+def render_file(rewriter, filename):
+  with open(filename, "r") as fp:
+    return "".join(rewriter.rewrite_lines(fp))
+
+##
+# Replaces the values in a key=value file. All keys are matched with one
+# compiled expression and the new value is looked up in a dictionary so the
+# cost per line does not depend on the number of keys.
+#
+class property_rewriter(object):
+  ##
+  # Constructor
+  # @param values: dictionary of key -> new value
+  # @param append_missing: if keys that are not defined in the file should be appended
+  def __init__(self, values, append_missing=False):
+    self._lines = {}
+    for k in values:
+      self._lines[k] = "%s=%s"%(k, values[k])
+    keys = sorted(values, key=len, reverse=True)
+    self._pattern = re.compile(r"^\s*(%s)\s*="%"|".join([re.escape(k) for k in keys]))
+    self._append_missing = append_missing
+
+  ##
+  # @param line: the line to rewrite
+  # @return the line with the value replaced if the key is handled, otherwise the line as is
+  def rewrite_line(self, line):
+    m = self._pattern.match(line)
+    if m is None:
+      return line
+    if line.endswith("\n"):
+      return self._lines[m.group(1)] + "\n"
+    return self._lines[m.group(1)]
+
+  ##
+  # @param lines: an iterable of lines
+  # @return a generator of rewritten lines
+  def rewrite_lines(self, lines):
+    match = self._pattern.match
+    seen = set()
+    line = "\n"
+    for line in lines:
+      m = match(line)
+      if m is None:
+        yield line
+      else:
+        seen.add(m.group(1))
+        yield self.rewrite_line(line)
+
+    if self._append_missing:
+      missing = [k for k in self._lines if k not in seen]
+      if missing:
+        if not line.endswith("\n"):
+          yield "\n"
+        for k in missing:
+          yield self._lines[k] + "\n"
+
+##
+# Replaces top level assignments in a python module like rave_defines.py. The
+# assignment target of each line is extracted once and looked up in a
+# dictionary of replacement lines, so the order of the names does not matter
+# and a name never matches another name that it is a prefix of.
+#
+class assignment_rewriter(object):
+  _pattern = re.compile(r"([A-Za-z_][A-Za-z0-9_]*)\s*(?::[^=\n]*)?=(?!=)")
+
+  ##
+  # Constructor
+  # @param assignments: dictionary of name -> the complete assignment line without newline.
+  # Names with the value None are left as they are.
+  # @param append_missing: if assignments that are not defined in the file should be appended
+  def __init__(self, assignments, append_missing=True):
+    self._lines = {}
+    for k in assignments:
+      if assignments[k] is not None:
+        self._lines[k] = assignments[k] + "\n"
+    self._append_missing = append_missing
+
+  ##
+  # @param lines: an iterable of lines
+  # @return a generator of rewritten lines
+  def rewrite_lines(self, lines):
+    match = self._pattern.match
+    replacements = self._lines
+    seen = set()
+    line = "\n"
+    for line in lines:
+      m = match(line)
+      if m is not None:
+        name = m.group(1)
+        if name in replacements:
+          seen.add(name)
+          if line.endswith("\n"):
+            yield replacements[name]
+          else:
+            yield replacements[name][:-1]
+          continue
+      yield line
+
+    if self._append_missing:
+      missing = [name for name in replacements if name not in seen]
+      if missing:
+        if not line.endswith("\n"):
+          yield "\n"
+        yield "\n# Added by baltrad-config\n"
+        for name in missing:
+          yield replacements[name]
+
+##
+# A text template with ${name} placeholders. The template is split into
+# literal and placeholder segments once so that rendering is a single join.
+#
+class compiled_template(object):
+  _pattern = re.compile(r"\$\{([^}]+)\}")
+
+  ##
+  # Constructor
+  # @param text: the template text
+  def __init__(self, text):
+    self._segments = self._pattern.split(text)
+    self._placeholders = [(i, self._segments[i]) for i in range(1, len(self._segments), 2)]
+    for i, name in self._placeholders:
+      self._segments[i] = "${%s}"%name
+
+  ##
+  # @param values: dictionary of placeholder name -> value
+  # @return the rendered text. Placeholders without a value are kept as they are.
+  def render(self, values):
+    segments = list(self._segments)
+    for i, name in self._placeholders:
+      if name in values:
+        segments[i] = values[name]
+    return "".join(segments)
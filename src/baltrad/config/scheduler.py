@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import concurrent.futures
+
+##
+# Runs a number of steps on a thread pool. Each step declares the steps it
+# depends on and is started as soon as all of them have finished. If a step
+# fails, no new steps are started and the exception is raised when the
+# running steps have finished.
+#
+class step_scheduler(object):
+  ##
+  # Constructor
+  # @param max_workers: the maximum number of steps running at the same time
+  def __init__(self, max_workers=None):
+    self._max_workers = max_workers
+    self._steps = {}
+
+  ##
+  # Adds a step
+  # @param name: the unique name of the step
+  # @param func: the function to call, it is called without arguments
+  # @param depends: the names of the steps that must have finished first
+  def add(self, name, func, depends=()):
+    if name in self._steps:
+      raise Exception("Step %s already added"%name)
+    self._steps[name] = (func, tuple(depends))
+
+  ##
+  # Verifies that all dependencies exist and that there are no cycles
+  def _validate(self):
+    for name in self._steps:
+      for d in self._steps[name][1]:
+        if d not in self._steps:
+          raise Exception("Step %s depends on unknown step %s"%(name, d))
+
+    visited = {}
+    def visit(name, path):
+      if visited.get(name) == "done":
+        return
+      if visited.get(name) == "visiting":
+        raise Exception("Cyclic step dependency: %s"%" -> ".join(path + [name]))
+      visited[name] = "visiting"
+      for d in self._steps[name][1]:
+        visit(d, path + [name])
+      visited[name] = "done"
+
+    for name in self._steps:
+      visit(name, [])
+
+  ##
+  # Runs all steps
+  # @return a dictionary with the result of each step
+  def run(self):
+    self._validate()
+    results = {}
+    remaining = dict([(name, set(self._steps[name][1])) for name in self._steps])
+    failure = None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+      running = {}
+      while True:
+        if failure is None:
+          for name in [n for n in remaining if not remaining[n]]:
+            del remaining[name]
+            running[executor.submit(self._steps[name][0])] = name
+        if not running:
+          break
+
+        done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+          name = running.pop(future)
+          try:
+            results[name] = future.result()
+          except Exception as e:
+            if failure is None:
+              failure = e
+            continue
+          for n in remaining:
+            remaining[n].discard(name)
+
+    if failure is not None:
+      raise failure
+    return results
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import io
+import re
+import threading
+
+# Characters that may start a comment, a quoted string, a dollar quote or end a statement
+_SPECIAL = re.compile(r"--|/\*|['\"$;]")
+_BLOCK_COMMENT = re.compile(r"/\*|\*/")
+_DOLLAR_QUOTE = re.compile(r"\$([A-Za-z_\u0080-\uffff][A-Za-z0-9_\u0080-\uffff]*)?\$")
+_ESCAPE_STRING = re.compile(r"\\.|'", re.S)
+_COPY_FROM_STDIN = re.compile(r"^\s*COPY\b.*\bFROM\s+STDIN\b", re.I | re.S)
+
+##
+# One statement of a sql script
+#
+class sql_statement(object):
+  ##
+  # Constructor
+  # @param text: the statement without the terminating semicolon and comments
+  # @param line: the line in the script where the statement starts
+  # @param copy_data: the data of a COPY ... FROM stdin statement, otherwise None
+  def __init__(self, text, line, copy_data=None):
+    self.text = text
+    self.line = line
+    self.copy_data = copy_data
+
+  ##
+  # @return the first line of the statement, shortened to at most 60 characters
+  def summary(self):
+    first = self.text.split("\n", 1)[0]
+    if len(first) > 60 or "\n" in self.text:
+      first = first[:57] + "..."
+    return first
+
+def _is_identifier_char(c):
+  return c.isalnum() or c == "_" or c == "$"
+
+##
+# Splits a sql script into statements while reading it. Handles -- and nested
+# /* */ comments, '' strings, E'' strings with backslash escapes, "" identifiers,
+# dollar quoting with and without tags and the data of COPY ... FROM stdin, which
+# ends at a line containing only \. as in psql. Comments are removed.
+# @param lines: an iterable of lines, e.g. an open file
+# @param firstline: the line number of the first line
+# @return a generator of sql_statement
+def split_statements(lines, firstline=1):
+  parts = []
+  start = None
+  state = None      # None, "'", "e'", '"', "/*" or a dollar quote
+  depth = 0
+  copy = None
+  lineno = firstline - 1
+
+  for line in lines:
+    lineno = lineno + 1
+    if copy is not None:
+      if line.rstrip("\r\n") == "\\.":
+        yield sql_statement(copy.text, copy.line, "".join(copy_data))
+        copy = None
+      else:
+        copy_data.append(line)
+      continue
+
+    i = 0
+    n = len(line)
+    while i < n:
+      if state is None:
+        m = _SPECIAL.search(line, i)
+        end = m.start() if m else n
+        if start is None and line[i:end].strip():
+          start = lineno
+        parts.append(line[i:end])
+        if not m:
+          break
+        token = m.group(0)
+        if token == "--":
+          parts.append("\n")
+          break
+        if token == "/*":
+          state, depth, i = "/*", 1, m.end()
+          continue
+        if start is None:
+          start = lineno
+        if token == ";":
+          text = "".join(parts).strip()
+          parts, i = [], m.end()
+          if text:
+            if _COPY_FROM_STDIN.match(text):
+              copy, copy_data = sql_statement(text, start), []
+              start = None
+              break
+            yield sql_statement(text, start)
+          start = None
+          continue
+        if token == "$":
+          d = _DOLLAR_QUOTE.match(line, m.start())
+          if d and (m.start() == 0 or not _is_identifier_char(line[m.start() - 1])):
+            state = d.group(0)
+            parts.append(state)
+            i = d.end()
+          else:
+            parts.append("$")
+            i = m.end()
+          continue
+        if token == "'" and m.start() > 0 and line[m.start() - 1] in "eE" and (m.start() == 1 or not _is_identifier_char(line[m.start() - 2])):
+          state = "e'"
+        else:
+          state = token
+        parts.append(token)
+        i = m.end()
+      elif state == "/*":
+        m = _BLOCK_COMMENT.search(line, i)
+        if not m:
+          break
+        depth = depth + (1 if m.group(0) == "/*" else -1)
+        i = m.end()
+        if depth == 0:
+          state = None
+          parts.append(" ")
+      elif state == "e'":
+        j = i
+        while True:
+          m = _ESCAPE_STRING.search(line, j)
+          if not m or m.group(0) == "'":
+            break
+          j = m.end()
+        end = m.end() if m else n
+        parts.append(line[i:end])
+        if m:
+          state = None
+        i = end
+      else:
+        end = line.find(state, i)
+        if end < 0:
+          parts.append(line[i:])
+          break
+        end = end + len(state)
+        parts.append(line[i:end])
+        state = None
+        i = end
+
+  if copy is not None:
+    yield sql_statement(copy.text, copy.line, "".join(copy_data))
+    return
+  text = "".join(parts).strip()
+  if text:
+    yield sql_statement(text, start)
+
+##
+# Groups statements into batches that are sent to the server in one call.
+# A COPY ... FROM stdin statement is always a batch of its own.
+# @param statements: an iterable of sql_statement
+# @param size: the maximum number of statements in a batch
+# @return a generator of lists of sql_statement
+def batches(statements, size=1):
+  batch = []
+  for s in statements:
+    if s.copy_data is not None:
+      if batch:
+        yield batch
+        batch = []
+      yield [s]
+      continue
+    batch.append(s)
+    if len(batch) >= size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+##
+# Executes a batch of statements
+# @param dbcursor: a psycopg2 cursor
+# @param batch: a list of sql_statement from batches
+def execute_batch(dbcursor, batch):
+  if batch[0].copy_data is not None:
+    dbcursor.copy_expert(batch[0].text, io.StringIO(batch[0].copy_data))
+  else:
+    dbcursor.execute(";\n".join([s.text for s in batch]))
+
+##
+# Collects the execution times of statements, can be shared between threads
+#
+class statement_report(object):
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.entries = []
+
+  ##
+  # Adds the time of a batch
+  # @param script: the name of the script
+  # @param batch: the list of sql_statement
+  # @param elapsed: the time in seconds
+  def add(self, script, batch, elapsed):
+    text = batch[0].summary()
+    if len(batch) > 1:
+      text = "%s (+%d statements)"%(text, len(batch) - 1)
+    with self._lock:
+      self.entries.append((elapsed, script, batch[0].line, text))
+
+  ##
+  # @param count: the number of statements to return
+  # @return a list of (elapsed, script, line, summary), the slowest first
+  def slowest(self, count=20):
+    with self._lock:
+      return sorted(self.entries, key=lambda e: -e[0])[:count]
+
+  ##
+  # Writes the slowest statements and the total time per script
+  # @param filename: the report file
+  # @param count: the number of statements to include
+  def write(self, filename, count=20):
+    with open(filename, "w") as fp:
+      fp.write(self.format(count))
+
+  ##
+  # @param count: the number of statements to include
+  # @return the report as a string
+  def format(self, count=20):
+    with self._lock:
+      entries = list(self.entries)
+    totals = {}
+    for elapsed, script, _, _ in entries:
+      n, t = totals.get(script, (0, 0.0))
+      totals[script] = (n + 1, t + elapsed)
+    lines = ["%d statement batch(es), %.3fs in total"%(len(entries), sum([e[0] for e in entries])), "", "Per script:"]
+    for script in sorted(totals):
+      lines.append("  %10.3fs %6d  %s"%(totals[script][1], totals[script][0], script))
+    lines.extend(["", "Slowest statements:"])
+    for elapsed, script, line, text in self.slowest(count):
+      lines.append("  %10.3fs  %s:%d  %s"%(elapsed, script, line, text))
+    return "\n".join(lines) + "\n"
+
+  def __str__(self):
+    return self.format()
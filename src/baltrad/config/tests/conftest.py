@@ -0,0 +1,119 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import grp
+import os
+import pwd
+
+import pytest
+
+from baltrad.config import propertyhandler
+
+# Number of extra keys in the synthetic configuration file
+SYNTHETIC_KEYS = 10000
+
+##
+# A configuration file with the default values, as written by init
+@pytest.fixture
+def config_file(tmp_path):
+  path = str(tmp_path / "localhost.properties")
+  propertyhandler.propertyhandler().write_config_file(path)
+  return path
+
+##
+# A configuration file with the default values and SYNTHETIC_KEYS site specific keys
+@pytest.fixture
+def synthetic_config_file(tmp_path):
+  path = str(tmp_path / "synthetic.properties")
+  with open(path, "w") as fp:
+    fp.write(str(propertyhandler.propertyhandler()))
+    for i in range(SYNTHETIC_KEYS):
+      fp.write("site.extra.property.%d = value %d\n"%(i, i))
+  return path
+
+# Number of filler lines in the files modified by the setup at scale 1, roughly
+# the size of the files on an installed node
+DEX_LINES = 60
+RAVE_DEFINES_LINES = 150
+APPCONTEXT_LINES = 120
+EXTRA_PROPERTIES = 20
+
+##
+# Creates the configuration file and the files modified by the setup in a directory
+# @param directory: where the files are created
+# @param scale: multiplies the size of the files, 1 is about the size on a node
+# @return a dictionary name -> path of the created files
+def create_setup_files(directory, scale=1):
+  j = lambda name: os.path.join(directory, name)
+  files = {
+    "conf":j("localhost.properties"), "bltnode":j("bltnode.properties"), "dex":j("dex.properties"),
+    "dexdb":j("db.properties"), "dexfc":j("dex.fc.properties"), "dexbeast":j("dex.beast.properties"),
+    "ravedefines":j("rave_defines.py"), "server":j("server.xml"), "appcontext":j("applicationContext.xml")
+  }
+
+  # The current user owns the files so that the ownership change of the setup is a no-op
+  a = propertyhandler.propertyhandler()
+  a.nodename = "test.node"
+  a.baltrad_user = pwd.getpwuid(os.getuid())[0]
+  a.baltrad_group = grp.getgrgid(os.getgid())[0]
+  a.keystore_root = j("keys")
+  with open(files["conf"], "w") as fp:
+    fp.write(str(a))
+    for i in range(EXTRA_PROPERTIES * scale):
+      fp.write("site.extra.property.%d = value %d\n"%(i, i))
+
+  with open(files["dex"], "w") as fp:
+    fp.write("key.alias=old\nnode.name=old\nkeystore.directory=/old\nnode.address=http://old\n")
+    fp.write("framepublisher.min_poolsize=1\nframepublisher.max_poolsize=5\nframepublisher.queuesize=100\n")
+    for i in range(DEX_LINES * scale):
+      fp.write("dex.extra.property.%d=%d\n"%(i, i))
+
+  with open(files["ravedefines"], "w") as fp:
+    fp.write("import os\nDEX_SPOE = \"http://old\"\nDEX_NODENAME = \"old\"\nPGFs = 4\n")
+    for i in range(RAVE_DEFINES_LINES * scale):
+      fp.write("RAVE_EXTRA_%d = os.path.join(\"/opt/baltrad\", \"%d\")\n"%(i, i))
+
+  with open(files["appcontext"], "w") as fp:
+    fp.write("<beans>\n")
+    for i in range(APPCONTEXT_LINES * scale // 2):
+      fp.write("  <bean id=\"bean%d\" class=\"eu.baltrad.Bean%d\">\n  </bean>\n"%(i, i))
+    fp.write("  <security:port-mappings>\n    <security:port-mapping http=\"1\" https=\"2\"/>\n  </security:port-mappings>\n</beans>\n")
+
+  with open(files["server"], "w") as fp:
+    fp.write(a.render_tomcat_server_file())
+  return files
+
+##
+# The configuration and the files modified by the setup. The size is about the
+# size found on a node, unless a scale is given with indirect parametrization.
+@pytest.fixture
+def setup_files(request, tmp_path):
+  return create_setup_files(str(tmp_path), getattr(request, "param", 1))
+
+##
+# The arguments of a setup that writes all outputs to setup_files, parsed with the
+# parser of the command line so that new options get their default values
+@pytest.fixture
+def setup_args(setup_files):
+  from baltrad.config import main
+  return main.create_parser().parse_args([
+    "setup", "--conf=%s"%setup_files["conf"], "--bltnodefile=%s"%setup_files["bltnode"], "--dexfile=%s"%setup_files["dex"],
+    "--dexdbfile=%s"%setup_files["dexdb"], "--dexfcfile=%s"%setup_files["dexfc"], "--dexbeastfile=%s"%setup_files["dexbeast"],
+    "--ravedefinesfile=%s"%setup_files["ravedefines"], "--tomcatserverfile=%s"%setup_files["server"],
+    "--appcontextfile=%s"%setup_files["appcontext"]])
@@ -0,0 +1,89 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import json
+import os
+import sys
+
+import pytest
+
+from baltrad.config import bltcmd
+
+NAMES = ("DEX_SPOE", "DEX_NODENAME")
+
+def read(tmp_path, content):
+  path = tmp_path / "rave_defines.py"
+  path.write_text(content)
+  return bltcmd.read_literal_assignments(str(path), NAMES)
+
+def test_literal_assignments(tmp_path):
+  assert read(tmp_path, "import os\nNODE = 'n1'\nDEX_SPOE = 'http://h:8080/BaltradDex'\nDEX_NODENAME = NODE\nOTHER = os.getcwd()\n") == \
+    {"DEX_SPOE":"http://h:8080/BaltradDex", "DEX_NODENAME":"n1"}
+
+def test_missing_name_is_unresolved(tmp_path):
+  assert read(tmp_path, "DEX_SPOE = 'http://h'\n") is None
+
+def test_assignment_in_block_is_unresolved(tmp_path):
+  assert read(tmp_path, "DEX_SPOE = 'http://h'\ntry:\n  DEX_NODENAME = 'a'\nexcept ImportError:\n  pass\n") is None
+  assert read(tmp_path, "DEX_SPOE = 'http://h'\nDEX_NODENAME = 'a'\nif True:\n  DEX_NODENAME = 'b'\n") is None
+
+def test_star_import_is_unresolved(tmp_path):
+  assert read(tmp_path, "from site_defines import *\nDEX_SPOE = 'http://h'\n") is None
+
+def test_imported_name_is_unresolved(tmp_path):
+  assert read(tmp_path, "from site_defines import DEX_NODENAME\nDEX_SPOE = 'http://h'\n") is None
+
+def test_computed_value_is_unresolved(tmp_path):
+  assert read(tmp_path, "import socket\nDEX_SPOE = 'http://h'\nDEX_NODENAME = socket.gethostname()\n") is None
+
+@pytest.fixture
+def rave_defines(tmp_path, monkeypatch):
+  libdir = tmp_path / "lib"
+  libdir.mkdir()
+  (libdir / "rave_defines.py").write_text("DEX_SPOE = 'http://h:8080/BaltradDex'\nDEX_NODENAME = 'n1'\nDEX_PRIVATEKEY = '/keys/n1.priv'\n")
+  monkeypatch.syspath_prepend(str(libdir))
+  monkeypatch.delitem(sys.modules, "rave_defines", raising=False)
+  monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+  return str(tmp_path / "cache" / "baltrad-config")
+
+def tamper(cachedir):
+  path = os.path.join(cachedir, "bltcmd-defaults.json")
+  with open(path) as fp:
+    cached = json.load(fp)
+  cached["values"]["DEX_SPOE"] = "http://attacker"
+  with open(path, "w") as fp:
+    json.dump(cached, fp)
+  return path
+
+def test_read_rave_defines_uses_private_cache(rave_defines):
+  assert bltcmd.read_rave_defines()["DEX_NODENAME"] == "n1"
+  assert os.stat(os.path.join(rave_defines, "bltcmd-defaults.json")).st_mode & 0o777 == 0o600
+  tamper(rave_defines)
+  assert bltcmd.read_rave_defines()["DEX_SPOE"] == "http://attacker"
+
+def test_read_rave_defines_ignores_writable_cache_directory(rave_defines):
+  bltcmd.read_rave_defines()
+  tamper(rave_defines)
+  os.chmod(rave_defines, 0o777)
+  assert bltcmd.read_rave_defines()["DEX_SPOE"] == "http://h:8080/BaltradDex"
+
+def test_read_rave_defines_ignores_writable_cache_file(rave_defines):
+  bltcmd.read_rave_defines()
+  os.chmod(tamper(rave_defines), 0o666)
+  assert bltcmd.read_rave_defines()["DEX_SPOE"] == "http://h:8080/BaltradDex"
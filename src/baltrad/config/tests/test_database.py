@@ -0,0 +1,167 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import hashlib
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from baltrad.config import database
+
+##
+# A connection that records the executed sql and keeps the ledger in a dictionary
+# with the same primary key as the ledger table
+class fake_connection(object):
+  def __init__(self, fail=None):
+    self.closed = False
+    self.executed = []
+    self.ledger = {}
+    self.pending = {}
+    self.fail = fail
+    self.commits = 0
+    self.rollbacks = 0
+
+  def cursor(self):
+    return fake_cursor(self)
+
+  def commit(self):
+    self.ledger.update(self.pending)
+    self.pending = {}
+    self.commits = self.commits + 1
+
+  def rollback(self):
+    self.pending = {}
+    self.rollbacks = self.rollbacks + 1
+
+class fake_cursor(object):
+  def __init__(self, connection):
+    self.connection = connection
+    self.rows = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    return False
+
+  def execute(self, sql, params=None):
+    c = self.connection
+    if c.fail is not None and c.fail in sql:
+      raise psycopg2.DatabaseError("failed: %s"%sql)
+    if sql.startswith("INSERT INTO " + database.LEDGER_TABLE):
+      key = (params[0], params[2])
+      if key in c.ledger or key in c.pending:
+        raise psycopg2.DatabaseError("duplicate key value violates unique constraint")
+      c.pending[key] = params[1]
+    elif sql.startswith("SELECT checksum FROM " + database.LEDGER_TABLE):
+      self.rows = [(k[1],) for k in c.ledger if k[0] == params[0]]
+    c.executed.append(sql)
+
+  def fetchall(self):
+    return self.rows
+
+def create_database(connection):
+  db = database.baltrad_database("bltnode.properties", "localhost", "baltrad", "baltrad", "secret")
+  db._connection = connection
+  return db
+
+def write_script(tmp_path, text):
+  path = str(tmp_path / "upgrade.sql")
+  with open(path, "w") as fp:
+    fp.write(text)
+  return path
+
+REPEATED = "UPDATE t SET n = n + 1;\n%s\nUPDATE t SET n = n + 1;\n%s\nUPDATE t SET n = n + 1;\n"%(database.CHUNK_MARKER, database.CHUNK_MARKER)
+
+def test_split_chunks_gives_repeated_chunks_their_own_checksum():
+  chunks = database.split_chunks(REPEATED)
+  assert [c[1] for c in chunks] == [1, 2, 4]
+  assert chunks[1][2] == chunks[2][2]
+  assert len(set([c[0] for c in chunks])) == 3
+
+def test_split_chunks_checksum_of_first_occurrence_is_the_chunk_hash():
+  chunks = database.split_chunks("CREATE TABLE a (id integer);\n")
+  assert chunks[0][0] == hashlib.sha256(b"CREATE TABLE a (id integer);\n").hexdigest()
+
+def test_run_migrations_applies_repeated_chunks_once_each(tmp_path, capsys):
+  path = write_script(tmp_path, REPEATED)
+  connection = fake_connection()
+  create_database(connection)._run_migrations(path, "dex", "dex")
+  assert [s for s in connection.executed if s.startswith("UPDATE")] == ["UPDATE t SET n = n + 1"] * 3
+  assert len(connection.ledger) == 3
+
+  connection.executed = []
+  create_database(connection)._run_migrations(path, "dex", "dex")
+  assert [s for s in connection.executed if s.startswith("UPDATE")] == []
+  assert "Applied 0 of 3 chunk(s) of dex/upgrade.sql" in capsys.readouterr().out
+
+def failing_lines():
+  yield "INSERT INTO t VALUES (1);\n"
+  yield "INSERT INTO t VALUES (2);\n"
+  raise OSError("read failed")
+
+def test_execute_sql_rolls_back_when_reading_the_script_fails():
+  connection = fake_connection()
+  with pytest.raises(OSError):
+    create_database(connection)._execute_sql(failing_lines(), "upgrade.sql", "dex")
+  assert connection.executed == ["INSERT INTO t VALUES (1)", "INSERT INTO t VALUES (2)"]
+  assert (connection.commits, connection.rollbacks) == (0, 1)
+
+def test_execute_sql_rolls_back_to_savepoint_when_reading_the_script_fails():
+  connection = fake_connection()
+  db = create_database(connection)
+  db._in_transaction = True
+  with pytest.raises(OSError):
+    db._execute_sql(failing_lines(), "upgrade.sql", "dex")
+  assert connection.executed == ["SAVEPOINT baltrad_script", "INSERT INTO t VALUES (1)", "INSERT INTO t VALUES (2)", "ROLLBACK TO SAVEPOINT baltrad_script"]
+  assert (connection.commits, connection.rollbacks) == (0, 0)
+
+def test_execute_sql_reports_where_a_statement_failed():
+  connection = fake_connection(fail="VALUES (2)")
+  with pytest.raises(Exception, match="Failed to run baltrad dex db scheme at upgrade.sql:2 \\(INSERT INTO t VALUES \\(2\\)\\)"):
+    create_database(connection)._execute_sql(failing_lines(), "upgrade.sql", "dex")
+  assert (connection.commits, connection.rollbacks) == (0, 1)
+
+def test_applied_chunks_uses_a_savepoint_in_a_transaction():
+  connection = fake_connection(fail="CREATE TABLE IF NOT EXISTS")
+  db = create_database(connection)
+  db._in_transaction = True
+  with pytest.raises(Exception, match="Failed to read the baltrad_config_ledger table"):
+    db._applied_chunks("dex/upgrade.sql")
+  assert connection.executed == ["SAVEPOINT baltrad_ledger", "SELECT pg_advisory_xact_lock(hashtext(%s))", "ROLLBACK TO SAVEPOINT baltrad_ledger"]
+  assert (connection.commits, connection.rollbacks) == (0, 0)
+
+def test_single_transaction_is_rolled_back_when_a_component_fails():
+  connection = fake_connection()
+  db = create_database(connection)
+  def fail():
+    raise Exception("upgrade failed")
+  db._succeed = lambda: None
+  db._fail = fail
+  with pytest.raises(Exception, match="dex: upgrade failed"):
+    db._run_components("upgrade", [("bdb", "_succeed"), ("beast", "_succeed"), ("dex", "_fail")], True, False)
+  assert (connection.commits, connection.rollbacks) == (0, 1)
+
+def test_single_transaction_is_committed_when_all_components_succeed():
+  connection = fake_connection()
+  db = create_database(connection)
+  db._succeed = lambda: None
+  db._run_components("upgrade", [("bdb", "_succeed"), ("beast", "_succeed"), ("dex", "_succeed")], True, False)
+  assert (connection.commits, connection.rollbacks) == (1, 0)
@@ -0,0 +1,46 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import os
+
+from baltrad.config import fleet
+
+def write(path, content):
+  with open(str(path), "w") as fp:
+    fp.write(content)
+  return str(path)
+
+def test_render_node_reports_unset_tomcat_memory(tmp_path, config_file):
+  overlay = write(tmp_path / "node1.properties", "baltrad.node.name = node1\n")
+  name, nodedir, nfiles, unset = fleet.render_node(config_file, overlay, str(tmp_path / "out"), fleet.fleet_sources())
+  assert (name, nodedir) == ("node1", str(tmp_path / "out" / "node1"))
+  assert "baltrad.tomcat.jvm.heap_max" in unset
+  with open(os.path.join(nodedir, "setenv.sh")) as fp:
+    assert "-Xmx" not in fp.read()
+
+def test_render_node_with_memory_in_overlay(tmp_path, config_file):
+  overlay = write(tmp_path / "node2.properties",
+                  "baltrad.node.name = node2\n"
+                  "baltrad.tomcat.jvm.heap_min = 1g\n"
+                  "baltrad.tomcat.jvm.heap_max = 3g\n"
+                  "baltrad.tomcat.jvm.max_direct_memory = 384m\n")
+  _, nodedir, _, unset = fleet.render_node(config_file, overlay, str(tmp_path / "out"), fleet.fleet_sources())
+  assert unset == []
+  with open(os.path.join(nodedir, "setenv.sh")) as fp:
+    assert "-Xms1g -Xmx3g -XX:MaxDirectMemorySize=384m" in fp.read()
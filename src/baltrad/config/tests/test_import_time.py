@@ -0,0 +1,40 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Modules that are only needed by some commands and must not be imported at startup
+HEAVY_MODULES = ["requests", "psycopg2", "rave_defines", "baltradcrypto", "baltrad.config.database", "baltrad.config.fleet", "difflib"]
+
+def imported_modules(module):
+  code = "import json, sys, %s; print(json.dumps(sorted(sys.modules)))"%module
+  env = dict(os.environ, PYTHONPATH=os.pathsep.join([p for p in sys.path if p]))
+  out = subprocess.check_output([sys.executable, "-c", code], env=env)
+  return set(json.loads(out.decode("utf-8").splitlines()[-1]))
+
+@pytest.mark.parametrize("module", ["baltrad.config.bltcmd", "baltrad.config.main"])
+def test_no_heavy_imports_at_startup(module):
+  modules = imported_modules(module)
+  assert module in modules
+  assert [m for m in HEAVY_MODULES if m in modules] == []
@@ -0,0 +1,41 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import os
+
+import pytest
+
+from baltrad.config import main
+
+def run(*argv):
+  args = main.create_parser().parse_args(list(argv))
+  args.func(args)
+
+def test_dbtune_dry_run_needs_no_outfile(config_file, capsys):
+  run("dbtune", "--conf=%s"%config_file, "--dry-run")
+  assert "shared_buffers = " in capsys.readouterr().out
+
+def test_dbtune_writes_outfile(tmp_path, config_file):
+  outfile = str(tmp_path / "baltrad.conf")
+  run("dbtune", "--conf=%s"%config_file, "--outfile=%s"%outfile)
+  assert os.path.exists(outfile)
+
+def test_dbtune_without_outfile_fails(config_file):
+  with pytest.raises(Exception, match="needs --outfile="):
+    run("dbtune", "--conf=%s"%config_file)
@@ -0,0 +1,128 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import os
+
+import pytest
+
+from baltrad.config import outputs
+
+def read(path):
+  with open(path) as fp:
+    return fp.read()
+
+def create(path, content):
+  with open(path, "w") as fp:
+    fp.write(content)
+  return str(path)
+
+def test_commit_replaces_all_files(tmp_path):
+  a = create(tmp_path / "a", "old a")
+  b = str(tmp_path / "b")
+  tx = outputs.output_transaction()
+  tx.write(a, "new a")
+  tx.write(b, "new b")
+  assert read(a) == "old a"
+  tx.commit()
+  assert (read(a), read(b)) == ("new a", "new b")
+  assert sorted(os.listdir(str(tmp_path))) == ["a", "b"]
+
+def test_failed_commit_restores_all_files(tmp_path, monkeypatch):
+  a = create(tmp_path / "a", "old a")
+  b = str(tmp_path / "b")
+  c = create(tmp_path / "c", "old c")
+  tx = outputs.output_transaction()
+  for path in (a, b, c):
+    tx.write(path, "new")
+
+  rename = os.rename
+  def failing_rename(src, dst):
+    if dst == c:
+      raise OSError("rename failed")
+    rename(src, dst)
+  monkeypatch.setattr(os, "rename", failing_rename)
+
+  with pytest.raises(OSError):
+    tx.commit()
+  assert (read(a), read(c)) == ("old a", "old c")
+  assert sorted(os.listdir(str(tmp_path))) == ["a", "c"]
+
+def test_rollback_removes_temporary_files(tmp_path):
+  a = create(tmp_path / "a", "old a")
+  tx = outputs.output_transaction()
+  tx.write(a, "new a")
+  tx.rollback()
+  assert read(a) == "old a"
+  assert os.listdir(str(tmp_path)) == ["a"]
+
+def test_write_atomic_keeps_mode(tmp_path):
+  a = create(tmp_path / "a", "old")
+  os.chmod(a, 0o640)
+  outputs.write_atomic(a, "new")
+  assert os.stat(a).st_mode & 0o7777 == 0o640
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="only root can change the owner of a file")
+def test_write_atomic_keeps_owner(tmp_path):
+  a = create(tmp_path / "a", "old")
+  os.chown(a, 4321, 4322)
+  outputs.write_atomic(a, "new")
+  st = os.stat(a)
+  assert (st.st_uid, st.st_gid) == (4321, 4322)
+  assert read(a) == "new"
+
+def test_output_writer_skips_unchanged_files(tmp_path):
+  a = create(tmp_path / "a", "same")
+  changes = []
+  f = outputs.output_file(a, lambda: "same", 0o600, lambda path, original, content: changes.append(path))
+  writer = outputs.output_writer([f])
+  writer.run()
+  assert writer.skipped == [f] and changes == []
+
+def test_output_state_is_saved_privately(tmp_path):
+  a = create(tmp_path / "a", "content")
+  statefile = str(tmp_path / "state" / "baltrad-config.state")
+  state = outputs.output_state(statefile)
+  state.update(a, outputs.content_digest("content"))
+  state.save()
+  assert os.stat(statefile).st_mode & 0o777 == 0o600
+  assert os.listdir(str(tmp_path / "state")) == ["baltrad-config.state"]
+  assert outputs.output_state(statefile).is_unchanged(a, outputs.content_digest("content"))
+
+def test_output_writer_notifies_changes_after_commit(tmp_path):
+  a = create(tmp_path / "a", "old")
+  changes = []
+  on_change = lambda path, original, content: changes.append((read(path), original, content))
+  writer = outputs.output_writer([outputs.output_file(a, lambda: "new", 0o600, on_change)])
+  writer.run()
+  assert changes == [("new", "old", "new")]
+
+def test_output_writer_does_not_notify_rolled_back_changes(tmp_path):
+  a = create(tmp_path / "a", "old")
+  changes = []
+  def failing_render():
+    raise Exception("render failed")
+  files = [
+    outputs.output_file(a, lambda: "new", 0o600, lambda path, original, content: changes.append(path)),
+    outputs.output_file(str(tmp_path / "b"), failing_render)
+  ]
+  writer = outputs.output_writer(files)
+  with pytest.raises(Exception, match="render failed"):
+    writer.run()
+  writer.notify_changes()
+  assert changes == [] and read(a) == "old"
@@ -0,0 +1,189 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import json
+import os
+
+import pytest
+
+from baltrad.config import propertyhandler
+
+def read(path):
+  with open(path) as fp:
+    return fp.read()
+
+def write(path, content):
+  with open(path, "w") as fp:
+    fp.write(content)
+  return str(path)
+
+def test_patch_config_file_keeps_includes_and_references(tmp_path, config_file):
+  os.rename(config_file, str(tmp_path / "base.properties"))
+  main = write(tmp_path / "node.properties",
+               "baltrad.include = base.properties\n"
+               "keys.dir = /srv/keys\n"
+               "baltrad.keyczar.root = ${keys.dir}\n")
+  a = propertyhandler.propertyhandler()
+  a.open_config_file(main)
+  assert a.keystore_root == "/srv/keys"
+
+  a.keystore_pwd = "changed"
+  a.patch_config_file(main, ["keystore_pwd"])
+  assert read(main) == ("baltrad.include = base.properties\n"
+                        "keys.dir = /srv/keys\n"
+                        "baltrad.keyczar.root = ${keys.dir}\n"
+                        "baltrad.keystore.password=changed\n")
+  b = propertyhandler.propertyhandler()
+  b.open_config_file(main)
+  assert (b.keystore_pwd, b.keystore_root) == ("changed", "/srv/keys")
+
+def test_patch_config_file_replaces_existing_keys(config_file):
+  a = propertyhandler.propertyhandler()
+  a.open_config_file(config_file)
+  before = read(config_file)
+  a.db_pool_size = 42
+  a.patch_config_file(config_file, ["db_pool_size"])
+  after = read(config_file)
+  assert after == before.replace("baltrad.db.pool.size = 10\n", "baltrad.db.pool.size=42\n")
+
+def test_resolve_properties_resolves_references():
+  properties = {"a":"${b}/x", "b":"${c}${c}", "c":"1", "d":"${undefined} ${c}", "e":"plain"}
+  assert propertyhandler.resolve_properties(properties) == {"a":"11/x", "b":"11", "c":"1", "d":"${undefined} 1", "e":"plain"}
+  assert properties["a"] == "${b}/x"
+
+def test_resolve_properties_without_references_copies():
+  properties = {"a":"1", "b":"$b"}
+  result = propertyhandler.resolve_properties(properties)
+  assert result == properties and result is not properties
+
+def test_resolve_properties_reports_cycles():
+  with pytest.raises(Exception, match="Cyclic property reference: a -> b -> a"):
+    propertyhandler.resolve_properties({"x":"${a}", "a":"${b}", "b":"${a}"})
+
+def test_post_config_depends_on_unknown_script(config_file):
+  write(config_file, read(config_file) + "baltrad.post.config.script.1 = /bin/true\nbaltrad.post.config.script.1.depends = 2\n")
+  with pytest.raises(Exception, match="baltrad.post.config.script.1.depends refers to script 2, but only 1 post config"):
+    propertyhandler.propertyhandler().open_config_file(config_file)
+
+def test_post_config_depends_not_a_number(config_file):
+  write(config_file, read(config_file) + "baltrad.post.config.script.1 = /bin/true\nbaltrad.post.config.script.1.depends = first\n")
+  with pytest.raises(Exception, match="baltrad.post.config.script.1.depends should be a comma separated list"):
+    propertyhandler.propertyhandler().open_config_file(config_file)
+
+def test_connection_budget_counts_sqla_overflow():
+  a = propertyhandler.propertyhandler()
+  a.bdb_server_backend_sqla_pool_size = 5
+  budget = a.analyze_connection_budget(max_connections=100)
+  bdb = [e for e in budget.entries if e[1] == "baltrad.bdb.server.backend.sqla.pool_size"]
+  assert [e[2] for e in bdb] == [5 + propertyhandler.SQLA_MAX_OVERFLOW]
+  assert budget.total_connections() == sum([e[2] for e in budget.entries])
+
+def test_connection_budget_oversubscribed():
+  a = propertyhandler.propertyhandler()
+  budget = a.analyze_connection_budget(max_connections=a.db_pool_size + a.bdb_server_backend_sqla_pool_size + 3)
+  assert budget.is_oversubscribed()
+
+def test_render_tomcat_setenv_without_resources_leaves_memory_to_the_jvm():
+  a = propertyhandler.propertyhandler()
+  content = a.render_tomcat_setenv()
+  assert "-Xmx" not in content and "-Xms" not in content and "MaxDirectMemorySize" not in content
+  assert "-XX:+UseG1GC" in content
+
+def test_render_tomcat_setenv_derives_memory_from_given_resources():
+  from baltrad.config import tune
+  a = propertyhandler.propertyhandler()
+  heap, direct = tune.tomcat_memory(a, tune.host_resources(4, 8*1024*tune.MB))
+  content = a.render_tomcat_setenv(tune.host_resources(4, 8*1024*tune.MB))
+  assert "-Xms%dm -Xmx%dm -XX:MaxDirectMemorySize=%dm"%(heap // tune.MB, heap // tune.MB, direct // tune.MB) in content
+
+def test_render_tomcat_setenv_uses_configured_memory():
+  from baltrad.config import tune
+  a = propertyhandler.propertyhandler()
+  a.tomcat_jvm_heap_min, a.tomcat_jvm_heap_max, a.tomcat_jvm_max_direct_memory = "1g", "2g", "256m"
+  assert a.unset_tomcat_memory_keys() == []
+  content = a.render_tomcat_setenv(tune.host_resources(64, 256*1024*tune.MB))
+  assert "-Xms1g -Xmx2g -XX:MaxDirectMemorySize=256m" in content
+
+def _snapshot(cachedir):
+  names = [n for n in os.listdir(cachedir) if n.endswith(".json")]
+  assert len(names) == 1
+  return os.path.join(cachedir, names[0])
+
+def _tamper(snapshotfile):
+  with open(snapshotfile) as fp:
+    snapshot = json.load(fp)
+  snapshot["values"]["nodename"] = "tampered"
+  with open(snapshotfile, "w") as fp:
+    json.dump(snapshot, fp)
+
+def test_load_cached_uses_snapshot_until_file_changes(tmp_path, config_file):
+  cachedir = str(tmp_path / "cache")
+  a = propertyhandler.load_cached(config_file, cachedir)
+  assert oct(os.stat(cachedir).st_mode & 0o777) == oct(0o700)
+  snapshotfile = _snapshot(cachedir)
+  _tamper(snapshotfile)
+
+  b = propertyhandler.load_cached(config_file, cachedir)
+  assert b.nodename == "tampered"
+  assert b.db_pool_size == a.db_pool_size and b.post_config_script_depends == a.post_config_script_depends
+  a.nodename = "tampered"
+  assert str(b) == str(a)
+
+  with open(config_file, "a") as fp:
+    fp.write("baltrad.node.name = changed\n")
+  assert propertyhandler.load_cached(config_file, cachedir).nodename == "changed"
+
+def test_load_cached_ignores_writable_cache_directory(tmp_path, config_file):
+  cachedir = str(tmp_path / "cache")
+  a = propertyhandler.load_cached(config_file, cachedir)
+  _tamper(_snapshot(cachedir))
+  os.chmod(cachedir, 0o777)
+  assert propertyhandler.load_cached(config_file, cachedir).nodename == a.nodename
+
+def test_load_cached_ignores_writable_snapshot(tmp_path, config_file):
+  cachedir = str(tmp_path / "cache")
+  a = propertyhandler.load_cached(config_file, cachedir)
+  snapshotfile = _snapshot(cachedir)
+  _tamper(snapshotfile)
+  os.chmod(snapshotfile, 0o666)
+  assert propertyhandler.load_cached(config_file, cachedir).nodename == a.nodename
+
+def test_load_cached_ignores_snapshot_with_missing_attributes(tmp_path, config_file):
+  cachedir = str(tmp_path / "cache")
+  propertyhandler.load_cached(config_file, cachedir)
+  snapshotfile = _snapshot(cachedir)
+  with open(snapshotfile) as fp:
+    snapshot = json.load(fp)
+  del snapshot["values"]["post_config_workers"]
+  with open(snapshotfile, "w") as fp:
+    json.dump(snapshot, fp)
+  assert propertyhandler.load_cached(config_file, cachedir).post_config_workers == 1
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="only root can change the owner of a file")
+def test_rewritten_files_keep_owner(setup_files):
+  a = propertyhandler.propertyhandler()
+  a.open_config_file(setup_files["conf"])
+  for name in ("conf", "dex", "ravedefines"):
+    os.chown(setup_files[name], 4321, 4322)
+  a.write_dex_properties(setup_files["dex"])
+  a.update_rave_defines(setup_files["ravedefines"], setup_files["bltnode"])
+  a.patch_config_file(setup_files["conf"], ["nodename"])
+  for name in ("conf", "dex", "ravedefines"):
+    st = os.stat(setup_files[name])
+    assert (st.st_uid, st.st_gid) == (4321, 4322)
@@ -0,0 +1,57 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import baltradutils.jprops
+
+from baltrad.config import propertyhandler
+
+@pytest.fixture(params=["real", "synthetic"])
+def properties_file(request, config_file, synthetic_config_file):
+  return config_file if request.param == "real" else synthetic_config_file
+
+def load(filename):
+  with open(filename, "r") as fp:
+    return baltradutils.jprops.load_properties(fp)
+
+##
+# The parse pass without reading the file
+def test_parse(benchmark, properties_file):
+  benchmark.group = "parse"
+  properties = load(properties_file)
+  values = benchmark(propertyhandler._parse_properties, properties)
+  assert values["nodename"] == propertyhandler.propertyhandler().nodename
+
+def test_resolve_properties(benchmark, properties_file):
+  benchmark.group = "resolve"
+  properties = load(properties_file)
+  assert benchmark(propertyhandler.resolve_properties, properties) == properties
+
+def test_open_config_file(benchmark, properties_file):
+  benchmark.group = "open_config_file"
+  benchmark(lambda: propertyhandler.propertyhandler().open_config_file(properties_file))
+
+def test_serialize(benchmark, properties_file):
+  benchmark.group = "serialize"
+  a = propertyhandler.propertyhandler()
+  a.open_config_file(properties_file)
+  assert benchmark(str, a) == str(propertyhandler.propertyhandler())
@@ -0,0 +1,55 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+from baltrad.config import rewriter
+
+def rewrite(r, text):
+  return "".join(r.rewrite_lines(text.splitlines(True)))
+
+def test_property_rewriter_replaces_values():
+  r = rewriter.property_rewriter({"node.name":"new", "node.name.alias":"alias"})
+  text = "# node.name=comment\nnode.name = old\n  node.name.alias=old\nnode.names=other\n"
+  assert rewrite(r, text) == "# node.name=comment\nnode.name=new\nnode.name.alias=alias\nnode.names=other\n"
+
+def test_property_rewriter_appends_missing_keys():
+  r = rewriter.property_rewriter({"a":"1", "b":"2"}, append_missing=True)
+  assert rewrite(r, "a=0") == "a=1\nb=2\n"
+  assert rewrite(rewriter.property_rewriter({"b":"2"}), "a=0\n") == "a=0\n"
+
+def test_render_file_leaves_the_file_untouched(tmp_path):
+  path = str(tmp_path / "dex.properties")
+  with open(path, "w") as fp:
+    fp.write("a=0\nc=3\n")
+  assert rewriter.render_file(rewriter.property_rewriter({"a":"1"}), path) == "a=1\nc=3\n"
+  with open(path) as fp:
+    assert fp.read() == "a=0\nc=3\n"
+
+def test_assignment_rewriter_replaces_top_level_assignments():
+  r = rewriter.assignment_rewriter({"PGF":"PGF = 2", "DEX_SPOE":"DEX_SPOE = \"new\"", "UNCHANGED":None}, append_missing=False)
+  text = "PGFs = 4\nPGF: int = 1\nif PGF == 1:\n  PGF = 3\nDEX_SPOE=\"old\"\nUNCHANGED = 1"
+  assert rewrite(r, text) == "PGFs = 4\nPGF = 2\nif PGF == 1:\n  PGF = 3\nDEX_SPOE = \"new\"\nUNCHANGED = 1"
+
+def test_assignment_rewriter_appends_missing_assignments():
+  r = rewriter.assignment_rewriter({"A":"A = 1", "B":"B = 2"})
+  assert rewrite(r, "A = 0") == "A = 1\n\n# Added by baltrad-config\nB = 2\n"
+
+def test_compiled_template_renders_known_placeholders():
+  t = rewriter.compiled_template("<a x=\"${x}\" y=\"${y}\">${x}</a>")
+  assert t.render({"x":"1"}) == "<a x=\"1\" y=\"${y}\">1</a>"
+  assert t.render({"x":"${y}", "y":"2"}) == "<a x=\"${y}\" y=\"2\">${y}</a>"
@@ -0,0 +1,104 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import io
+import os
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from baltrad.config import main
+from baltrad.config import propertyhandler
+from baltrad.config import rewriter
+from baltrad.config import sqlscript
+
+# The size of the files relative to a node, 100 shows how the cost grows with the size
+SCALES = [1, 100]
+
+@pytest.fixture
+def handler(setup_files):
+  a = propertyhandler.propertyhandler()
+  a.open_config_file(setup_files["conf"])
+  return a
+
+@pytest.mark.parametrize("setup_files", SCALES, indirect=True)
+def test_execute_post_config(benchmark, monkeypatch, setup_files, setup_args):
+  benchmark.group = "setup"
+  # The files are written as the current user, without changing the owner
+  monkeypatch.setattr(main, "get_owner", lambda a: (None, None))
+  benchmark(main.execute_post_config, setup_args)
+  with open(setup_files["dex"]) as fp:
+    assert "node.name=test.node\n" in fp.read()
+
+@pytest.mark.parametrize("setup_files", SCALES, indirect=True)
+def test_update_rave_defines(benchmark, setup_files, handler):
+  benchmark.group = "rave_defines"
+  benchmark(handler.update_rave_defines, setup_files["ravedefines"], setup_files["bltnode"])
+  with open(setup_files["ravedefines"]) as fp:
+    assert "DEX_NODENAME = \"test.node\"\n" in fp.read()
+
+@pytest.mark.parametrize("setup_files", SCALES, indirect=True)
+def test_write_dex_properties(benchmark, setup_files, handler):
+  benchmark.group = "dex_properties"
+  benchmark(handler.write_dex_properties, setup_files["dex"])
+
+@pytest.mark.parametrize("setup_files", SCALES, indirect=True)
+def test_update_application_context(benchmark, setup_files, handler):
+  benchmark.group = "application_context"
+  benchmark(handler.update_application_context, setup_files["appcontext"])
+
+@pytest.mark.parametrize("method, name", [
+  ("write_bltnode_properties", "bltnode"),
+  ("write_dex_db_properties", "dexdb"),
+  ("write_dex_fc_properties", "dexfc"),
+  ("write_dex_beast_properties", "dexbeast"),
+  ("write_tomcat_server_file", "server")
+])
+def test_write(benchmark, setup_files, handler, method, name):
+  benchmark.group = "write"
+  benchmark(getattr(handler, method), setup_files[name])
+  assert os.path.exists(setup_files[name])
+
+def test_render_tomcat_server_file(benchmark, handler):
+  benchmark.group = "server_xml"
+  assert handler.keystore_jks in benchmark(handler.render_tomcat_server_file)
+
+@pytest.mark.parametrize("nkeys", [10, 1000])
+def test_property_rewriter(benchmark, nkeys):
+  benchmark.group = "property_rewriter"
+  lines = ["key.%d=old\n"%i for i in range(10000)]
+  r = rewriter.property_rewriter(dict([("key.%d"%(i * 7), "new") for i in range(nkeys)]))
+  result = benchmark(lambda: list(r.rewrite_lines(lines)))
+  assert result[7] == "key.7=new\n"
+
+def test_assignment_rewriter(benchmark):
+  benchmark.group = "assignment_rewriter"
+  lines = ["NAME_%d = %d\n"%(i, i) for i in range(10000)]
+  r = rewriter.assignment_rewriter(dict([("NAME_%d"%(i * 7), "NAME_%d = 0"%(i * 7)) for i in range(1000)]))
+  result = benchmark(lambda: list(r.rewrite_lines(lines)))
+  assert result[7] == "NAME_7 = 0\n"
+
+def test_split_statements(benchmark):
+  benchmark.group = "split_statements"
+  script = "".join([
+    "-- table %d\nCREATE TABLE t%d (id integer, name text DEFAULT 'a;b');\n"
+    "CREATE FUNCTION f%d() RETURNS integer AS $$ BEGIN RETURN 1; END; $$ LANGUAGE plpgsql;\n"%(i, i, i) for i in range(2000)])
+  statements = benchmark(lambda: list(sqlscript.split_statements(io.StringIO(script))))
+  assert len(statements) == 4000
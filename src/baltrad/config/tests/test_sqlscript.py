@@ -0,0 +1,48 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+from baltrad.config import sqlscript
+
+def split(text, firstline=1):
+  return [(s.text, s.line, s.copy_data) for s in sqlscript.split_statements(text.splitlines(True), firstline)]
+
+def test_split_statements_removes_comments():
+  text = "-- header; not a statement\nSELECT 1; /* a; /* nested; */ comment */ SELECT 2;\n\nSELECT -- trailing;\n 3"
+  assert [s[0] for s in split(text)] == ["SELECT 1", "SELECT 2", "SELECT \n 3"]
+
+def test_split_statements_keeps_quoted_semicolons():
+  text = "INSERT INTO t VALUES ('a;b', 'it''s;', E'x\\';y');\nCREATE TABLE \"a;b\" (id integer);\n"
+  assert [s[0] for s in split(text)] == ["INSERT INTO t VALUES ('a;b', 'it''s;', E'x\\';y')", "CREATE TABLE \"a;b\" (id integer)"]
+
+def test_split_statements_handles_dollar_quotes():
+  text = "CREATE FUNCTION f() RETURNS integer AS $body$\nBEGIN\n  RETURN 1; -- $$;\nEND;\n$body$ LANGUAGE plpgsql;\nSELECT a$b; SELECT $$;$$;\n"
+  result = [s[0] for s in split(text)]
+  assert result == ["CREATE FUNCTION f() RETURNS integer AS $body$\nBEGIN\n  RETURN 1; -- $$;\nEND;\n$body$ LANGUAGE plpgsql", "SELECT a$b", "SELECT $$;$$"]
+
+def test_split_statements_reports_start_lines():
+  text = "\n-- comment\nSELECT 1;\n\nSELECT\n  2; SELECT 3;\n"
+  assert [s[1] for s in split(text, 10)] == [12, 14, 15]
+
+def test_split_statements_reads_copy_data():
+  text = "COPY t (a, b) FROM stdin;\n1\t'x;y'\n2\t\\N\n\\.\nSELECT 1;\n"
+  assert split(text) == [("COPY t (a, b) FROM stdin", 1, "1\t'x;y'\n2\t\\N\n"), ("SELECT 1", 5, None)]
+
+def test_batches_keep_copy_statements_apart():
+  statements = list(sqlscript.split_statements(["SELECT 1; SELECT 2; SELECT 3;\n", "COPY t FROM stdin;\n", "1\n", "\\.\n", "SELECT 4;\n"]))
+  assert [[s.text for s in b] for b in sqlscript.batches(statements, 2)] == [["SELECT 1", "SELECT 2"], ["SELECT 3"], ["COPY t FROM stdin"], ["SELECT 4"]]
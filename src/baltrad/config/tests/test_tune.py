@@ -0,0 +1,101 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import os
+
+import pytest
+
+from baltrad.config import propertyhandler
+from baltrad.config import tune
+
+def write(path, content):
+  os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+  with open(str(path), "w") as fp:
+    fp.write(content)
+  return str(path)
+
+def test_cgroup_v2_limits_of_parent_slice(tmp_path):
+  root = tmp_path / "cgroup"
+  write(root / "cgroup.controllers", "cpu memory\n")
+  write(root / "system.slice" / "baltrad.slice" / "memory.max", "2147483648\n")
+  write(root / "system.slice" / "baltrad.slice" / "cpu.max", "200000 100000\n")
+  write(root / "system.slice" / "baltrad.slice" / "tomcat.service" / "memory.max", "max\n")
+  write(root / "system.slice" / "baltrad.slice" / "tomcat.service" / "cpu.max", "max 100000\n")
+  procfile = write(tmp_path / "cgroup.proc", "0::/system.slice/baltrad.slice/tomcat.service\n")
+  cgroups = tune._read_proc_cgroup(procfile)
+
+  assert tune.host_resources._cgroup_memory_limit(str(root), cgroups) == 2147483648
+  assert tune.host_resources._cgroup_cpu_quota(str(root), cgroups) == 2.0
+
+def test_cgroup_v2_smallest_limit_is_used(tmp_path):
+  root = tmp_path / "cgroup"
+  write(root / "cgroup.controllers", "cpu memory\n")
+  write(root / "a" / "memory.max", "1073741824\n")
+  write(root / "a" / "b" / "memory.max", "4294967296\n")
+  procfile = write(tmp_path / "cgroup.proc", "0::/a/b\n")
+
+  assert tune.host_resources._cgroup_memory_limit(str(root), tune._read_proc_cgroup(procfile)) == 1073741824
+
+def test_cgroup_v1_limits(tmp_path):
+  root = tmp_path / "cgroup"
+  write(root / "memory" / "system.slice" / "memory.limit_in_bytes", "1073741824\n")
+  write(root / "memory" / "memory.limit_in_bytes", "9223372036854771712\n")
+  write(root / "cpu,cpuacct" / "system.slice" / "tomcat.service" / "cpu.cfs_quota_us", "150000\n")
+  write(root / "cpu,cpuacct" / "system.slice" / "tomcat.service" / "cpu.cfs_period_us", "100000\n")
+  procfile = write(tmp_path / "cgroup.proc",
+                   "4:memory:/system.slice/tomcat.service\n"
+                   "2:cpu,cpuacct:/system.slice/tomcat.service\n"
+                   "0::/system.slice/tomcat.service\n")
+  cgroups = tune._read_proc_cgroup(procfile)
+
+  assert tune.host_resources._cgroup_memory_limit(str(root), cgroups) == 1073741824
+  assert tune.host_resources._cgroup_cpu_quota(str(root), cgroups) == 1.5
+
+def test_no_cgroup_limits(tmp_path):
+  root = tmp_path / "cgroup"
+  write(root / "cgroup.controllers", "cpu memory\n")
+  procfile = write(tmp_path / "cgroup.proc", "0::/\n")
+  cgroups = tune._read_proc_cgroup(procfile)
+
+  assert tune.host_resources._cgroup_memory_limit(str(root), cgroups) is None
+  assert tune.host_resources._cgroup_cpu_quota(str(root), cgroups) is None
+
+def budget(a, tunings, max_connections):
+  return tune.apply_tunings(a, tunings).analyze_connection_budget(max_connections)
+
+def test_propose_fits_a_stock_postgresql_server():
+  a = propertyhandler.propertyhandler()
+  tunings = tune.propose(tune.host_resources(16, 64*1024*tune.MB), a)
+  b = budget(a, tunings, tune.DEFAULT_MAX_CONNECTIONS)
+  assert not b.is_oversubscribed()
+  assert b.total_connections() > b.available_connections() - 5
+  assert [t for t in tunings if t.attribute == "rave_pgfs"][0].value.isdigit()
+
+def test_propose_keeps_pools_that_fit_the_configured_max_connections():
+  a = propertyhandler.propertyhandler()
+  a.db_max_connections = 500
+  tunings = tune.propose(tune.host_resources(16, 64*1024*tune.MB), a)
+  values = dict([(t.attribute, t.value) for t in tunings])
+  assert (values["db_pool_size"], values["bdb_server_backend_sqla_pool_size"], values["rave_pgfs"]) == (48, 32, "15")
+  assert budget(a, tunings, 500).total_connections() == 105
+
+def test_propose_reports_too_few_connections():
+  a = propertyhandler.propertyhandler()
+  with pytest.raises(Exception, match="allows 9 connections"):
+    tune.propose(tune.host_resources(16, 64*1024*tune.MB), a, 12)
@@ -0,0 +1,75 @@
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import os
+
+from baltrad.config import outputs
+from baltrad.config import watch
+
+def read(path):
+  with open(path) as fp:
+    return fp.read()
+
+def set_property(config_file, key, value):
+  with open(config_file, "a") as fp:
+    fp.write("%s = %s\n"%(key, value))
+
+class failing_output(object):
+  def __init__(self):
+    self.fail = False
+
+  def render(self, text):
+    if self.fail:
+      raise IOError("source file is missing")
+    return text
+
+def create_watcher(tmp_path, config_file, failing):
+  nodefile = str(tmp_path / "node.txt")
+  poolfile = str(tmp_path / "pool.txt")
+  def create_outputs(a):
+    return [
+      outputs.output_file(nodefile, lambda: failing.render("%s\n"%a.nodename)),
+      outputs.output_file(poolfile, lambda: "%d\n"%a.db_pool_size)
+    ]
+  return watch.output_watcher(config_file, create_outputs, lambda a: (None, None)), nodefile, poolfile
+
+def test_reload_writes_only_affected_outputs(tmp_path, config_file):
+  watcher, nodefile, poolfile = create_watcher(tmp_path, config_file, failing_output())
+  watcher.start()
+  pool_mtime = os.stat(poolfile).st_mtime_ns
+
+  set_property(config_file, "baltrad.node.name", "node2")
+  watcher.reload()
+  assert read(nodefile) == "node2\n"
+  assert os.stat(poolfile).st_mtime_ns == pool_mtime
+
+def test_failed_regeneration_is_retried(tmp_path, config_file):
+  failing = failing_output()
+  watcher, nodefile, _ = create_watcher(tmp_path, config_file, failing)
+  watcher.start()
+  before = read(nodefile)
+
+  failing.fail = True
+  set_property(config_file, "baltrad.node.name", "node2")
+  watcher.reload()
+  assert read(nodefile) == before
+
+  failing.fail = False
+  watcher.reload()
+  assert read(nodefile) == "node2\n"
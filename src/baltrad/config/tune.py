@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import copy
+import os
+import re
+
+from baltrad.config import outputs
+from baltrad.config import propertyhandler
+from baltrad.config import rewriter
+
+MB = 1024*1024
+
+# The memory a PGF worker process is assumed to need when compositing
+PGF_WORKER_MEMORY = 512*MB
+
+# The memory used by the bdb server and other processes besides tomcat and the PGF workers
+OTHER_MEMORY = 512*MB
+
+# Largest heap proposed for tomcat, larger heaps give longer pauses for little gain
+MAX_TOMCAT_HEAP = 16*1024*MB
+
+# The max_connections of a stock postgresql server, used when baltrad.db.max_connections is not set
+DEFAULT_MAX_CONNECTIONS = 100
+
+# The pools that hold database connections and are scaled down when the proposal
+# does not fit the connections of the database server
+_CONNECTION_POOLS = ("db_pool_size", "bdb_server_backend_sqla_pool_size", "rave_pgfs")
+
+# Values above this are treated as "no limit" by cgroup v1
+_CGROUP_V1_UNLIMITED = 1 << 60
+
+def _read_first_line(filename):
+  try:
+    with open(filename, "r") as fp:
+      return fp.readline().strip()
+  except (IOError, OSError):
+    return None
+
+##
+# Reads the cgroups of the current process
+# @param procfile: the cgroup file of the process
+# @return dictionary controller -> cgroup path, the cgroup v2 path has the controller ""
+def _read_proc_cgroup(procfile):
+  result = {}
+  try:
+    with open(procfile, "r") as fp:
+      for line in fp:
+        parts = line.rstrip("\n").split(":", 2)
+        if len(parts) == 3:
+          for controller in parts[1].split(","):
+            result[controller] = parts[2]
+  except (IOError, OSError):
+    pass
+  return result
+
+##
+# @param mount: where the cgroup hierarchy is mounted
+# @param path: the cgroup path of the process
+# @return the cgroup directories from the one of the process up to the root of the hierarchy
+def _cgroup_dirs(mount, path):
+  parts = [p for p in path.split("/") if p]
+  while True:
+    yield os.path.join(mount, *parts)
+    if not parts:
+      return
+    parts.pop()
+
+##
+# @param cgroot: the cgroup file system root
+# @param controller: a cgroup v1 controller
+# @return where the hierarchy of the controller is mounted, e.g. cgroot/cpu,cpuacct
+def _cgroup_v1_mount(cgroot, controller):
+  if os.path.isdir(os.path.join(cgroot, controller)):
+    return os.path.join(cgroot, controller)
+  try:
+    for name in os.listdir(cgroot):
+      if controller in name.split(","):
+        return os.path.join(cgroot, name)
+  except (IOError, OSError):
+    pass
+  return os.path.join(cgroot, controller)
+
+##
+# The cpu and memory resources available to the node. Limits imposed by
+# cgroups (containers, systemd slices and services) and cpu affinity are taken
+# into account. The cgroup of the process is read from /proc/self/cgroup and the
+# smallest limit between it and the root of the hierarchy is used.
+#
+class host_resources(object):
+  ##
+  # Constructor
+  # @param cpus: the number of cpus that can be used
+  # @param memory: the memory in bytes that can be used
+  # @param notes: a list of strings describing where the values came from
+  def __init__(self, cpus, memory, notes=None):
+    self.cpus = cpus
+    self.memory = memory
+    self.notes = notes or []
+
+  ##
+  # Reads the resources of the current host
+  # @param cgroot: the cgroup file system root
+  # @param procfile: the file with the cgroups of the process
+  # @return a host_resources
+  @staticmethod
+  def detect(cgroot="/sys/fs/cgroup", procfile="/proc/self/cgroup"):
+    cgroups = _read_proc_cgroup(procfile)
+    notes = []
+    cpus = os.cpu_count() or 1
+    notes.append("%d cpu(s) online"%cpus)
+    if hasattr(os, "sched_getaffinity"):
+      affinity = len(os.sched_getaffinity(0))
+      if affinity < cpus:
+        cpus = affinity
+        notes.append("cpu affinity limits to %d cpu(s)"%cpus)
+
+    quota = host_resources._cgroup_cpu_quota(cgroot, cgroups)
+    if quota is not None and quota < cpus:
+      cpus = max(1, int(quota))
+      notes.append("cgroup cpu quota limits to %.1f cpu(s)"%quota)
+
+    memory = host_resources._meminfo_total()
+    if memory is not None:
+      notes.append("%d MB memory"%(memory // MB))
+    limit = host_resources._cgroup_memory_limit(cgroot, cgroups)
+    if limit is not None and (memory is None or limit < memory):
+      memory = limit
+      notes.append("cgroup memory limit %d MB"%(memory // MB))
+    if memory is None:
+      memory = 2048*MB
+      notes.append("memory could not be determined, assuming %d MB"%(memory // MB))
+
+    return host_resources(cpus, memory, notes)
+
+  @staticmethod
+  def _meminfo_total():
+    try:
+      with open("/proc/meminfo", "r") as fp:
+        for line in fp:
+          if line.startswith("MemTotal:"):
+            return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+      pass
+    return None
+
+  @staticmethod
+  def _cgroup_cpu_quota(cgroot, cgroups):
+    quotas = []
+    if os.path.exists(os.path.join(cgroot, "cgroup.controllers")):
+      for d in _cgroup_dirs(cgroot, cgroups.get("", "/")):
+        v2 = _read_first_line(os.path.join(d, "cpu.max"))
+        if v2 is not None:
+          quota, period = (v2.split() + ["100000"])[:2]
+          if quota != "max":
+            quotas.append(float(quota) / float(period))
+    else:
+      for d in _cgroup_dirs(_cgroup_v1_mount(cgroot, "cpu"), cgroups.get("cpu", "/")):
+        quota = _read_first_line(os.path.join(d, "cpu.cfs_quota_us"))
+        period = _read_first_line(os.path.join(d, "cpu.cfs_period_us"))
+        if quota is not None and period is not None and int(quota) > 0:
+          quotas.append(float(quota) / float(period))
+    return min(quotas) if quotas else None
+
+  @staticmethod
+  def _cgroup_memory_limit(cgroot, cgroups):
+    limits = []
+    if os.path.exists(os.path.join(cgroot, "cgroup.controllers")):
+      for d in _cgroup_dirs(cgroot, cgroups.get("", "/")):
+        v2 = _read_first_line(os.path.join(d, "memory.max"))
+        if v2 is not None and v2 != "max":
+          limits.append(int(v2))
+    else:
+      for d in _cgroup_dirs(_cgroup_v1_mount(cgroot, "memory"), cgroups.get("memory", "/")):
+        v1 = _read_first_line(os.path.join(d, "memory.limit_in_bytes"))
+        if v1 is not None and int(v1) < _CGROUP_V1_UNLIMITED:
+          limits.append(int(v1))
+    return min(limits) if limits else None
+
+##
+# A proposed value for one property
+#
+class tuning(object):
+  ##
+  # Constructor
+  # @param attribute: the propertyhandler attribute
+  # @param value: the proposed value
+  # @param reason: why the value was chosen
+  def __init__(self, attribute, value, reason):
+    self.definition = _DEFINITIONS[attribute]
+    self.attribute = attribute
+    self.value = value
+    self.reason = reason
+
+  ##
+  # @return the key in the property file
+  def key(self):
+    return self.definition.key
+
+  ##
+  # @return the value as written to the property file
+  def text(self):
+    v = self.value
+    if self.definition.format is not None:
+      return self.definition.format(v)
+    return "%s"%v
+
+_DEFINITIONS = dict([(p.attribute, p) for p in propertyhandler.PROPERTIES])
+
+def _clamp(v, lo, hi):
+  return max(lo, min(hi, v))
+
+##
+# Proposes values for the thread, process and connection pools. The connection
+# pools are kept within the connections the database server allows.
+# @param res: the host_resources
+# @param a: the propertyhandler the proposal is for
+# @param max_connections: the max_connections of the database server, if None
+# baltrad.db.max_connections or DEFAULT_MAX_CONNECTIONS is used
+# @param reserved_connections: connections reserved for superusers
+# @return a list of tuning
+def propose(res, a, max_connections=None, reserved_connections=3):
+  cpus = res.cpus
+  result = []
+
+  pgfs = _clamp(min(cpus - 1, res.memory // PGF_WORKER_MEMORY), 1, 64)
+  result.append(tuning("rave_pgfs", "%d"%pgfs,
+    "one PGF worker per cpu leaving one cpu for tomcat and postgres, at most one per %d MB memory"%(PGF_WORKER_MEMORY // MB)))
+
+  tileprocs = _clamp(cpus, 1, 32)
+  result.append(tuning("rave_pgf_tiledcompositing_nrprocesses", tileprocs,
+    "tiled compositing is cpu bound, one process per cpu"))
+
+  threads = _clamp(2 * cpus, 4, 64)
+  result.append(tuning("bdb_server_cherrypy_threads", threads,
+    "bdb requests mostly wait for database and disk, two threads per cpu"))
+  result.append(tuning("bdb_server_backend_sqla_pool_size", threads,
+    "one database connection per bdb server thread"))
+  result.append(tuning("bdb_client_rest_maxconnections", _clamp(2 * threads, 20, 128),
+    "twice the number of bdb server threads so that clients do not wait for a free connection"))
+
+  executors = _clamp(2 * cpus, 4, 64)
+  result.append(tuning("beast_manager_number_executors", executors,
+    "message handling mostly waits for I/O, two executors per cpu"))
+
+  publishers = _clamp(cpus, 2, 32)
+  result.append(tuning("beast_pooled_publisher_pool_core_size", _clamp(cpus // 2, 1, 16),
+    "keep half of the cpus ready for publishing"))
+  result.append(tuning("beast_pooled_publisher_pool_max_size", publishers,
+    "publishing is network bound, up to one publisher per cpu"))
+
+  result.append(tuning("baltrad_framepublisher_min_poolsize", 1,
+    "one idle frame publisher is enough"))
+  result.append(tuning("baltrad_framepublisher_max_poolsize", publishers,
+    "up to one frame publisher per cpu"))
+
+  result.append(tuning("db_pool_size", _clamp(executors + publishers, 10, 128),
+    "every message executor and publisher may hold a dex database connection"))
+
+  if max_connections is None:
+    max_connections = a.db_max_connections or DEFAULT_MAX_CONNECTIONS
+  fit_connection_budget(a, result, max_connections, reserved_connections)
+  return result
+
+##
+# @param a: the propertyhandler
+# @param tunings: a list of tuning
+# @return a copy of a with the tunings applied
+def apply_tunings(a, tunings):
+  tuned = copy.copy(a)
+  for t in tunings:
+    setattr(tuned, t.attribute, t.value)
+  return tuned
+
+##
+# Scales the proposed connection pools down until the node fits the available
+# connections of the database server. Every pool keeps at least one connection.
+# @param a: the propertyhandler the tunings are for
+# @param tunings: the list of tuning, modified in place
+# @param max_connections: the max_connections of the database server
+# @param reserved_connections: connections reserved for superusers
+# @raise Exception: if the connections that are not scaled already exceed the budget
+def fit_connection_budget(a, tunings, max_connections, reserved_connections=3):
+  budget = apply_tunings(a, tunings).analyze_connection_budget(max_connections, reserved_connections)
+  if not budget.is_oversubscribed():
+    return
+  pools = [t for t in tunings if t.attribute in _CONNECTION_POOLS and (a.with_rave or t.attribute != "rave_pgfs")]
+  sizes = [int(t.value) for t in pools]
+  room = budget.available_connections() - (budget.total_connections() - sum(sizes))
+  if room < len(pools):
+    raise Exception("The database server allows %d connections for the node, too few for the pools %s"%(
+      budget.available_connections(), ", ".join([t.key() for t in pools])))
+
+  scaled = [max(1, size * room // sum(sizes)) for size in sizes]
+  while sum(scaled) > room:
+    i = scaled.index(max(scaled))
+    scaled[i] = scaled[i] - 1
+  for t, size, new in zip(pools, sizes, scaled):
+    if new < size:
+      t.value = new if isinstance(t.value, int) else "%d"%new
+      t.reason = "%s, scaled down from %d to fit %d available database connections"%(t.reason, size, budget.available_connections())
+
+##
+# Derives the tomcat heap and direct memory sizes. The heap gets half of the
+# memory that is not used by the PGF workers and the other processes, but never
+# less than what the configured thread and connection pools need.
+# @param a: the propertyhandler
+# @param res: the host_resources
+# @return a tuple (heap size, max direct memory size) in bytes
+def tomcat_memory(a, res):
+  threads = a.tomcat_executor_max_threads + a.beast_manager_number_executors + \
+            a.beast_pooled_publisher_pool_max_size + a.baltrad_framepublisher_max_poolsize
+  needed = 256*MB + threads * 2*MB + a.db_pool_size * MB
+
+  available = res.memory - OTHER_MEMORY
+  if a.with_rave:
+    try:
+      available -= int(a.rave_pgfs) * PGF_WORKER_MEMORY
+    except ValueError:
+      pass
+
+  heap = max(needed, min(available // 2, MAX_TOMCAT_HEAP))
+  heap = min(heap, res.memory * 3 // 4)
+  heap = heap // MB * MB
+  return (heap, max(64*MB, heap // 8 // MB * MB))
+
+##
+# Proposes the tomcat heap and direct memory sizes. Writing them to the property
+# file makes setenv.sh independent of the host it is rendered on.
+# @param a: the propertyhandler with the pool sizes that will be used
+# @param res: the host_resources
+# @return a list of tuning
+def propose_tomcat_memory(a, res):
+  heap, direct = tomcat_memory(a, res)
+  reason = "half of the memory not used by the PGF workers and other processes, at most %d MB"%(MAX_TOMCAT_HEAP // MB)
+  return [
+    tuning("tomcat_jvm_heap_min", "%dm"%(heap // MB), "same as the maximum heap so that the heap is not resized"),
+    tuning("tomcat_jvm_heap_max", "%dm"%(heap // MB), reason),
+    tuning("tomcat_jvm_max_direct_memory", "%dm"%(direct // MB), "an eighth of the heap, at least 64 MB")
+  ]
+
+##
+# Writes the proposed values to the property file. Existing keys are replaced
+# and missing keys appended.
+# @param config_file: the property file
+# @param tunings: the list of tuning
+def patch_config_file(config_file, tunings):
+  values = {}
+  for t in tunings:
+    values[t.key()] = t.text()
+  outputs.write_atomic(config_file, rewriter.render_file(rewriter.property_rewriter(values, append_missing=True), config_file))
+
+##
+# A proposed postgresql server setting
+#
+class pg_setting(object):
+  ##
+  # Constructor
+  # @param name: the postgresql parameter
+  # @param value: the value as written to postgresql.conf
+  # @param reason: why the value was chosen
+  def __init__(self, name, value, reason):
+    self.name = name
+    self.value = value
+    self.reason = reason
+
+def _pg_size(v):
+  if v % (1024*MB) == 0:
+    return "%dGB"%(v // (1024*MB))
+  return "%dMB"%(v // MB)
+
+##
+# Proposes postgresql server settings for the node. The memory of the host is
+# assumed to be shared by postgresql and the node.
+# @param a: the propertyhandler
+# @param res: the host_resources
+# @return a list of pg_setting
+def propose_postgresql(a, res):
+  memory = res.memory
+  dbstorage = a.bdb_server_backend_sqla_storage_type == "db"
+  result = []
+
+  budget = a.analyze_connection_budget()
+  max_connections = budget.total_connections() + budget.reserved_connections
+  max_connections = max(20, max_connections + max(10, max_connections // 10))
+  result.append(pg_setting("max_connections", "%d"%max_connections,
+    "%d connections from the node pools, %d reserved for superusers and headroom for maintenance"%(budget.total_connections(), budget.reserved_connections)))
+
+  if dbstorage:
+    shared_buffers = _clamp(memory // 4 // MB * MB, 128*MB, 16*1024*MB)
+    reason = "files are stored in the database (storage type db), 1/4 of the memory"
+  else:
+    shared_buffers = _clamp(memory * 15 // 100 // MB * MB, 128*MB, 8*1024*MB)
+    reason = "files are stored in the file system (storage type fs) and need the page cache, 15% of the memory"
+  result.append(pg_setting("shared_buffers", _pg_size(shared_buffers), reason))
+
+  if dbstorage:
+    cache = memory * 3 // 4
+  else:
+    cache = memory // 2
+  result.append(pg_setting("effective_cache_size", _pg_size(cache // MB * MB),
+    "shared buffers and the page cache available for database pages"))
+
+  work_mem = _clamp((memory - shared_buffers) // (3 * max_connections) // MB * MB, 4*MB, 256*MB)
+  result.append(pg_setting("work_mem", _pg_size(work_mem),
+    "the memory not used by shared buffers, split over three sorts per connection"))
+
+  result.append(pg_setting("maintenance_work_mem", _pg_size(_clamp(memory // 16 // MB * MB, 64*MB, 2*1024*MB)),
+    "1/16 of the memory for vacuum and index builds"))
+
+  result.append(pg_setting("wal_buffers", "16MB", "enough for the write rate of a node"))
+  if dbstorage:
+    result.append(pg_setting("max_wal_size", "4GB", "file content is written to the database, avoid checkpoints driven by wal volume"))
+    result.append(pg_setting("min_wal_size", "1GB", "keep wal segments for bursts of incoming files"))
+  else:
+    result.append(pg_setting("max_wal_size", "1GB", "only metadata is written to the database"))
+    result.append(pg_setting("min_wal_size", "256MB", "keep wal segments for bursts of incoming files"))
+  result.append(pg_setting("checkpoint_timeout", "15min", "fewer checkpoints and full page writes"))
+  result.append(pg_setting("checkpoint_completion_target", "0.9", "spread the checkpoint writes"))
+  return result
+
+##
+# @param settings: a list of pg_setting
+# @return the content of the postgresql include file
+def render_postgresql_conf(settings):
+  s = []
+  s.append("# Generated by baltrad-config dbtune, changes will be overwritten\n")
+  for p in settings:
+    s.append("\n# %s\n"%p.reason)
+    s.append("%s = %s\n"%(p.name, p.value))
+  return "".join(s)
+
+_PG_UNITS = {"kB":1024, "MB":MB, "GB":1024*MB, "TB":1024*1024*MB, "ms":1, "s":1000, "min":60000, "h":3600000, "d":86400000}
+_PG_VALUE_PATTERN = re.compile(r"^\s*([0-9.]+)\s*([A-Za-z]*)\s*$")
+
+##
+# @param value: a postgresql setting value like 512MB, 1GB or 15min
+# @return the value in bytes or milliseconds for values with unit, otherwise the value as is
+def normalize_pg_value(value):
+  m = _PG_VALUE_PATTERN.match(value)
+  if m is None or (m.group(2) and m.group(2) not in _PG_UNITS):
+    return value.strip()
+  return float(m.group(1)) * _PG_UNITS.get(m.group(2), 1)
+
+##
+# Compares the proposed settings with what the server uses
+# @param settings: a list of pg_setting
+# @param show: function returning the current value of a setting, e.g. baltrad_database.show_setting
+# @return a list of (pg_setting, current value) for the settings that differ
+def verify_postgresql(settings, show):
+  result = []
+  for p in settings:
+    current = show(p.name)
+    if normalize_pg_value(current) != normalize_pg_value(p.value):
+      result.append((p, current))
+  return result
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+'''
+Copyright (C) 2021 - Swedish Meteorological and Hydrological Institute (SMHI)
+
+This file is part of baltrad-config.
+
+baltrad-config is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+baltrad-config is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with baltrad-config.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+from baltrad.config import outputs
+from baltrad.config import propertyhandler
+
+logger = logging.getLogger("baltrad.config.watch")
+
+_ATTRIBUTES = dict([(p.attribute, p.key) for p in propertyhandler.PROPERTIES])
+
+##
+# A propertyhandler that records which properties are read. Used for finding
+# out which properties an output depends on by rendering it.
+#
+class tracing_propertyhandler(propertyhandler.propertyhandler):
+  ##
+  # Creates a tracing copy of a loaded propertyhandler
+  # @param a: the propertyhandler
+  # @return a tracing_propertyhandler with the same values
+  @staticmethod
+  def create(a):
+    t = tracing_propertyhandler.__new__(tracing_propertyhandler)
+    t.__dict__.update(a.__dict__)
+    t.__dict__["accessed"] = set()
+    return t
+
+  def __getattribute__(self, name):
+    if name in _ATTRIBUTES:
+      object.__getattribute__(self, "__dict__")["accessed"].add(name)
+    return object.__getattribute__(self, name)
+
+##
+# @param a: the propertyhandler
+# @param b: another propertyhandler
+# @return the attributes of the properties that differ between a and b
+def changed_attributes(a, b):
+  return set([attr for attr in _ATTRIBUTES if getattr(a, attr) != getattr(b, attr)])
+
+##
+# Keeps the outputs of a node up to date with the configuration file. Every
+# output is rendered with a tracing_propertyhandler, which gives an index from
+# property to the outputs that read it. When the configuration changes, only
+# the outputs that read a changed property are rendered and written again and
+# the index of those outputs is updated. Since a property that is not read
+# under the current values can not affect the output, the index is exact.
+#
+class output_watcher(object):
+  ##
+  # Constructor
+  # @param configfile: the configuration file
+  # @param create_outputs: function (propertyhandler) -> list of outputs.output_file
+  # @param owner: function (propertyhandler) -> (uid, gid), uid and gid may be None
+  def __init__(self, configfile, create_outputs, owner):
+    self.configfile = configfile
+    self.create_outputs = create_outputs
+    self.owner = owner
+    self.handler = None
+    self.index = {}
+
+  ##
+  # @return the files the configuration was read from
+  def watched_files(self):
+    return list(self.handler.loaded_files)
+
+  def _load(self):
+    a = propertyhandler.propertyhandler()
+    a.open_config_file(self.configfile)
+    return a
+
+  ##
+  # Writes the outputs whose paths are in paths, or all outputs if paths is None,
+  # and updates the index for them
+  def _regenerate(self, a, paths=None):
+    tracer = tracing_propertyhandler.create(a)
+    files = [f for f in self.create_outputs(tracer) if paths is None or f.path in paths]
+    traced = []
+    for f in files:
+      traced.append(outputs.output_file(f.path, self._traced_render(tracer, f), f.mode, f.on_change))
+    uid, gid = self.owner(a)
+    writer = outputs.output_writer(traced, None, uid, gid)
+    writer.run()
+    return writer
+
+  def _traced_render(self, tracer, f):
+    def render():
+      tracer.accessed.clear()
+      content = f.render()
+      for attr in list(self.index):
+        self.index[attr].discard(f.path)
+      for attr in tracer.accessed:
+        self.index.setdefault(attr, set()).add(f.path)
+      return content
+    return render
+
+  ##
+  # Loads the configuration and writes all outputs
+  def start(self):
+    starttime = time.time()
+    self.handler = self._load()
+    writer = self._regenerate(self.handler)
+    logger.info("Wrote %d file(s) in %.3fs, watching %s", len(writer.written), time.time() - starttime, ", ".join(self.watched_files()))
+
+  ##
+  # @param attributes: changed propertyhandler attributes
+  # @return the paths of the outputs that read any of the attributes
+  def affected_outputs(self, attributes):
+    result = set()
+    for attr in attributes:
+      result.update(self.index.get(attr, ()))
+    return result
+
+  ##
+  # Reloads the configuration and writes the outputs affected by the changes
+  def reload(self):
+    starttime = time.time()
+    try:
+      a = self._load()
+    except Exception as e:
+      logger.error("Could not read %s, keeping the current outputs: %s", self.configfile, e)
+      return
+    changed = changed_attributes(self.handler, a)
+    paths = self.affected_outputs(changed)
+    if not changed:
+      self.handler = a
+      logger.info("No property changed")
+      return
+    keys = ", ".join(sorted([_ATTRIBUTES[attr] for attr in changed]))
+    if not paths:
+      self.handler = a
+      logger.info("Changed %s, no output affected", keys)
+      return
+    try:
+      writer = self._regenerate(a, paths)
+    except Exception as e:
+      # The previous configuration is kept so that the change is retried on the next reload
+      logger.error("Failed to regenerate %s, retrying on the next change: %s", ", ".join(sorted(paths)), e)
+      return
+    self.handler = a
+    logger.info("Changed %s, wrote %s in %.3fs", keys, ", ".join([f.path for f, _ in writer.written]) or "nothing", time.time() - starttime)
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+##
+# Waits for changes of a number of files with inotify. The directories are
+# watched so that files replaced by a rename, as many editors do, are noticed.
+#
+class inotify_waiter(object):
+  def __init__(self):
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    self._add_watch = libc.inotify_add_watch
+    self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+    if self._fd < 0:
+      raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    self._watches = {}
+
+  ##
+  # @param files: the files to watch, replaces the previously watched files
+  def watch(self, files):
+    self._names = set([os.path.abspath(f) for f in files])
+    for dirname in set([os.path.dirname(f) for f in self._names]):
+      if dirname not in self._watches.values():
+        wd = self._add_watch(self._fd, dirname.encode("utf-8"), _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE)
+        if wd < 0:
+          raise OSError(ctypes.get_errno(), "inotify_add_watch failed for %s"%dirname)
+        self._watches[wd] = dirname
+
+  def _read_events(self):
+    names = set()
+    while True:
+      try:
+        data = os.read(self._fd, 65536)
+      except OSError as e:
+        if e.errno == errno.EAGAIN:
+          return names
+        raise
+      offset = 0
+      while offset < len(data):
+        wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+        offset += _EVENT_HEADER.size
+        name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "replace")
+        offset += length
+        if wd in self._watches:
+          names.add(os.path.join(self._watches[wd], name))
+
+  ##
+  # Blocks until one of the files has changed. Events arriving within settle
+  # seconds of each other are treated as one change.
+  # @param settle: the time in seconds to wait for more events
+  def wait(self, settle=0.2):
+    while True:
+      select.select([self._fd], [], [])
+      changed = self._read_events()
+      while select.select([self._fd], [], [], settle)[0]:
+        changed.update(self._read_events())
+      if changed.intersection(self._names):
+        return
+
+  def close(self):
+    os.close(self._fd)
+
+##
+# Waits for changes of a number of files by comparing their mtime and size,
+# used where inotify is not available.
+#
+class polling_waiter(object):
+  ##
+  # Constructor
+  # @param interval: seconds between the checks
+  def __init__(self, interval=2.0):
+    self._interval = interval
+    self._signatures = {}
+
+  def _signature(self, f):
+    try:
+      st = os.stat(f)
+      return (st.st_mtime_ns, st.st_size, st.st_ino)
+    except OSError:
+      return None
+
+  def watch(self, files):
+    self._signatures = dict([(f, self._signature(f)) for f in files])
+
+  def wait(self, settle=0.2):
+    while True:
+      time.sleep(self._interval)
+      for f in self._signatures:
+        if self._signature(f) != self._signatures[f]:
+          time.sleep(settle)
+          return
+
+  def close(self):
+    pass
+
+##
+# @param poll_interval: if set, polling is used instead of inotify
+# @return an inotify_waiter, or a polling_waiter if inotify is not available
+def create_waiter(poll_interval=None):
+  if poll_interval is None:
+    try:
+      return inotify_waiter()
+    except (OSError, AttributeError) as e:
+      logger.warning("inotify is not available (%s), polling every 2 seconds", e)
+      poll_interval = 2.0
+  return polling_waiter(poll_interval)
+
+##
+# Writes all outputs and then regenerates the affected outputs each time the
+# configuration file or one of its includes changes. Runs until interrupted.
+# @param watcher: the output_watcher
+# @param waiter: the inotify_waiter or polling_waiter
+def run(watcher, waiter):
+  watcher.start()
+  try:
+    while True:
+      waiter.watch(watcher.watched_files())
+      waiter.wait()
+      watcher.reload()
+  finally:
+    waiter.close()